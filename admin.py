@@ -3,13 +3,14 @@ from aiogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, C
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State
 from aiogram import Bot
-from db import DB_PATH, get_categories, add_category, delete_category
+from aiogram.exceptions import TelegramAPIError, TelegramNetworkError, TelegramServerError
+from db import pool, get_categories, add_category, delete_category, get_stats
+from catalog import reload_catalog
+from broadcast import broadcaster
 import aiosqlite
-from config import ADMIN_ID
+from config import ADMIN_ID, ADMIN_PAGE_SIZE
 import logging
-from datetime import datetime, timedelta
 import asyncio
-#from bot import send_message_with_retry
 
 router = Router()
 
@@ -36,18 +37,37 @@ class AdminStates(StatesGroup):
 
 
 async def edit_message_with_retry(message: Message, text: str, reply_markup=None, parse_mode=None, max_attempts=3):
-    """Редактирование сообщения с повторными попытками"""
+    """Редактирование сообщения с повтором при сетевых ошибках (флуд-контроль - в RateLimitMiddleware)"""
     for attempt in range(max_attempts):
         try:
             await message.edit_text(text, reply_markup=reply_markup, parse_mode=parse_mode)
             return True
-        except Exception as e:
+        except (TelegramNetworkError, TelegramServerError) as e:
             logging.error(f"Failed to edit message: {e}, attempt {attempt + 1}/{max_attempts}")
             if attempt == max_attempts - 1:
                 return False
-            await asyncio.sleep(1)
+            await asyncio.sleep(2 ** attempt)
+        except TelegramAPIError as e:
+            # Сообщение не изменилось, удалено и т.п. - повтор не поможет
+            logging.error(f"Failed to edit message: {e}")
+            return False
     return False
 
+async def send_message_with_retry(bot: Bot, chat_id: int, text: str, max_attempts=3, **kwargs):
+    """Отправка сообщения с повтором при сетевых ошибках (флуд-контроль - в RateLimitMiddleware)"""
+    for attempt in range(max_attempts):
+        try:
+            return await bot.send_message(chat_id, text, **kwargs)
+        except (TelegramNetworkError, TelegramServerError) as e:
+            logging.error(f"Failed to send message: {e}, attempt {attempt + 1}/{max_attempts}")
+            if attempt == max_attempts - 1:
+                return None
+            await asyncio.sleep(2 ** attempt)
+        except TelegramAPIError as e:
+            logging.error(f"Failed to send message: {e}")
+            return None
+    return None
+
 @router.message(F.text == "Админ-панель")
 async def admin_command(message: Message, state: FSMContext):
     if message.from_user.id != ADMIN_ID:
@@ -94,6 +114,7 @@ async def add_category_start(callback: CallbackQuery, state: FSMContext):
 async def add_category_name(message: Message, state: FSMContext):
     name = message.text.strip()
     if await add_category(name):
+        await reload_catalog()
         await send_message_with_retry(message.bot, message.chat.id, f"Категория '{name}' добавлена!")
     else:
         await send_message_with_retry(message.bot, message.chat.id, f"Категория '{name}' уже существует!")
@@ -107,10 +128,10 @@ async def add_category_name(message: Message, state: FSMContext):
 @router.callback_query(F.data.startswith("view_cat_"), AdminStates.MANAGE_CATEGORIES)
 async def view_category(callback: CallbackQuery, state: FSMContext):
     category_id = int(callback.data.split("_")[2])
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         cursor = await db.execute("SELECT name FROM categories WHERE id = ?", (category_id,))
         category_name = (await cursor.fetchone())[0]
-        subcategories = await get_categories(category_id)
+    subcategories = await get_categories(category_id)
     
     kb_buttons = [[InlineKeyboardButton(text=subcat[1], callback_data=f"view_subcat_{subcat[0]}")] for subcat in subcategories]
     kb_buttons.append([InlineKeyboardButton(text="Добавить подкатегорию", callback_data=f"add_subcategory_{category_id}")])
@@ -138,6 +159,7 @@ async def add_subcategory_name(message: Message, state: FSMContext):
     category_id = data["category_id"]
     name = message.text.strip()
     if await add_category(name, category_id):
+        await reload_catalog()
         await send_message_with_retry(message.bot, message.chat.id, f"Подкатегория '{name}' добавлена!")
     else:
         await send_message_with_retry(message.bot, message.chat.id, f"Подкатегория '{name}' уже существует!")
@@ -152,6 +174,7 @@ async def add_subcategory_name(message: Message, state: FSMContext):
 async def delete_category_start(callback: CallbackQuery, state: FSMContext):
     category_id = int(callback.data.split("_")[2])
     if await delete_category(category_id):
+        await reload_catalog()
         await edit_message_with_retry(
             callback.message,
             "Категория удалена!",
@@ -346,39 +369,42 @@ async def add_product_delivery(message: Message, state: FSMContext):
         )
         return
     
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         cursor = await db.execute(
             "SELECT COUNT(*) FROM products WHERE name = ? AND category_id = ? AND subcategory_id = ?",
             (data["name"], data["category_id"], data.get("subcategory_id"))
         )
-        if (await cursor.fetchone())[0] > 0:
-            await send_message_with_retry(
-                message.bot,
-                message.chat.id,
-                "Такой товар уже существует!",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="Назад", callback_data="back_to_admin")]
-                ])
-            )
-            await state.clear()
-            return
-        await db.execute(
-            """
-            INSERT INTO products (name, desc, price, category_id, subcategory_id, delivery_file, media)
-            VALUES (?, ?, ?, ?, ?, ?, ?)
-            """,
-            (
-                data["name"],
-                data.get("desc"),
-                data["price"],
-                data["category_id"],
-                data.get("subcategory_id"),
-                delivery_file,
-                data.get("media")
+        exists = (await cursor.fetchone())[0] > 0
+        if not exists:
+            await db.execute(
+                """
+                INSERT INTO products (name, desc, price, category_id, subcategory_id, delivery_file, media)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (
+                    data["name"],
+                    data.get("desc"),
+                    data["price"],
+                    data["category_id"],
+                    data.get("subcategory_id"),
+                    delivery_file,
+                    data.get("media")
+                )
             )
+    
+    if exists:
+        await send_message_with_retry(
+            message.bot,
+            message.chat.id,
+            "Такой товар уже существует!",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="Назад", callback_data="back_to_admin")]
+            ])
         )
-        await db.commit()
+        await state.clear()
+        return
     
+    await reload_catalog()
     logging.info(f"Product added: {data['name']} by user {message.from_user.id}")
     await send_message_with_retry(
         message.bot,
@@ -455,16 +481,30 @@ async def back_to_product_media(callback: CallbackQuery, state: FSMContext):
     )
     await state.set_state(AdminStates.ADD_PRODUCT_MEDIA)
 
-@router.callback_query(F.data == "list_products", AdminStates.MAIN)
+@router.callback_query(F.data.startswith("list_products"), AdminStates.MAIN)
 async def list_products(callback: CallbackQuery, state: FSMContext):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("""
+    """Список товаров постранично: list_products, list_products_a<id> (дальше), list_products_b<id> (назад)"""
+    position = callback.data[len("list_products_"):] or None
+    backward = position is not None and position[0] == "b"
+    # Keyset по первичному ключу: страница не зависит от числа товаров до неё
+    async with pool.reader() as db:
+        cursor = await db.execute(f"""
             SELECT p.id, p.name, p.price, c.name, s.name
             FROM products p
             JOIN categories c ON p.category_id = c.id
             LEFT JOIN categories s ON p.subcategory_id = s.id
-        """)
+            WHERE p.id {"<" if backward else ">"} ?
+            ORDER BY p.id {"DESC" if backward else "ASC"}
+            LIMIT ?
+        """, (int(position[1:]) if position else 0, ADMIN_PAGE_SIZE + 1))
         products = await cursor.fetchall()
+    has_more = len(products) > ADMIN_PAGE_SIZE
+    products = products[:ADMIN_PAGE_SIZE]
+    if backward:
+        products.reverse()
+        has_prev, has_next = has_more, True
+    else:
+        has_prev, has_next = position is not None, has_more
     
     if not products:
         await edit_message_with_retry(
@@ -484,13 +524,19 @@ async def list_products(callback: CallbackQuery, state: FSMContext):
             text += f" / {subcategory}"
         text += "\n"
     
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"list_products_b{products[0][0]}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=f"list_products_a{products[-1][0]}"))
+    kb_buttons = [nav] if nav else []
+    kb_buttons.append([InlineKeyboardButton(text="Назад", callback_data="back_to_admin")])
     await edit_message_with_retry(
         callback.message,
         text,
-        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-            [InlineKeyboardButton(text="Назад", callback_data="back_to_admin")]
-        ])
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=kb_buttons)
     )
+    await callback.answer()
 
 @router.callback_query(F.data == "delete_product", AdminStates.MAIN)
 async def delete_product_start(callback: CallbackQuery, state: FSMContext):
@@ -519,32 +565,33 @@ async def delete_product(message: Message, state: FSMContext):
     
     try:
         product_id = int(message.text)
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with pool.writer() as db:
             # Проверяем, есть ли товар
             cursor = await db.execute("SELECT name FROM products WHERE id = ?", (product_id,))
             product = await cursor.fetchone()
-            if not product:
-                await send_message_with_retry(
-                    message.bot,
-                    message.chat.id,
-                    f"Товар с ID {product_id} не найден!",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="Назад", callback_data="back_to_admin")]
-                    ])
-                )
-                await state.clear()
-                return
-            
-            # Удаляем из корзины
-            await db.execute("DELETE FROM cart WHERE product_id = ?", (product_id,))
-            # Удаляем из заказов
-            await db.execute("DELETE FROM orders WHERE product_id = ?", (product_id,))
-            # Удаляем из invoices
-            await db.execute("DELETE FROM invoices WHERE product_id = ?", (product_id,))
-            # Удаляем сам товар
-            await db.execute("DELETE FROM products WHERE id = ?", (product_id,))
-            await db.commit()
+            if product:
+                # Удаляем из корзины
+                await db.execute("DELETE FROM cart WHERE product_id = ?", (product_id,))
+                # Удаляем из заказов
+                await db.execute("DELETE FROM orders WHERE product_id = ?", (product_id,))
+                # Удаляем из invoices
+                await db.execute("DELETE FROM invoices WHERE product_id = ?", (product_id,))
+                # Удаляем сам товар
+                await db.execute("DELETE FROM products WHERE id = ?", (product_id,))
+        
+        if not product:
+            await send_message_with_retry(
+                message.bot,
+                message.chat.id,
+                f"Товар с ID {product_id} не найден!",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="Назад", callback_data="back_to_admin")]
+                ])
+            )
+            await state.clear()
+            return
         
+        await reload_catalog()
         await send_message_with_retry(
             message.bot,
             message.chat.id,
@@ -579,19 +626,20 @@ async def edit_product_start(callback: CallbackQuery, state: FSMContext):
 async def edit_product(message: Message, state: FSMContext):
     try:
         product_id = int(message.text)
-        async with aiosqlite.connect(DB_PATH) as db:
+        async with pool.reader() as db:
             cursor = await db.execute("SELECT COUNT(*) FROM products WHERE id = ?", (product_id,))
-            if (await cursor.fetchone())[0] == 0:
-                await send_message_with_retry(
-                    message.bot,
-                    message.chat.id,
-                    "Товар не найден!",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="Назад", callback_data="back_to_admin")]
-                    ])
-                )
-                await state.clear()
-                return
+            found = (await cursor.fetchone())[0] > 0
+        if not found:
+            await send_message_with_retry(
+                message.bot,
+                message.chat.id,
+                "Товар не найден!",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="Назад", callback_data="back_to_admin")]
+                ])
+            )
+            await state.clear()
+            return
         await state.update_data(product_id=product_id)
         kb = InlineKeyboardMarkup(inline_keyboard=[
             [InlineKeyboardButton(text="Название", callback_data="edit_name")],
@@ -666,21 +714,10 @@ async def update_product_field(message: Message, state: FSMContext):
     data = await state.get_data()
     product_id = data["product_id"]
     field = data["field"]
-    async with aiosqlite.connect(DB_PATH) as db:
-        if field == "price":
-            try:
-                value = float(message.text)
-                if value < 0:
-                    await send_message_with_retry(
-                        message.bot,
-                        message.chat.id,
-                        "Цена должна быть числом >= 0. Попробуй снова:",
-                        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                            [InlineKeyboardButton(text="Назад", callback_data="edit_product")]
-                        ])
-                    )
-                    return
-            except ValueError:
+    if field == "price":
+        try:
+            value = float(message.text)
+            if value < 0:
                 await send_message_with_retry(
                     message.bot,
                     message.chat.id,
@@ -690,45 +727,56 @@ async def update_product_field(message: Message, state: FSMContext):
                     ])
                 )
                 return
-        elif field == "delivery_file" and message.text != "/skip":
-            if message.text:
-                value = message.text
-            elif message.photo:
-                value = message.photo[-1].file_id
-            elif message.animation:
-                value = message.animation.file_id
-            elif message.document:
-                value = message.document.file_id
-            else:
-                await send_message_with_retry(
-                    message.bot,
-                    message.chat.id,
-                    "Отправьте текст, фото, гиф или файл (или /skip):",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="Назад", callback_data="edit_product")]
-                    ])
-                )
-                return
-        elif field == "media" and message.text != "/skip":
-            if message.photo:
-                value = message.photo[-1].file_id
-            elif message.animation:
-                value = message.animation.file_id
-            else:
-                await send_message_with_retry(
-                    message.bot,
-                    message.chat.id,
-                    "Отправьте фото или гиф (или /skip):",
-                    reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                        [InlineKeyboardButton(text="Назад", callback_data="edit_product")]
-                    ])
-                )
-                return
+        except ValueError:
+            await send_message_with_retry(
+                message.bot,
+                message.chat.id,
+                "Цена должна быть числом >= 0. Попробуй снова:",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="Назад", callback_data="edit_product")]
+                ])
+            )
+            return
+    elif field == "delivery_file" and message.text != "/skip":
+        if message.text:
+            value = message.text
+        elif message.photo:
+            value = message.photo[-1].file_id
+        elif message.animation:
+            value = message.animation.file_id
+        elif message.document:
+            value = message.document.file_id
         else:
-            value = message.text if message.text != "/skip" else None
-        
+            await send_message_with_retry(
+                message.bot,
+                message.chat.id,
+                "Отправьте текст, фото, гиф или файл (или /skip):",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="Назад", callback_data="edit_product")]
+                ])
+            )
+            return
+    elif field == "media" and message.text != "/skip":
+        if message.photo:
+            value = message.photo[-1].file_id
+        elif message.animation:
+            value = message.animation.file_id
+        else:
+            await send_message_with_retry(
+                message.bot,
+                message.chat.id,
+                "Отправьте фото или гиф (или /skip):",
+                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                    [InlineKeyboardButton(text="Назад", callback_data="edit_product")]
+                ])
+            )
+            return
+    else:
+        value = message.text if message.text != "/skip" else None
+    
+    async with pool.writer() as db:
         await db.execute(f"UPDATE products SET {field} = ? WHERE id = ?", (value, product_id))
-        await db.commit()
+    await reload_catalog()
     
     await send_message_with_retry(
         message.bot,
@@ -744,9 +792,9 @@ async def update_product_field(message: Message, state: FSMContext):
 async def update_product_category(callback: CallbackQuery, state: FSMContext):
     category_id = int(callback.data.split("_")[2])
     product_id = (await state.get_data())["product_id"]
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute("UPDATE products SET category_id = ?, subcategory_id = NULL WHERE id = ?", (category_id, product_id))
-        await db.commit()
+    await reload_catalog()
     await edit_message_with_retry(
         callback.message,
         "Категория обновлена!",
@@ -760,9 +808,9 @@ async def update_product_category(callback: CallbackQuery, state: FSMContext):
 async def update_product_subcategory(callback: CallbackQuery, state: FSMContext):
     subcategory_id = None if callback.data == "new_subcategory_none" else int(callback.data.split("_")[2])
     product_id = (await state.get_data())["product_id"]
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute("UPDATE products SET subcategory_id = ? WHERE id = ?", (subcategory_id, product_id))
-        await db.commit()
+    await reload_catalog()
     await edit_message_with_retry(
         callback.message,
         "Подкатегория обновлена!",
@@ -841,35 +889,38 @@ async def add_promocode_max_uses(message: Message, state: FSMContext):
                 ])
             )
             return
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         try:
             await db.execute(
                 "INSERT INTO promocodes (code, discount_percent, max_uses) VALUES (?, ?, ?)",
                 (data["code"], data["discount"], max_uses)
             )
-            await db.commit()
-            await send_message_with_retry(
-                message.bot,
-                message.chat.id,
-                "Промокод добавлен!",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="Назад", callback_data="back_to_admin")]
-                ])
-            )
+            added = True
         except aiosqlite.IntegrityError:
-            await send_message_with_retry(
-                message.bot,
-                message.chat.id,
-                "Промокод с таким кодом уже существует!",
-                reply_markup=InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(text="Назад", callback_data="back_to_admin")]
-                ])
-            )
+            added = False
+    if added:
+        await send_message_with_retry(
+            message.bot,
+            message.chat.id,
+            "Промокод добавлен!",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="Назад", callback_data="back_to_admin")]
+            ])
+        )
+    else:
+        await send_message_with_retry(
+            message.bot,
+            message.chat.id,
+            "Промокод с таким кодом уже существует!",
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="Назад", callback_data="back_to_admin")]
+            ])
+        )
     await state.clear()
 
 @router.callback_query(F.data == "discounts", AdminStates.MAIN)
 async def discounts(callback: CallbackQuery, state: FSMContext):
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         cursor = await db.execute("SELECT code, discount_percent, max_uses, uses_count FROM promocodes")
         promocodes = await cursor.fetchall()
     
@@ -895,64 +946,27 @@ async def discounts(callback: CallbackQuery, state: FSMContext):
 
 @router.callback_query(F.data == "stats", AdminStates.MAIN)
 async def stats(callback: CallbackQuery, state: FSMContext):
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT COUNT(*) FROM users")
-        total_users = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT COUNT(*) FROM users WHERE created_at >= ?", (datetime.now() - timedelta(days=30),))
-        users_month = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT COUNT(*) FROM users WHERE created_at >= ?", (datetime.now() - timedelta(days=7),))
-        users_week = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT COUNT(*) FROM users WHERE created_at >= ?", (datetime.now() - timedelta(days=1),))
-        users_yesterday = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT COUNT(*) FROM users WHERE created_at >= ?", (datetime.now().date(),))
-        users_today = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT COUNT(*) FROM users WHERE created_at >= ?", (datetime.now() - timedelta(hours=1),))
-        users_hour = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT COUNT(*) FROM orders WHERE status = 'completed'")
-        total_orders = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT COUNT(*) FROM orders WHERE status = 'completed' AND timestamp >= ?", (datetime.now() - timedelta(days=30),))
-        orders_month = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT COUNT(*) FROM orders WHERE status = 'completed' AND timestamp >= ?", (datetime.now() - timedelta(days=7),))
-        orders_week = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT COUNT(*) FROM orders WHERE status = 'completed' AND timestamp >= ?", (datetime.now() - timedelta(days=1),))
-        orders_yesterday = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT COUNT(*) FROM orders WHERE status = 'completed' AND date(timestamp) = date('now')")
-        orders_today = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT COUNT(*) FROM orders WHERE status = 'completed' AND timestamp >= ?", (datetime.now() - timedelta(hours=1),))
-        orders_hour = (await cursor.fetchone())[0]
-        
-        cursor = await db.execute("SELECT SUM(amount) FROM orders WHERE status = 'completed'")
-        total_revenue = (await cursor.fetchone())[0] or 0.0
-        
+    stats = await get_stats()
+    users, orders = stats["users"], stats["orders"]
+    async with pool.reader() as db:
         cursor = await db.execute("SELECT code, discount_percent, max_uses, uses_count FROM promocodes")
         promocodes = await cursor.fetchall()
     
-    total_users_esc = str(total_users).replace('.', '\\.')
-    users_month_esc = str(users_month).replace('.', '\\.')
-    users_week_esc = str(users_week).replace('.', '\\.')
-    users_yesterday_esc = str(users_yesterday).replace('.', '\\.')
-    users_today_esc = str(users_today).replace('.', '\\.')
-    users_hour_esc = str(users_hour).replace('.', '\\.')
+    total_users_esc = str(users["total"]).replace('.', '\\.')
+    users_month_esc = str(users["month"]).replace('.', '\\.')
+    users_week_esc = str(users["week"]).replace('.', '\\.')
+    users_yesterday_esc = str(users["yesterday"]).replace('.', '\\.')
+    users_today_esc = str(users["today"]).replace('.', '\\.')
+    users_hour_esc = str(users["hour"]).replace('.', '\\.')
     
-    total_orders_esc = str(total_orders).replace('.', '\\.')
-    orders_month_esc = str(orders_month).replace('.', '\\.')
-    orders_week_esc = str(orders_week).replace('.', '\\.')
-    orders_yesterday_esc = str(orders_yesterday).replace('.', '\\.')
-    orders_today_esc = str(orders_today).replace('.', '\\.')
-    orders_hour_esc = str(orders_hour).replace('.', '\\.')
+    total_orders_esc = str(orders["total"]).replace('.', '\\.')
+    orders_month_esc = str(orders["month"]).replace('.', '\\.')
+    orders_week_esc = str(orders["week"]).replace('.', '\\.')
+    orders_yesterday_esc = str(orders["yesterday"]).replace('.', '\\.')
+    orders_today_esc = str(orders["today"]).replace('.', '\\.')
+    orders_hour_esc = str(orders["hour"]).replace('.', '\\.')
     
-    total_revenue_esc = str(total_revenue).replace('.', '\\.')
+    total_revenue_esc = str(stats["revenue"]).replace('.', '\\.')
     
     text = f"*Статистика*\n\n" \
            f"*Пользователи*\n" \
@@ -989,6 +1003,45 @@ async def stats(callback: CallbackQuery, state: FSMContext):
         parse_mode="MarkdownV2"
     )
 
+@router.callback_query(F.data == "broadcast", AdminStates.MAIN)
+async def broadcast_start(callback: CallbackQuery, state: FSMContext):
+    await edit_message_with_retry(
+        callback.message,
+        "Отправьте сообщение для рассылки (текст, фото, файл и т.д.):",
+        reply_markup=InlineKeyboardMarkup(inline_keyboard=[
+            [InlineKeyboardButton(text="Назад", callback_data="back_to_admin")]
+        ])
+    )
+    await state.set_state(AdminStates.BROADCAST_MESSAGE)
+
+@router.message(AdminStates.BROADCAST_MESSAGE)
+async def broadcast_message(message: Message, state: FSMContext):
+    # Сохраняем только ссылку на сообщение: рассылка копирует его как есть
+    await state.update_data(broadcast_chat_id=message.chat.id, broadcast_message_id=message.message_id)
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Начать рассылку", callback_data="broadcast_confirm")],
+        [InlineKeyboardButton(text="Отмена", callback_data="back_to_admin")]
+    ])
+    await message.answer("Разослать это сообщение всем пользователям?", reply_markup=kb)
+
+@router.callback_query(F.data == "broadcast_confirm", AdminStates.BROADCAST_MESSAGE)
+async def broadcast_confirm(callback: CallbackQuery, state: FSMContext):
+    data = await state.get_data()
+    await edit_message_with_retry(callback.message, "Рассылка запущена.")
+    await broadcaster.start(callback.bot, data["broadcast_chat_id"], data["broadcast_message_id"], callback.message.chat.id)
+    await state.set_state(AdminStates.MAIN)
+    await callback.answer()
+
+@router.callback_query(F.data.startswith("broadcast_cancel_"))
+async def broadcast_cancel(callback: CallbackQuery):
+    if callback.from_user.id != ADMIN_ID:
+        return
+    broadcast_id = int(callback.data.split("_")[2])
+    if await broadcaster.cancel(broadcast_id):
+        await callback.answer("Рассылка остановлена")
+    else:
+        await callback.answer("Рассылка уже завершена")
+
 @router.callback_query(F.data == "back_to_admin")
 async def back_to_admin(callback: CallbackQuery, state: FSMContext):
     kb = InlineKeyboardMarkup(inline_keyboard=[
@@ -0,0 +1,324 @@
+# bench.py
+"""Нагрузочный бенчмарк хендлеров bot.py и admin.py без сети.
+
+Апдейты прогоняются через настоящий Dispatcher с обоими роутерами и FSM-хранилищем
+в SQLite. Bot API отвечает фейковая сессия (с задержкой --api-latency), Crypto Pay -
+локальный HTTP-сервер. БД - временная копия схемы, заполненная синтетическими данными.
+
+Пример:
+    python bench.py --users 100000 --products 2000 --clients 50 --rounds 20
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import tempfile
+import time
+from datetime import datetime
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.types import Update, Message, Chat, User, MessageId, ChatMemberMember
+from bot import router as bot_router
+from admin import router as admin_router, AdminStates
+from subscription import router as subscription_router
+from payments import crypto_pay
+from catalog import reload_catalog, _match_query
+from storage import SQLiteStorage
+from config import ADMIN_ID, SEARCH_LIMIT
+import db
+
+BOT_ID = 1000000001
+FIRST_USER_ID = 10000000
+
+# Словарь названий и описаний: частота слов убывает, как у настоящего каталога
+NAME_WORDS = ["бот", "телеграм", "канал", "трафик", "схема", "арбитраж", "крипта", "парсер", "аккаунт", "прокси",
+              "мануал", "курс", "шаблон", "скрипт", "база", "чат", "реклама", "инвайтер", "рассылка", "магазин"]
+DESC_WORDS = NAME_WORDS + ["настройка", "инструкция", "доступ", "лицензия", "обновление", "поддержка",
+                           "быстрый", "старт", "готовый", "пошаговый", "подробный", "новый"]
+
+class FakeSession(BaseSession):
+    """Сессия бота, отвечающая на любой метод Bot API без сети"""
+
+    def __init__(self, latency: float):
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        name = type(method).__name__
+        if name == "GetChatMember":
+            return ChatMemberMember(user=User(id=method.user_id, is_bot=False, first_name="user"))
+        if name == "GetMe":
+            return User(id=bot.id, is_bot=True, first_name="bench", username="bench_bot")
+        if name == "CopyMessage":
+            return MessageId(message_id=1)
+        if name.startswith(("Send", "Edit")):
+            chat_id = getattr(method, "chat_id", None) or 0
+            return Message(message_id=1, date=datetime.now(), chat=Chat(id=chat_id, type="private"),
+                           text=getattr(method, "text", None))
+        return True
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+async def start_fake_cryptopay(port: int) -> web.AppRunner:
+    """Локальный Crypto Pay API: createInvoice отвечает сразу"""
+    counter = iter(range(1, 1 << 62))
+
+    async def create_invoice(request: web.Request) -> web.Response:
+        invoice_id = next(counter)
+        return web.json_response({"ok": True, "result": {
+            "invoice_id": invoice_id, "status": "active", "pay_url": f"https://t.me/CryptoBot?start=inv_{invoice_id}"
+        }})
+
+    app = web.Application()
+    app.router.add_post("/createInvoice", create_invoice)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+def words(rng: random.Random, vocabulary: list, count: int) -> str:
+    return " ".join(rng.choices(vocabulary, weights=[1 / (i + 1) for i in range(len(vocabulary))], k=count))
+
+def search_queries(rng: random.Random) -> dict:
+    """Запросы поиска по видам: слово, начало слова (по мере набора), несколько слов"""
+    return {
+        "single_word": rng.choice(NAME_WORDS),
+        "prefix": rng.choice(NAME_WORDS)[:4],
+        "multi_word": " ".join(rng.sample(DESC_WORDS, 3)),
+    }
+
+async def seed(users: int, products: int, orders: int):
+    """Заполнить временную БД: юзеры, рефералы, товары по подкатегориям, заказы"""
+    rng = random.Random(1)
+    user_ids = range(FIRST_USER_ID, FIRST_USER_ID + users)
+    async with db.pool.writer() as conn:
+        await conn.executemany(
+            "INSERT INTO users (id, ref_id, balance, discount, created_at) VALUES (?, ?, ?, ?, datetime('now', ?))",
+            [(user_id, None, rng.randint(0, 100), rng.choice((0, 0, 0, 10)), f"-{rng.randint(0, 365 * 24)} hours")
+             for user_id in user_ids]
+        )
+        await conn.executemany(
+            "INSERT INTO referrals (user_id, ref_user_id, earnings) VALUES (?, ?, ?)",
+            [(user_id, rng.choice(user_ids), rng.random() * 5) for user_id in user_ids if rng.random() < 0.3]
+        )
+        await conn.executemany(
+            "INSERT INTO products (name, desc, price, category_id, subcategory_id, delivery_file) VALUES (?, ?, ?, ?, ?, ?)",
+            [(f"{words(rng, NAME_WORDS, rng.randint(2, 4)).capitalize()} {i}", words(rng, DESC_WORDS, rng.randint(8, 15)), 0 if i % 10 == 0 else rng.randint(1, 100),
+              1 if i % 10 == 0 else 2, None if i % 10 == 0 else 3 + i % 2, f"Инструкция {i}")
+             for i in range(products)]
+        )
+    async with db.pool.reader() as conn:
+        cursor = await conn.execute("SELECT id FROM products")
+        product_ids = [row[0] for row in await cursor.fetchall()]
+    # Заказы пишем пачками, чтобы не держать одну огромную транзакцию
+    for start in range(0, orders, 10000):
+        async with db.pool.writer() as conn:
+            await conn.executemany(
+                "INSERT INTO orders (user_id, product_id, amount, status, timestamp) VALUES (?, ?, ?, ?, datetime('now', ?))",
+                [(rng.choice(user_ids), rng.choice(product_ids), rng.randint(1, 100),
+                  rng.choice(("completed", "completed", "pending")), f"-{rng.randint(0, 365 * 24)} hours")
+                 for _ in range(start, min(orders, start + 10000))]
+            )
+    return list(user_ids), product_ids
+
+class Driver:
+    """Строит апдейты от имени юзеров и замеряет время их обработки"""
+
+    def __init__(self, dp: Dispatcher, bot: Bot):
+        self.dp = dp
+        self.bot = bot
+        self.update_id = 0
+        self.timings = {}  # (сценарий, шаг) -> [секунды]
+        self.errors = {}  # (сценарий, шаг) -> количество
+
+    def _user(self, user_id: int) -> dict:
+        return {"id": user_id, "is_bot": False, "first_name": "user", "username": f"user{user_id}"}
+
+    def message(self, user_id: int, text: str) -> Update:
+        self.update_id += 1
+        return Update.model_validate({"update_id": self.update_id, "message": {
+            "message_id": self.update_id, "date": int(time.time()), "text": text,
+            "chat": {"id": user_id, "type": "private"}, "from": self._user(user_id)
+        }}, context={"bot": self.bot})
+
+    def callback(self, user_id: int, data: str) -> Update:
+        self.update_id += 1
+        return Update.model_validate({"update_id": self.update_id, "callback_query": {
+            "id": str(self.update_id), "chat_instance": str(user_id), "data": data, "from": self._user(user_id),
+            "message": {"message_id": 1, "date": int(time.time()), "text": "menu",
+                        "chat": {"id": user_id, "type": "private"}, "from": self._user(BOT_ID)}
+        }}, context={"bot": self.bot})
+
+    async def feed(self, flow: str, step: str, update: Update):
+        started = time.perf_counter()
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            self.errors[(flow, step)] = self.errors.get((flow, step), 0) + 1
+            logging.debug(f"{flow}/{step}: {e!r}")
+        self.timings.setdefault((flow, step), []).append(time.perf_counter() - started)
+
+    @property
+    def updates(self) -> int:
+        return sum(len(values) for values in self.timings.values())
+
+async def flow_catalog(driver: Driver, user_id: int, product_id: int, subcategory_id: int):
+    await driver.feed("catalog", "products_command", driver.message(user_id, "Товары"))
+    await driver.feed("catalog", "show_subcategories", driver.callback(user_id, "category_2"))
+    await driver.feed("catalog", "show_products", driver.callback(user_id, f"subcategory_{subcategory_id}"))
+    await driver.feed("catalog", "show_product", driver.callback(user_id, f"product_{product_id}"))
+
+async def flow_cart(driver: Driver, user_id: int, product_id: int, subcategory_id: int):
+    await driver.feed("cart", "add_to_cart", driver.callback(user_id, f"add_to_cart_{product_id}"))
+    await driver.feed("cart", "cart_command", driver.message(user_id, "Корзина"))
+    await driver.feed("cart", "delete_item", driver.callback(user_id, f"delete_item_{product_id}"))
+
+async def flow_profile(driver: Driver, user_id: int, product_id: int, subcategory_id: int):
+    await driver.feed("profile", "profile_command", driver.message(user_id, "Профиль"))
+
+async def flow_buy(driver: Driver, user_id: int, product_id: int, subcategory_id: int):
+    await driver.feed("buy", "show_product", driver.callback(user_id, f"product_{product_id}"))
+    await driver.feed("buy", "buy_product", driver.callback(user_id, f"buy_product_{product_id}"))
+
+async def flow_admin_stats(driver: Driver, user_id: int, product_id: int, subcategory_id: int):
+    # Меню админки открываем через FSM напрямую: шаг проверяет именно выборку статистики
+    state = driver.dp.fsm.get_context(driver.bot, ADMIN_ID, ADMIN_ID)
+    await state.set_state(AdminStates.MAIN)
+    await driver.feed("admin_stats", "stats", driver.callback(ADMIN_ID, "stats"))
+
+_search_rng = random.Random(3)
+
+async def flow_search(driver: Driver, user_id: int, product_id: int, subcategory_id: int):
+    for step, query in search_queries(_search_rng).items():
+        await driver.feed("search", step, driver.message(user_id, f"/search {query}"))
+
+FLOWS = {
+    "catalog": flow_catalog,
+    "cart": flow_cart,
+    "profile": flow_profile,
+    "buy": flow_buy,
+    "admin_stats": flow_admin_stats,
+    "search": flow_search,
+}
+
+def percentile(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(p * len(values)))]
+
+def print_report(driver: Driver, elapsed: float):
+    print(f"\n{driver.updates} updates in {elapsed:.2f}s: {driver.updates / elapsed:.0f} updates/sec")
+    print(f"\n{'flow':<12} {'handler':<20} {'count':>7} {'errors':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for (flow, step), values in driver.timings.items():
+        values.sort()
+        print(f"{flow:<12} {step:<20} {len(values):>7} {driver.errors.get((flow, step), 0):>7} "
+              f"{percentile(values, 0.5) * 1000:>8.2f} {percentile(values, 0.95) * 1000:>8.2f} "
+              f"{percentile(values, 0.99) * 1000:>8.2f} {values[-1] * 1000:>8.2f}")
+
+async def bench_search(rounds: int):
+    """Запросы к FTS5 без кэша поиска, по одному: у хендлеров из flow_search частые запросы берутся из кэша"""
+    rng = random.Random(4)
+    timings = {}
+    for _ in range(rounds):
+        for kind, query in search_queries(rng).items():
+            started = time.perf_counter()
+            await db.search_product_ids(_match_query(query), SEARCH_LIMIT)
+            timings.setdefault(kind, []).append(time.perf_counter() - started)
+    print(f"\n{'search (db)':<20} {'count':>7} {'p50 ms':>8} {'p95 ms':>8} {'max ms':>8}")
+    for kind, values in timings.items():
+        values.sort()
+        print(f"{kind:<20} {len(values):>7} {percentile(values, 0.5) * 1000:>8.2f} "
+              f"{percentile(values, 0.95) * 1000:>8.2f} {values[-1] * 1000:>8.2f}")
+
+async def run(args):
+    path = os.path.join(tempfile.mkdtemp(prefix="bench_"), "bench.db")
+    db.pool.path = path
+    await db.pool.open()
+    cryptopay_runner = None
+    bot = None
+    storage = SQLiteStorage(args.fsm_cache, 1)
+    try:
+        await db.init_db()
+        started = time.perf_counter()
+        user_ids, product_ids = await seed(args.users, args.products, args.orders)
+        print(f"Seeded {len(user_ids)} users, {len(product_ids)} products, {args.orders} orders "
+              f"in {time.perf_counter() - started:.1f}s ({path})")
+        await reload_catalog()
+
+        cryptopay_runner = await start_fake_cryptopay(args.cryptopay_port)
+        crypto_pay.base_url = f"http://127.0.0.1:{args.cryptopay_port}"
+        bot = Bot(token=f"{BOT_ID}:bench", session=FakeSession(args.api_latency / 1000))
+        dp = Dispatcher(storage=storage)
+        dp.include_router(bot_router)
+        dp.include_router(admin_router)
+        dp.include_router(subscription_router)
+        dp["bot_username"] = "bench_bot"
+        driver = Driver(dp, bot)
+
+        flows = [FLOWS[name] for name in args.flows.split(",")]
+        paid_products = {}  # подкатегория -> платные товары
+        for product_id, subcategory_id in await _paid_products():
+            paid_products.setdefault(subcategory_id, []).append(product_id)
+        rng = random.Random(2)
+
+        async def client(user_id: int):
+            for _ in range(args.rounds):
+                for flow in flows:
+                    subcategory_id = rng.choice(list(paid_products))
+                    await flow(driver, user_id, rng.choice(paid_products[subcategory_id]), subcategory_id)
+
+        clients = rng.sample(user_ids, min(args.clients, len(user_ids)))
+        await asyncio.gather(*(client(user_id) for user_id in clients[:1]))  # Прогрев кэшей
+        driver.timings.clear()
+        driver.errors.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(client(user_id) for user_id in clients))
+        print_report(driver, time.perf_counter() - started)
+        print(f"\nBot API calls: {bot.session.calls}, FSM cache hits/misses: {storage.hits}/{storage.misses}")
+        if flow_search in flows:
+            await bench_search(args.rounds * 10)
+    finally:
+        await storage.close()
+        if cryptopay_runner is not None:
+            await cryptopay_runner.cleanup()
+        await crypto_pay.close()
+        await db.pool.close()
+        if not args.keep_db:
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(path + suffix):
+                    os.remove(path + suffix)
+
+async def _paid_products() -> list:
+    async with db.pool.reader() as conn:
+        cursor = await conn.execute("SELECT id, subcategory_id FROM products WHERE price > 0 AND subcategory_id IS NOT NULL")
+        return await cursor.fetchall()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=10000, help="юзеров в БД")
+    parser.add_argument("--products", type=int, default=500, help="товаров в БД")
+    parser.add_argument("--orders", type=int, default=50000, help="заказов в БД")
+    parser.add_argument("--clients", type=int, default=50, help="одновременно активных юзеров")
+    parser.add_argument("--rounds", type=int, default=10, help="проходов всех сценариев на юзера")
+    parser.add_argument("--flows", default=",".join(FLOWS), help=f"сценарии через запятую: {', '.join(FLOWS)}")
+    parser.add_argument("--api-latency", type=float, default=0, help="задержка ответа Bot API, мс")
+    parser.add_argument("--fsm-cache", type=int, default=10000, help="размер LRU-кэша FSM")
+    parser.add_argument("--cryptopay-port", type=int, default=8089, help="порт локального Crypto Pay")
+    parser.add_argument("--keep-db", action="store_true", help="не удалять временную БД")
+    args = parser.parse_args()
+    unknown = set(args.flows.split(",")) - set(FLOWS)
+    if unknown:
+        parser.error(f"unknown flows: {', '.join(sorted(unknown))}")
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(name)s - %(levelname)s - %(message)s")
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,212 @@
+# broadcast.py
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramAPIError, TelegramRetryAfter, TelegramForbiddenError, TelegramNetworkError, TelegramServerError
+)
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from config import BROADCAST_CONCURRENCY, BROADCAST_BATCH, BROADCAST_PROGRESS_INTERVAL
+from db import (
+    create_broadcast, get_broadcast, get_running_broadcast_ids, get_broadcast_recipients,
+    save_broadcast_results, finish_broadcast
+)
+from ratelimit import outbound_priority, BACKGROUND
+import asyncio
+import logging
+import time
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600} ч {seconds % 3600 // 60} мин"
+    if seconds >= 60:
+        return f"{seconds // 60} мин {seconds % 60} с"
+    return f"{seconds} с"
+
+class BroadcastRun:
+    """Состояние одной идущей рассылки"""
+
+    def __init__(self, info: dict):
+        self.info = info
+        self.id = info["id"]
+        self.counts = {"sent": info["sent"], "blocked": info["blocked"], "failed": info["failed"]}
+        self.done_before = sum(self.counts.values())  # Обработано до перезапуска
+        self.started = time.monotonic()
+        self.saving = set()  # Записи результатов, которые не должна прервать отмена
+        self.cancelled = False
+        self.task = None
+
+    @property
+    def done(self) -> int:
+        return sum(self.counts.values())
+
+    def progress_text(self, finished: str = None) -> str:
+        total = max(self.info["total"], self.done)
+        elapsed = time.monotonic() - self.started
+        speed = (self.done - self.done_before) / elapsed if elapsed > 0 else 0.0
+        text = f"Рассылка #{self.id}: {self.done}/{total}\n"
+        text += f"Доставлено: {self.counts['sent']}, заблокировали бота: {self.counts['blocked']}, ошибок: {self.counts['failed']}\n"
+        if finished:
+            text += f"{finished} за {format_duration(elapsed)}"
+        else:
+            eta = format_duration((total - self.done) / speed) if speed else "-"
+            text += f"Скорость: {speed:.1f} сообщ/с, осталось ~{eta}"
+        return text
+
+class Broadcaster:
+    """Рассылка сообщения всем пользователям с продолжением после перезапуска.
+
+    Частоту и флуд-контроль держит общий outbound_limiter: рассылка идёт с
+    приоритетом BACKGROUND и не быстрее TELEGRAM_BACKGROUND_RATE.
+
+    Получатели читаются пачками по id, результат каждой отправки пишется в
+    broadcast_deliveries, поэтому после перезапуска уже получившие пропускаются.
+    """
+
+    MAX_NETWORK_RETRIES = 3
+
+    def __init__(self, concurrency: int, batch_size: int, progress_interval: float):
+        self.concurrency = concurrency
+        self.batch_size = batch_size
+        self.progress_interval = progress_interval
+        self._runs = {}  # broadcast_id -> BroadcastRun
+
+    async def start(self, bot: Bot, from_chat_id: int, message_id: int, admin_chat_id: int) -> int:
+        """Запустить рассылку копии сообщения; прогресс обновляется в чате админа"""
+        progress = await bot.send_message(admin_chat_id, "Рассылка запускается...")
+        info = await create_broadcast(from_chat_id, message_id, admin_chat_id, progress.message_id)
+        self._spawn(bot, info)
+        logging.info(f"Broadcast {info['id']} started: {info['total']} recipients")
+        return info["id"]
+
+    async def resume(self, bot: Bot):
+        """Продолжить рассылки, прерванные остановкой бота"""
+        for broadcast_id in await get_running_broadcast_ids():
+            info = await get_broadcast(broadcast_id)
+            self._spawn(bot, info)
+            logging.info(f"Broadcast {broadcast_id} resumed: {info['sent'] + info['blocked'] + info['failed']}/{info['total']} done")
+
+    def _spawn(self, bot: Bot, info: dict):
+        run = BroadcastRun(info)
+        run.task = asyncio.create_task(self._run(bot, run))
+        self._runs[run.id] = run
+        run.task.add_done_callback(lambda _: self._runs.pop(run.id, None))
+
+    def is_running(self, broadcast_id: int) -> bool:
+        return broadcast_id in self._runs
+
+    async def cancel(self, broadcast_id: int) -> bool:
+        """Остановить рассылку по кнопке админа"""
+        run = self._runs.get(broadcast_id)
+        if run is None:
+            return False
+        run.cancelled = True
+        run.task.cancel()
+        await asyncio.gather(run.task, return_exceptions=True)
+        return True
+
+    async def stop(self):
+        """Остановка бота: прервать рассылки, оставив их в статусе running"""
+        tasks = [run.task for run in self._runs.values()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _send(self, bot: Bot, run: BroadcastRun, user_id: int) -> str:
+        network_errors = 0
+        while True:
+            try:
+                await bot.copy_message(user_id, run.info["from_chat_id"], run.info["message_id"])
+                return "sent"
+            except TelegramRetryAfter as e:
+                # RateLimitMiddleware уже приостановил весь фон; сюда доходит пауза длиннее TELEGRAM_MAX_RETRY_AFTER
+                logging.warning(f"Broadcast {run.id}: flood control, retry in {e.retry_after}s")
+                await asyncio.sleep(e.retry_after)
+            except TelegramForbiddenError:
+                return "blocked"
+            except (TelegramNetworkError, TelegramServerError) as e:
+                network_errors += 1
+                if network_errors > self.MAX_NETWORK_RETRIES:
+                    logging.error(f"Broadcast {run.id}: {user_id}: {e}")
+                    return "failed"
+                await asyncio.sleep(2 ** network_errors)
+            except TelegramAPIError as e:
+                # Чат не найден, пользователь удалён и т.п. - повтор не поможет
+                logging.debug(f"Broadcast {run.id}: {user_id}: {e}")
+                return "failed"
+
+    async def _update_progress(self, bot: Bot, run: BroadcastRun, finished: str = None):
+        kb = None
+        if not finished:
+            kb = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(text="Остановить", callback_data=f"broadcast_cancel_{run.id}")]
+            ])
+        try:
+            await bot.edit_message_text(
+                run.progress_text(finished),
+                chat_id=run.info["progress_chat_id"],
+                message_id=run.info["progress_message_id"],
+                reply_markup=kb,
+                parse_mode=None
+            )
+        except Exception as e:
+            logging.debug(f"Broadcast {run.id}: progress not updated: {e}")
+
+    async def _report(self, bot: Bot, run: BroadcastRun):
+        while True:
+            await asyncio.sleep(self.progress_interval)
+            await self._update_progress(bot, run)
+
+    async def _run(self, bot: Bot, run: BroadcastRun):
+        outbound_priority.set(BACKGROUND)  # Только в задаче рассылки: ответы юзерам идут раньше
+        queue = asyncio.Queue(maxsize=self.batch_size)
+
+        async def produce():
+            last_user_id = 0
+            while True:
+                user_ids = await get_broadcast_recipients(run.id, last_user_id, self.batch_size)
+                if not user_ids:
+                    break
+                for user_id in user_ids:
+                    await queue.put(user_id)
+                last_user_id = user_ids[-1]
+            for _ in range(self.concurrency):
+                await queue.put(None)
+
+        async def work():
+            while True:
+                user_id = await queue.get()
+                if user_id is None:
+                    return
+                status = await self._send(bot, run, user_id)
+                # Пишем до следующего получателя: после перезапуска повторно получит максимум по одному на воркер.
+                # Записи воркеров, пришедшие одновременно, писатель коммитит одной транзакцией
+                save = asyncio.create_task(save_broadcast_results(run.id, [(user_id, status)]))
+                run.saving.add(save)
+                save.add_done_callback(run.saving.discard)
+                run.counts[status] += 1
+                await asyncio.shield(save)
+
+        reporter = asyncio.create_task(self._report(bot, run))
+        status, finished = "done", "Завершена"
+        try:
+            # TaskGroup: при ошибке в одной задаче остальные отменяются, а не работают дальше
+            async with asyncio.TaskGroup() as tasks:
+                tasks.create_task(produce())
+                for _ in range(self.concurrency):
+                    tasks.create_task(work())
+        except asyncio.CancelledError:
+            if not run.cancelled:
+                raise  # Остановка бота: продолжим после перезапуска
+            status, finished = "cancelled", "Остановлена"
+        except Exception as e:
+            logging.error(f"Broadcast {run.id} failed: {e}")
+            raise
+        finally:
+            reporter.cancel()
+            if run.saving:
+                await asyncio.wait(run.saving)  # Иначе после перезапуска эти получатели получат сообщение ещё раз
+        await finish_broadcast(run.id, status)
+        await self._update_progress(bot, run, finished=finished)
+        logging.info(f"Broadcast {run.id} {status}: {run.counts}")
+
+broadcaster = Broadcaster(BROADCAST_CONCURRENCY, BROADCAST_BATCH, BROADCAST_PROGRESS_INTERVAL)
@@ -0,0 +1,276 @@
+# catalog.py
+from typing import NamedTuple, Optional
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+from config import CATALOG_PAGE_SIZE, CATALOG_SCREEN_CACHE_SIZE, SEARCH_LIMIT, SEARCH_CACHE_SIZE
+from db import pool, search_product_ids
+import asyncio
+import logging
+import re
+
+class Category(NamedTuple):
+    id: int
+    name: str
+    parent_id: Optional[int]
+
+class Product(NamedTuple):
+    id: int
+    name: str
+    desc: Optional[str]
+    price: float
+    category_id: int
+    subcategory_id: Optional[int]
+    delivery_file: Optional[str]
+    media: Optional[str]
+
+class CatalogSnapshot:
+    """Неизменяемый снимок каталога; заменяется целиком при изменениях в админке"""
+
+    def __init__(self, version: int, categories: list, products: list):
+        self.version = version
+        self.categories = {cat.id: cat for cat in categories}
+        self.products = {product.id: product for product in products}
+        children = {}
+        for cat in sorted(categories, key=lambda c: c.name):
+            children.setdefault(cat.parent_id, []).append(cat)
+        self._children = {parent_id: tuple(cats) for parent_id, cats in children.items()}
+        direct, in_subcategory = {}, {}
+        for product in sorted(products, key=lambda p: p.id):
+            if product.subcategory_id is None:
+                direct.setdefault(product.category_id, []).append(product)
+            else:
+                in_subcategory.setdefault(product.subcategory_id, []).append(product)
+        self._direct = {cat_id: tuple(items) for cat_id, items in direct.items()}
+        self._in_subcategory = {cat_id: tuple(items) for cat_id, items in in_subcategory.items()}
+
+    def get_categories(self, parent_id: int = None) -> tuple:
+        """Категории (или подкатегории parent_id), отсортированные по имени"""
+        return self._children.get(parent_id, ())
+
+    def get_category(self, category_id: int) -> Optional[Category]:
+        return self.categories.get(category_id)
+
+    def get_product(self, product_id: int) -> Optional[Product]:
+        return self.products.get(product_id)
+
+    def get_category_products(self, category_id: int) -> tuple:
+        """Товары категории без подкатегории"""
+        return self._direct.get(category_id, ())
+
+    def get_subcategory_products(self, subcategory_id: int) -> tuple:
+        """Товары подкатегории"""
+        return self._in_subcategory.get(subcategory_id, ())
+
+class Screen(NamedTuple):
+    """Готовый экран каталога для edit_text"""
+    text: str
+    reply_markup: InlineKeyboardMarkup
+    found: bool = True  # False - заглушка "не найдено"
+
+_snapshot = CatalogSnapshot(0, [], [])
+_reload_lock = asyncio.Lock()
+_screens = OrderedDict()  # (экран, id, версия каталога) -> Screen, LRU
+screen_stats = {"hits": 0, "misses": 0}
+_searches = OrderedDict()  # (запрос FTS5, версия каталога) -> товары, LRU
+search_stats = {"hits": 0, "misses": 0}
+
+def get_catalog() -> CatalogSnapshot:
+    """Текущий снимок каталога (без обращения к БД)"""
+    return _snapshot
+
+async def reload_catalog() -> CatalogSnapshot:
+    """Перечитать каталог из БД и атомарно подменить снимок"""
+    global _snapshot
+    async with _reload_lock:
+        async with pool.reader() as db:
+            cursor = await db.execute("SELECT id, name, parent_id FROM categories")
+            categories = [Category(*row) for row in await cursor.fetchall()]
+            cursor = await db.execute("""
+                SELECT id, name, desc, price, category_id, subcategory_id, delivery_file, media
+                FROM products
+            """)
+            products = [Product(*row) for row in await cursor.fetchall()]
+        _snapshot = CatalogSnapshot(_snapshot.version + 1, categories, products)
+        _screens.clear()  # Экраны старой версии больше не нужны
+        _searches.clear()
+    logging.info(f"Catalog v{_snapshot.version} loaded: {len(categories)} categories, {len(products)} products")
+    return _snapshot
+
+def _cached_screen(screen: str, item_id, build) -> Optional[Screen]:
+    """Экран из кэша или построенный build(снимок) для текущей версии каталога"""
+    catalog = _snapshot
+    key = (screen, item_id, catalog.version)
+    cached = _screens.get(key)
+    if cached is not None:
+        _screens.move_to_end(key)
+        screen_stats["hits"] += 1
+        return cached
+    screen_stats["misses"] += 1
+    result = build(catalog)
+    if result is not None:
+        _screens[key] = result
+        while len(_screens) > CATALOG_SCREEN_CACHE_SIZE:
+            _screens.popitem(last=False)
+    return result
+
+def _match_query(query: str) -> Optional[str]:
+    """Запрос FTS5 из текста юзера: все слова, последнее - как начало слова (поиск по мере набора)"""
+    words = re.findall(r"\w+", query.lower())[:8]
+    if not words:
+        return None
+    terms = [f'"{word}"' for word in words]
+    terms[-1] += "*"
+    return " ".join(terms)
+
+async def search_products(query: str) -> tuple:
+    """Товары по поисковому запросу, лучшие первыми; недавние запросы - из кэша"""
+    match = _match_query(query)
+    if match is None:
+        return ()
+    catalog = _snapshot
+    key = (match, catalog.version)
+    cached = _searches.get(key)
+    if cached is not None:
+        _searches.move_to_end(key)
+        search_stats["hits"] += 1
+        return cached
+    search_stats["misses"] += 1
+    product_ids = await search_product_ids(match, SEARCH_LIMIT)
+    # Карточки берём из снимка: товар мог быть удалён после индексации
+    result = tuple(product for product in map(catalog.get_product, product_ids) if product is not None)
+    _searches[key] = result
+    while len(_searches) > SEARCH_CACHE_SIZE:
+        _searches.popitem(last=False)
+    return result
+
+def _page_start(products: tuple, cursor: Optional[str], size: int) -> int:
+    """Индекс первого товара страницы: 'a<id>' - после id, 'b<id>' - до id, None - первая.
+
+    Товары в снимке отсортированы по id, поэтому граница находится бисекцией
+    без перебора предыдущих страниц. Экраны кэшируются по индексу, а не по
+    курсору: произвольные id в callback_data не плодят новых записей.
+    """
+    if not cursor:
+        return 0
+    product_id = int(cursor[1:])
+    if cursor[0] == "b":
+        return max(0, bisect_left(products, product_id, key=lambda p: p.id) - size)
+    start = bisect_right(products, product_id, key=lambda p: p.id)
+    return start if start < len(products) else max(0, len(products) - size)
+
+def _products_keyboard(products: tuple, back: str, start: int, page_data: str) -> tuple:
+    page = products[start:start + CATALOG_PAGE_SIZE]
+    has_prev, has_next = start > 0, start + CATALOG_PAGE_SIZE < len(products)
+    text = ""
+    kb_buttons = []
+    for product in page:
+        text += f"*{product.name} | {product.price}$*\n"
+        kb_buttons.append([
+            InlineKeyboardButton(text=f"{product.name} | {product.price}$", callback_data=f"product_{product.id}")
+        ])
+    # Кнопки листания несут id крайнего товара страницы
+    nav = []
+    if has_prev:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"{page_data}_b{page[0].id}"))
+    if has_next:
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=f"{page_data}_a{page[-1].id}"))
+    if nav:
+        kb_buttons.append(nav)
+    kb_buttons.append([InlineKeyboardButton(text="Назад", callback_data=back)])
+    return text, InlineKeyboardMarkup(inline_keyboard=kb_buttons)
+
+def _not_found(text: str, back: str) -> Screen:
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Назад", callback_data=back)]
+    ])
+    return Screen(text, kb, found=False)
+
+def render_categories_menu() -> Screen:
+    """Список категорий из главного меню"""
+    def build(catalog):
+        kb_buttons = [[InlineKeyboardButton(text=cat.name, callback_data=f"category_{cat.id}")] for cat in catalog.get_categories()]
+        return Screen("Выберите категорию:", InlineKeyboardMarkup(inline_keyboard=kb_buttons))
+    return _cached_screen("categories_menu", None, build)
+
+def render_categories() -> Screen:
+    """Список категорий с кнопкой назад"""
+    def build(catalog):
+        text = "Категории:\n\n"
+        kb_buttons = []
+        for cat in catalog.get_categories():
+            text += f"* {cat.name}\n"
+            kb_buttons.append([InlineKeyboardButton(text=cat.name, callback_data=f"category_{cat.id}")])
+        kb_buttons.append([InlineKeyboardButton(text="Назад", callback_data="back_to_main")])
+        return Screen(text, InlineKeyboardMarkup(inline_keyboard=kb_buttons))
+    return _cached_screen("categories", None, build)
+
+def render_category(category_id: int, cursor: str = None) -> Optional[Screen]:
+    """Экран категории: подкатегории или сразу товары (для "Бесплатное"), cursor - страница товаров"""
+    start = _page_start(_snapshot.get_category_products(category_id), cursor, CATALOG_PAGE_SIZE)
+
+    def build(catalog):
+        category = catalog.get_category(category_id)
+        if not category:
+            return None
+        if category.name == "Бесплатное":
+            products = catalog.get_category_products(category.id)
+            if not products:
+                return _not_found("Товары не найдены.", "back_to_categories")
+            text, kb = _products_keyboard(products, "back_to_categories", start, f"page_cat_{category.id}")
+            return Screen(f"Товары в категории *{category.name}*:\n\n" + text, kb)
+        subcategories = catalog.get_categories(category.id)
+        if not subcategories:
+            return _not_found("Подкатегории не найдены.", "back_to_categories")
+        kb_buttons = [[InlineKeyboardButton(text=subcat.name, callback_data=f"subcategory_{subcat.id}")] for subcat in subcategories]
+        kb_buttons.append([InlineKeyboardButton(text="Назад", callback_data="back_to_categories")])
+        return Screen(f"Подкатегории в *{category.name}*:\n\n", InlineKeyboardMarkup(inline_keyboard=kb_buttons))
+    return _cached_screen("category", (category_id, start), build)
+
+def render_subcategory(subcategory_id: int, cursor: str = None) -> Optional[Screen]:
+    """Товары подкатегории, cursor - страница"""
+    start = _page_start(_snapshot.get_subcategory_products(subcategory_id), cursor, CATALOG_PAGE_SIZE)
+
+    def build(catalog):
+        subcategory = catalog.get_category(subcategory_id)
+        if not subcategory:
+            return None
+        back = f"back_to_category_{subcategory.parent_id}"
+        products = catalog.get_subcategory_products(subcategory.id)
+        if not products:
+            return _not_found("Товары не найдены.", back)
+        text, kb = _products_keyboard(products, back, start, f"page_sub_{subcategory.id}")
+        return Screen(f"Товары в подкатегории *{subcategory.name}*:\n\n" + text, kb)
+    return _cached_screen("subcategory", (subcategory_id, start), build)
+
+def render_product(product_id: int) -> Optional[Screen]:
+    """Карточка товара"""
+    def build(catalog):
+        product = catalog.get_product(product_id)
+        if not product:
+            return None
+        text = f"*Товар*: {product.name}\n"
+        text += f"*Описание*: {product.desc or 'Нет описания'}\n"
+        text += f"*Цена*: {product.price}$\n"
+        kb_buttons = []
+        if product.price == 0:
+            kb_buttons.append([InlineKeyboardButton(text="Получить", callback_data=f"get_free_{product.id}")])
+        else:
+            kb_buttons.append([
+                InlineKeyboardButton(text="Купить", callback_data=f"buy_{product.id}"),
+                InlineKeyboardButton(text="🛒 Добавить в корзину", callback_data=f"add_to_cart_{product.id}")
+            ])
+        kb_buttons.append([InlineKeyboardButton(text="Назад", callback_data=f"back_to_products_{product.id}")])
+        return Screen(text, InlineKeyboardMarkup(inline_keyboard=kb_buttons))
+    return _cached_screen("product", product_id, build)
+
+def render_search(query: str, products: tuple) -> Screen:
+    """Результаты поиска (без Markdown: в тексте запрос юзера)"""
+    if not products:
+        return _not_found(f"По запросу «{query}» ничего не найдено.", "back_to_categories")
+    kb_buttons = [
+        [InlineKeyboardButton(text=f"{product.name} | {product.price}$", callback_data=f"product_{product.id}")]
+        for product in products
+    ]
+    kb_buttons.append([InlineKeyboardButton(text="Назад", callback_data="back_to_categories")])
+    return Screen(f"Найдено по запросу «{query}»:", InlineKeyboardMarkup(inline_keyboard=kb_buttons))
\ No newline at end of file
@@ -9,4 +9,57 @@ ADMIN_ID = int(os.getenv("ADMIN_ID"))
 CHANNEL_ID = -1002015777041
 CHAT_ID = -1002042675240
 CHANNEL_INVITE = os.getenv("CHANNEL_INVITE")  # e.g., https://t.me/+abc123
-CHAT_INVITE = os.getenv("CHAT_INVITE")       # e.g., https://t.me/+xyz456
\ No newline at end of file
+CHAT_INVITE = os.getenv("CHAT_INVITE")       # e.g., https://t.me/+xyz456
+DB_READERS = int(os.getenv("DB_READERS", 4))  # Количество читающих соединений в пуле БД
+DB_JOURNAL_MODE = os.getenv("DB_JOURNAL_MODE", "WAL")  # WAL: чтения не блокируются записью
+DB_WRITE_BATCH = int(os.getenv("DB_WRITE_BATCH", 64))  # Максимум заявок на запись в одном коммите
+SUBSCRIPTION_TTL = int(os.getenv("SUBSCRIPTION_TTL", 300))  # Сколько секунд верить положительной проверке подписки
+SUBSCRIPTION_NEGATIVE_TTL = int(os.getenv("SUBSCRIPTION_NEGATIVE_TTL", 15))  # ...и отрицательной (короче, чтобы подписавшийся быстро получил доступ)
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", 100000))
+CRYPTOPAY_API_URL = os.getenv("CRYPTOPAY_API_URL", "https://pay.crypt.bot/api")  # Можно указать локальную заглушку для тестов
+CRYPTOPAY_TIMEOUT = float(os.getenv("CRYPTOPAY_TIMEOUT", 10))  # Таймаут одного запроса, сек
+CRYPTOPAY_MAX_RETRIES = int(os.getenv("CRYPTOPAY_MAX_RETRIES", 3))
+CRYPTOPAY_MAX_RETRY_AFTER = float(os.getenv("CRYPTOPAY_MAX_RETRY_AFTER", 30))  # Дольше этого по Retry-After не ждём - ошибка вызывающему, сек
+INVOICE_EXPIRES_IN = int(os.getenv("INVOICE_EXPIRES_IN", 3600))  # Время жизни инвойса, сек
+INVOICE_POLL_MIN_INTERVAL = float(os.getenv("INVOICE_POLL_MIN_INTERVAL", 3))  # Пауза опроса при ожидающих оплатах
+INVOICE_POLL_MAX_INTERVAL = float(os.getenv("INVOICE_POLL_MAX_INTERVAL", 30))  # Пауза опроса без ожидающих оплат
+CRYPTOPAY_WEBHOOK_PATH = os.getenv("CRYPTOPAY_WEBHOOK_PATH")  # e.g., /cryptopay; если не задан - только опрос инвойсов
+INVOICE_RECONCILE_INTERVAL = float(os.getenv("INVOICE_RECONCILE_INTERVAL", 300))  # Страховочный опрос при работе через вебхук
+WEB_HOST = os.getenv("WEB_HOST", "127.0.0.1")  # Встроенный HTTP-сервер (вебхуки)
+WEB_PORT = int(os.getenv("WEB_PORT", 8080))
+TELEGRAM_RATE = float(os.getenv("TELEGRAM_RATE", 30))  # Исходящих сообщений в секунду на весь бот (лимит Telegram); 0 - без ограничения
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", 1))  # Сообщений в секунду в один личный чат
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", 20))  # Сообщений в минуту в одну группу или канал
+TELEGRAM_CHAT_BURST = float(os.getenv("TELEGRAM_CHAT_BURST", 3))  # Сколько сообщений в чат уходит подряд без паузы
+TELEGRAM_BACKGROUND_RATE = float(os.getenv("TELEGRAM_BACKGROUND_RATE", 25))  # Из них на рассылки и выдачу товаров - остальное всегда остаётся интерактиву; 0 - без отдельного лимита
+TELEGRAM_MAX_RETRY_AFTER = float(os.getenv("TELEGRAM_MAX_RETRY_AFTER", 30))  # Дольше этого после 429 не ждём - ошибка вызывающему, сек
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 10))  # Одновременных запросов рассылки
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", 500))  # Получателей в одной выборке из БД
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", 5))  # Как часто обновлять прогресс у админа, сек
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", 8))  # Одновременных выдач товаров
+DELIVERY_BATCH = int(os.getenv("DELIVERY_BATCH", 100))  # Выдач в одной выборке из БД
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", 10))  # Попыток до отчёта админу; с паузами 5 с..10 мин это ~30 мин
+DELIVERY_RETRY_DELAY = float(os.getenv("DELIVERY_RETRY_DELAY", 5))  # Пауза перед первым повтором, дальше удваивается, сек
+DELIVERY_RETRY_MAX_DELAY = float(os.getenv("DELIVERY_RETRY_MAX_DELAY", 600))  # Максимальная пауза между повторами, сек
+DELIVERY_POLL_INTERVAL = float(os.getenv("DELIVERY_POLL_INTERVAL", 5))  # Проверка очереди без wake() (после сбоя БД и т.п.), сек
+CATALOG_PAGE_SIZE = int(os.getenv("CATALOG_PAGE_SIZE", 10))  # Товаров на странице каталога
+CATALOG_SCREEN_CACHE_SIZE = int(os.getenv("CATALOG_SCREEN_CACHE_SIZE", 10000))  # Готовых экранов каталога в памяти
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", 30))  # Строк на странице списка товаров в админке
+SEARCH_LIMIT = int(os.getenv("SEARCH_LIMIT", 20))  # Результатов поиска (в inline-режиме Telegram показывает до 50)
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", 1000))  # Недавних запросов в кэше
+SEARCH_CACHE_TIME = int(os.getenv("SEARCH_CACHE_TIME", 300))  # cache_time ответа на inline-запрос, сек
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")  # Свой Bot API сервер (например, fake_telegram.py для нагрузочных тестов); по умолчанию api.telegram.org
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")  # e.g., https://shop.example.com/telegram; если не задан - long polling
+TELEGRAM_WEBHOOK_PATH = os.getenv("TELEGRAM_WEBHOOK_PATH", "/telegram")  # Путь на встроенном HTTP-сервере (за reverse proxy)
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET")  # Если не задан - выводится из BOT_TOKEN
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))  # Апдейтов в очереди; при переполнении Telegram повторит доставку
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 32))  # Одновременно обрабатываемых апдейтов
+RUN_BACKGROUND_JOBS = os.getenv("RUN_BACKGROUND_JOBS", "1") == "1"  # Опрос инвойсов, выдача товаров и рассылки; 0 - выключить (например, у отладочного экземпляра)
+FSM_CACHE_SIZE = int(os.getenv("FSM_CACHE_SIZE", 10000))  # Состояний FSM активных юзеров в памяти
+FSM_FLUSH_INTERVAL = float(os.getenv("FSM_FLUSH_INTERVAL", 1))  # Как часто сбрасывать изменённые состояния в БД, сек
+METRICS_PATH = os.getenv("METRICS_PATH", "/metrics")  # Prometheus-метрики на встроенном HTTP-сервере; пусто - выключено
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")  # JSONL со спанами апдейтов; пусто - трассировка выключена
+TRACE_SLOW_MS = float(os.getenv("TRACE_SLOW_MS", 1000))  # Апдейты медленнее этого сохраняются всегда
+TRACE_SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", 0.01))  # ...остальные - с такой вероятностью
+TRACE_MAX_BYTES = int(os.getenv("TRACE_MAX_BYTES", 50 * 1024 * 1024))  # Размер файла до ротации
+TRACE_BACKUPS = int(os.getenv("TRACE_BACKUPS", 5))
\ No newline at end of file
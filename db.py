@@ -1,101 +1,539 @@
 import aiosqlite
+import asyncio
 import logging
-from datetime import datetime
+import time
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from config import DB_READERS, DB_JOURNAL_MODE, DB_WRITE_BATCH
+from metrics import observe_io
+from tracing import traced_connection
 
 DB_PATH = "traffic_shop.db"
 
+# Настройки SQLite для каждого соединения (journal_mode задаётся отдельно, только писателем)
+PRAGMAS = {
+    "synchronous": "NORMAL",  # В режиме WAL безопасно и без fsync на каждый коммит
+    "cache_size": -16000,  # ~16 МБ страничного кэша на соединение
+    "mmap_size": 268435456,  # 256 МБ memory-mapped I/O
+    "busy_timeout": 5000,  # мс ожидания блокировки вместо "database is locked"
+    "temp_store": "MEMORY",
+}
+
+SEARCH_RANK_DEPTH = 200  # Совпадений FTS5, среди которых bm25() выбирает лучшие
+
+class _WriteJob:
+    """Заявка на запись в очереди писателя"""
+    __slots__ = ("turn", "done", "committed")
+
+    def __init__(self):
+        loop = asyncio.get_running_loop()
+        self.turn = loop.create_future()  # соединение выдано заявке
+        self.done = loop.create_future()  # блок заявки завершён (True - успешно)
+        self.committed = loop.create_future()  # транзакция с заявкой закоммичена
+
+class ConnectionPool:
+    """Пул долгоживущих соединений: несколько читателей и один писатель.
+
+    Все записи проходят через одну фоновую задачу: заявки из очереди выполняются
+    по очереди (каждая в своём SAVEPOINT) и коммитятся одной транзакцией на пачку.
+    """
+
+    def __init__(self, path: str, readers: int = 4, journal_mode: str = "WAL", write_batch: int = 64):
+        self.path = path
+        self.readers_count = readers
+        self.journal_mode = journal_mode
+        self.write_batch = write_batch
+        self._readers = None
+        self._all_readers = []
+        self._writer = None
+        self._write_queue = None
+        self._writer_task = None
+
+    @property
+    def is_open(self) -> bool:
+        return self._writer is not None
+
+    async def _connect(self, **kwargs) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.path, **kwargs)
+        for name, value in PRAGMAS.items():
+            await conn.execute(f"PRAGMA {name} = {value}")
+        return conn
+
+    async def open(self):
+        """Открыть соединения (вызывается один раз при старте)"""
+        if self.is_open:
+            return
+        # Транзакциями писателя управляем вручную (BEGIN/SAVEPOINT/COMMIT)
+        self._writer = await self._connect(isolation_level=None)
+        cursor = await self._writer.execute(f"PRAGMA journal_mode = {self.journal_mode}")
+        journal_mode = (await cursor.fetchone())[0]
+        self._readers = asyncio.Queue()
+        for _ in range(self.readers_count):
+            conn = await self._connect()
+            await conn.execute("PRAGMA query_only = ON")
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+        self._write_queue = asyncio.Queue()
+        self._writer_task = asyncio.create_task(self._write_loop())
+        logging.info(f"DB pool opened: {self.readers_count} readers + 1 writer, journal_mode={journal_mode} ({self.path})")
+
+    async def close(self):
+        """Дождаться записи очереди и закрыть все соединения"""
+        if not self.is_open:
+            return
+        self._write_queue.put_nowait(None)
+        await self._writer_task
+        self._writer_task = None
+        self._write_queue = None
+        await self._writer.close()
+        self._writer = None
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers = []
+        self._readers = None
+        logging.info("DB pool closed")
+
+    async def _write_loop(self):
+        """Единственная задача-писатель: групповой коммит заявок из очереди"""
+        stopping = False
+        while not stopping:
+            job = await self._write_queue.get()
+            if job is None:
+                break
+            applied = []
+            try:
+                await self._writer.execute("BEGIN IMMEDIATE")
+                while True:
+                    if not job.turn.cancelled():
+                        await self._writer.execute("SAVEPOINT job")
+                        job.turn.set_result(self._writer)
+                        if await job.done:
+                            await self._writer.execute("RELEASE job")
+                            applied.append(job)
+                        else:
+                            await self._writer.execute("ROLLBACK TO job")
+                            await self._writer.execute("RELEASE job")
+                            job.committed.set_result(None)
+                    if len(applied) >= self.write_batch or self._write_queue.empty():
+                        break
+                    job = self._write_queue.get_nowait()
+                    if job is None:
+                        stopping = True
+                        break
+                await self._writer.execute("COMMIT")
+            except Exception as e:
+                logging.error(f"DB write batch failed: {e}")
+                if self._writer.in_transaction:
+                    try:
+                        await self._writer.execute("ROLLBACK")
+                    except Exception as rollback_error:
+                        logging.error(f"DB rollback failed: {rollback_error}")
+                for failed in applied:
+                    failed.committed.set_exception(e)
+                # Заявка, на которой упал BEGIN/SAVEPOINT/RELEASE, иначе ждала бы вечно
+                if job is not None and job not in applied:
+                    if not job.turn.done():
+                        job.turn.set_exception(e)
+                    elif not job.turn.cancelled() and not job.committed.done():
+                        job.committed.set_exception(e)
+                applied = []
+            for committed in applied:
+                committed.committed.set_result(None)
+
+    @asynccontextmanager
+    async def reader(self):
+        """Соединение только для чтения; возвращается в пул после блока"""
+        if not self.is_open:
+            raise RuntimeError("DB pool is not open")
+        started = time.perf_counter()
+        conn = await self._readers.get()
+        try:
+            yield traced_connection(conn)
+        finally:
+            self._readers.put_nowait(conn)
+            observe_io("sqlite", "read", time.perf_counter() - started)
+
+    @asynccontextmanager
+    async def writer(self):
+        """Пишущее соединение из очереди писателя.
+
+        Блок коммитится вместе с пачкой, при ошибке откатывается только он.
+        Пока блок выполняется, остальные записи ждут, поэтому внутри нельзя
+        обращаться к сети или открывать вложенный writer().
+        """
+        if not self.is_open:
+            raise RuntimeError("DB pool is not open")
+        started = time.perf_counter()
+        job = _WriteJob()
+        self._write_queue.put_nowait(job)
+        try:
+            conn = await job.turn
+        except asyncio.CancelledError:
+            if job.turn.done() and not job.turn.cancelled():
+                job.done.set_result(False)  # соединение уже выдано - вернуть его писателю
+            raise
+        try:
+            yield traced_connection(conn)
+        except BaseException:
+            job.done.set_result(False)
+            raise
+        job.done.set_result(True)
+        try:
+            await asyncio.shield(job.committed)
+        finally:
+            # Время с ожиданием очереди и коммита: столько запись стоила хендлеру
+            observe_io("sqlite", "write", time.perf_counter() - started)
+
+pool = ConnectionPool(DB_PATH, DB_READERS, DB_JOURNAL_MODE, DB_WRITE_BATCH)
+
+def _stats_trigger(name: str, event: str, when, ts: str, users: str, orders: str, revenue: str) -> str:
+    """Триггер, прибавляющий изменение к часовой, дневной и общей сводке"""
+    hour = f"strftime('%Y-%m-%d %H:00:00', COALESCE({ts}, CURRENT_TIMESTAMP))"
+    day = f"date(COALESCE({ts}, CURRENT_TIMESTAMP))"
+    values = f"{users}, {orders}, COALESCE({revenue}, 0)"
+    update = f"users = users + excluded.users, orders = orders + excluded.orders, revenue = revenue + excluded.revenue"
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS {name} AFTER {event}{f" WHEN {when}" if when else ""} BEGIN
+            INSERT INTO stats_hourly (hour, users, orders, revenue) VALUES ({hour}, {values})
+            ON CONFLICT (hour) DO UPDATE SET {update};
+            INSERT INTO stats_daily (day, users, orders, revenue) VALUES ({day}, {values})
+            ON CONFLICT (day) DO UPDATE SET {update};
+            UPDATE stats_totals SET users = users + {users}, orders = orders + {orders},
+                revenue = revenue + COALESCE({revenue}, 0);
+        END
+        """
+
+# Миграции схемы: (версия, описание, SQL-команды). Только добавлять в конец,
+# применённые миграции не менять.
+MIGRATIONS = [
+    (1, "Базовая схема", [
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            ref_id INTEGER,
+            balance REAL DEFAULT 0.0,
+            discount INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS categories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            parent_id INTEGER,  -- NULL для категорий, ID категории для подкатегорий
+            UNIQUE(name, parent_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS products (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            desc TEXT,
+            price REAL NOT NULL,
+            category_id INTEGER,
+            subcategory_id INTEGER,  -- NULL, если нет подкатегории
+            delivery_file TEXT,  -- Текст инструкции или file_id
+            media TEXT,  -- file_id для фото/гиф
+            FOREIGN KEY (category_id) REFERENCES categories(id),
+            FOREIGN KEY (subcategory_id) REFERENCES categories(id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS orders (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            product_id INTEGER,
+            amount REAL,
+            currency TEXT,
+            status TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS referrals (
+            user_id INTEGER,
+            ref_user_id INTEGER,
+            earnings REAL DEFAULT 0.0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS promocodes (
+            code TEXT PRIMARY KEY,
+            discount_percent INTEGER,
+            expiration TIMESTAMP,
+            max_uses INTEGER,
+            uses_count INTEGER DEFAULT 0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS cart (
+            user_id INTEGER,
+            product_id INTEGER,
+            quantity INTEGER DEFAULT 1,
+            PRIMARY KEY (user_id, product_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS invoices (
+            invoice_id TEXT PRIMARY KEY,
+            user_id INTEGER,
+            product_id INTEGER,
+            amount REAL,
+            payload TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS memberships (
+            chat_id INTEGER,
+            user_id INTEGER,
+            status TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (chat_id, user_id)
+        )
+        """,
+        """
+        INSERT OR IGNORE INTO categories (id, name, parent_id) VALUES
+        (1, 'Бесплатное', NULL),
+        (2, 'Обучения и схемы', NULL),
+        (3, 'Софты', 2),
+        (4, 'Обучения', 2)
+        """
+    ]),
+    (2, "Индексы для частых запросов", [
+        # Профиль и корзина: покупки юзера
+        "CREATE INDEX IF NOT EXISTS idx_orders_user_status ON orders (user_id, status)",
+        # Количество и сумма заработка рефералов (покрывающий индекс)
+        "CREATE INDEX IF NOT EXISTS idx_referrals_ref_user ON referrals (ref_user_id, earnings)",
+        # Товары категории без подкатегории и товары подкатегории
+        "CREATE INDEX IF NOT EXISTS idx_products_category ON products (category_id, subcategory_id)",
+        "CREATE INDEX IF NOT EXISTS idx_products_subcategory ON products (subcategory_id)",
+        # Диапазоны дат в статистике
+        "CREATE INDEX IF NOT EXISTS idx_users_created_at ON users (created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_orders_status_timestamp ON orders (status, timestamp, amount)",
+    ]),
+    (3, "Сводки статистики по часам и дням", [
+        """
+        CREATE TABLE IF NOT EXISTS stats_hourly (
+            hour TEXT PRIMARY KEY,  -- 'YYYY-MM-DD HH:00:00' (UTC)
+            users INTEGER DEFAULT 0,
+            orders INTEGER DEFAULT 0,
+            revenue REAL DEFAULT 0.0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stats_daily (
+            day TEXT PRIMARY KEY,  -- 'YYYY-MM-DD' (UTC)
+            users INTEGER DEFAULT 0,
+            orders INTEGER DEFAULT 0,
+            revenue REAL DEFAULT 0.0
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS stats_totals (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            users INTEGER DEFAULT 0,
+            orders INTEGER DEFAULT 0,
+            revenue REAL DEFAULT 0.0
+        )
+        """,
+        # Перенос уже накопленной истории
+        """
+        INSERT INTO stats_hourly (hour, users)
+        SELECT strftime('%Y-%m-%d %H:00:00', created_at), COUNT(*) FROM users WHERE true GROUP BY 1
+        ON CONFLICT (hour) DO UPDATE SET users = users + excluded.users
+        """,
+        """
+        INSERT INTO stats_hourly (hour, orders, revenue)
+        SELECT strftime('%Y-%m-%d %H:00:00', timestamp), COUNT(*), COALESCE(SUM(amount), 0)
+        FROM orders WHERE status = 'completed' GROUP BY 1
+        ON CONFLICT (hour) DO UPDATE SET orders = orders + excluded.orders, revenue = revenue + excluded.revenue
+        """,
+        """
+        INSERT INTO stats_daily (day, users)
+        SELECT date(created_at), COUNT(*) FROM users WHERE true GROUP BY 1
+        ON CONFLICT (day) DO UPDATE SET users = users + excluded.users
+        """,
+        """
+        INSERT INTO stats_daily (day, orders, revenue)
+        SELECT date(timestamp), COUNT(*), COALESCE(SUM(amount), 0)
+        FROM orders WHERE status = 'completed' GROUP BY 1
+        ON CONFLICT (day) DO UPDATE SET orders = orders + excluded.orders, revenue = revenue + excluded.revenue
+        """,
+        """
+        INSERT INTO stats_totals (id, users, orders, revenue) VALUES (1,
+            (SELECT COUNT(*) FROM users),
+            (SELECT COUNT(*) FROM orders WHERE status = 'completed'),
+            (SELECT COALESCE(SUM(amount), 0) FROM orders WHERE status = 'completed'))
+        """,
+        # Дальше сводки поддерживают триггеры, какой бы код ни писал в users/orders
+        _stats_trigger("stats_users_insert", "INSERT ON users", None, "NEW.created_at", "1", "0", "0"),
+        _stats_trigger("stats_users_delete", "DELETE ON users", None, "OLD.created_at", "-1", "0", "0"),
+        _stats_trigger("stats_orders_insert", "INSERT ON orders", "NEW.status = 'completed'",
+                       "NEW.timestamp", "0", "1", "NEW.amount"),
+        _stats_trigger("stats_orders_delete", "DELETE ON orders", "OLD.status = 'completed'",
+                       "OLD.timestamp", "0", "-1", "-OLD.amount"),
+        _stats_trigger("stats_orders_update_old", "UPDATE OF status, amount, timestamp ON orders",
+                       "OLD.status = 'completed'", "OLD.timestamp", "0", "-1", "-OLD.amount"),
+        _stats_trigger("stats_orders_update_new", "UPDATE OF status, amount, timestamp ON orders",
+                       "NEW.status = 'completed'", "NEW.timestamp", "0", "1", "NEW.amount"),
+    ]),
+    (4, "Рассылки", [
+        """
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            from_chat_id INTEGER,  -- Откуда копировать сообщение рассылки
+            message_id INTEGER,
+            progress_chat_id INTEGER,  -- Сообщение админу с прогрессом
+            progress_message_id INTEGER,
+            status TEXT DEFAULT 'running',  -- running, done, cancelled
+            total INTEGER,
+            sent INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS broadcast_deliveries (
+            broadcast_id INTEGER,
+            user_id INTEGER,
+            status TEXT,  -- sent, blocked, failed
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (5, "Хранилище FSM", [
+        """
+        CREATE TABLE IF NOT EXISTS fsm (
+            bot_id INTEGER,
+            chat_id INTEGER,
+            user_id INTEGER,
+            thread_id INTEGER,  -- 0, если нет темы
+            destiny TEXT,
+            state TEXT,
+            data TEXT,  -- JSON
+            PRIMARY KEY (bot_id, chat_id, user_id, thread_id, destiny)
+        ) WITHOUT ROWID
+        """,
+    ]),
+    (6, "Полнотекстовый поиск товаров", [
+        # Индекс без копии текста (content=products); префиксы для поиска по началу слова
+        """
+        CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+            name, "desc", content = 'products', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3'
+        )
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+            INSERT INTO products_fts (rowid, name, "desc") VALUES (NEW.id, NEW.name, NEW."desc");
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, "desc") VALUES ('delete', OLD.id, OLD.name, OLD."desc");
+        END
+        """,
+        """
+        CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, "desc" ON products BEGIN
+            INSERT INTO products_fts (products_fts, rowid, name, "desc") VALUES ('delete', OLD.id, OLD.name, OLD."desc");
+            INSERT INTO products_fts (rowid, name, "desc") VALUES (NEW.id, NEW.name, NEW."desc");
+        END
+        """,
+        "INSERT INTO products_fts (products_fts) VALUES ('rebuild')",
+    ]),
+    (7, "Заказы из нескольких товаров", [
+        """
+        CREATE TABLE IF NOT EXISTS order_groups (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            amount REAL,
+            status TEXT DEFAULT 'pending',  -- pending, paid, expired
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            paid_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS order_group_items (
+            group_id INTEGER,
+            product_id INTEGER,
+            price REAL,  -- Цена со скидкой на момент оформления
+            PRIMARY KEY (group_id, product_id)
+        ) WITHOUT ROWID
+        """,
+        "ALTER TABLE invoices ADD COLUMN group_id INTEGER",  # Инвойс на всю корзину
+    ]),
+    (8, "Очередь выдачи товаров", [
+        """
+        CREATE TABLE IF NOT EXISTS deliveries (
+            order_id INTEGER PRIMARY KEY,  -- Одна выдача на заказ
+            user_id INTEGER,
+            name TEXT,
+            delivery_file TEXT,  -- Копия на момент покупки: товар могут изменить или удалить
+            status TEXT DEFAULT 'pending',  -- pending, sent, dead
+            attempts INTEGER DEFAULT 0,
+            next_attempt_at REAL DEFAULT 0,  -- unix time
+            last_error TEXT,
+            reported INTEGER DEFAULT 0,  -- Админ уведомлён о невыданном товаре
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_deliveries_pending ON deliveries (next_attempt_at) WHERE status = 'pending'",
+        "CREATE INDEX IF NOT EXISTS idx_deliveries_unreported ON deliveries (order_id) WHERE status = 'dead' AND reported = 0",
+    ]),
+    (9, "Префиксы поиска до 4 символов", [
+        # Опции FTS5 не меняются через ALTER: пересоздаём индекс, триггеры ссылаются на него по имени
+        "DROP TABLE IF EXISTS products_fts",
+        """
+        CREATE VIRTUAL TABLE products_fts USING fts5(
+            name, "desc", content = 'products', content_rowid = 'id',
+            tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4'
+        )
+        """,
+        "INSERT INTO products_fts (products_fts) VALUES ('rebuild')",
+    ]),
+]
+
+async def get_schema_version(db) -> int:
+    await db.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INTEGER PRIMARY KEY,
+            description TEXT,
+            applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor = await db.execute("SELECT MAX(version) FROM schema_version")
+    return (await cursor.fetchone())[0] or 0
+
 async def init_db():
-    """Инициализация БД"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS users (
-                id INTEGER PRIMARY KEY,
-                ref_id INTEGER,
-                balance REAL DEFAULT 0.0,
-                discount INTEGER DEFAULT 0,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS categories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                parent_id INTEGER,  -- NULL для категорий, ID категории для подкатегорий
-                UNIQUE(name, parent_id)
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS products (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                desc TEXT,
-                price REAL NOT NULL,
-                category_id INTEGER,
-                subcategory_id INTEGER,  -- NULL, если нет подкатегории
-                delivery_file TEXT,  -- Текст инструкции или file_id
-                media TEXT,  -- file_id для фото/гиф
-                FOREIGN KEY (category_id) REFERENCES categories(id),
-                FOREIGN KEY (subcategory_id) REFERENCES categories(id)
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS orders (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id INTEGER,
-                product_id INTEGER,
-                amount REAL,
-                currency TEXT,
-                status TEXT,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS referrals (
-                user_id INTEGER,
-                ref_user_id INTEGER,
-                earnings REAL DEFAULT 0.0
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS promocodes (
-                code TEXT PRIMARY KEY,
-                discount_percent INTEGER,
-                expiration TIMESTAMP,
-                max_uses INTEGER,
-                uses_count INTEGER DEFAULT 0
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS cart (
-                user_id INTEGER,
-                product_id INTEGER,
-                quantity INTEGER DEFAULT 1,
-                PRIMARY KEY (user_id, product_id)
-            )
-        """)
-        await db.execute("""
-            CREATE TABLE IF NOT EXISTS invoices (
-                invoice_id TEXT PRIMARY KEY,
-                user_id INTEGER,
-                product_id INTEGER,
-                amount REAL,
-                payload TEXT
+    """Инициализация БД: применить недостающие миграции"""
+    latest = MIGRATIONS[-1][0]
+    async with pool.reader() as db:
+        cursor = await db.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'schema_version'")
+        if await cursor.fetchone():
+            cursor = await db.execute("SELECT MAX(version) FROM schema_version")
+            if (await cursor.fetchone())[0] == latest:
+                return  # Схема актуальна
+    async with pool.writer() as db:
+        current = await get_schema_version(db)
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+        # Каждая миграция - отдельный блок писателя: применяется целиком или никак
+        async with pool.writer() as db:
+            for statement in statements:
+                await db.execute(statement)
+            await db.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
             )
-        """)
-        # Тестовые категории
-        await db.execute("""
-            INSERT OR IGNORE INTO categories (id, name, parent_id) VALUES
-            (1, 'Бесплатное', NULL),
-            (2, 'Обучения и схемы', NULL),
-            (3, 'Софты', 2),
-            (4, 'Обучения', 2)
-        """)
-
-        await db.commit()
+        logging.info(f"Applied migration {version}: {description}")
 
 async def use_promocode(user_id: int, code: str) -> int:
     """Использовать промокод"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         cursor = await db.execute("""
             SELECT discount_percent, uses_count, max_uses, expiration
             FROM promocodes WHERE code = ?
@@ -111,20 +549,19 @@ async def use_promocode(user_id: int, code: str) -> int:
             await db.execute("""
                 UPDATE users SET discount = ? WHERE id = ?
             """, (discount, user_id))
-            await db.commit()
             return discount
         return 0
 
 async def get_purchases_count(user_id: int) -> int:
     """Количество покупок юзера"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         cursor = await db.execute("SELECT COUNT(*) FROM orders WHERE user_id = ? AND status = ?", (user_id, "completed"))
         count = await cursor.fetchone()
         return count[0]
 
 async def get_cart_items(user_id: int) -> list:
     """Получить товары в корзине"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         cursor = await db.execute("""
             SELECT p.id, p.name, p.price 
             FROM cart c 
@@ -135,49 +572,73 @@ async def get_cart_items(user_id: int) -> list:
 
 async def get_user(user_id: int) -> dict:
     """Получить данные юзера"""
-    async with aiosqlite.connect(DB_PATH) as db:
-        cursor = await db.execute("SELECT id, ref_id, balance, discount FROM users WHERE id = ?", (user_id,))
+    async with pool.reader() as db:
+        cursor = await db.execute("""
+            SELECT u.id, u.ref_id, u.balance, u.discount,
+                (SELECT COUNT(*) FROM referrals WHERE ref_user_id = u.id),
+                (SELECT SUM(earnings) FROM referrals WHERE ref_user_id = u.id)
+            FROM users u WHERE u.id = ?
+        """, (user_id,))
         user = await cursor.fetchone()
-        if user:
-            return {
-                "id": user[0],
-                "ref_id": user[1],
-                "balance": user[2],
-                "discount": user[3] or 0,
-                "referrals_count": await get_referrals_count(user_id),
-                "earnings": await get_referrals_earnings(user_id)
-            }
-        return None
+    if user:
+        return {
+            "id": user[0],
+            "ref_id": user[1],
+            "balance": user[2],
+            "discount": user[3] or 0,
+            "referrals_count": user[4],
+            "earnings": user[5] or 0.0
+        }
+    return None
+
+async def get_profile(user_id: int) -> dict:
+    """Данные для экрана профиля одним запросом"""
+    async with pool.reader() as db:
+        cursor = await db.execute("""
+            SELECT u.balance, u.discount,
+                (SELECT COUNT(*) FROM referrals WHERE ref_user_id = u.id),
+                (SELECT SUM(earnings) FROM referrals WHERE ref_user_id = u.id),
+                (SELECT COUNT(*) FROM orders WHERE user_id = u.id AND status = 'completed')
+            FROM users u WHERE u.id = ?
+        """, (user_id,))
+        profile = await cursor.fetchone()
+    if profile:
+        return {
+            "balance": profile[0],
+            "discount": profile[1] or 0,
+            "referrals_count": profile[2],
+            "earnings": profile[3] or 0.0,
+            "purchases_count": profile[4]
+        }
+    return None
 
 async def add_user(user_id: int, ref_id: int = None):
     """Добавить юзера"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute("INSERT OR IGNORE INTO users (id, ref_id) VALUES (?, ?)", (user_id, ref_id))
-        await db.commit()
 
 async def get_referrals_count(user_id: int) -> int:
     """Количество рефералов"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         cursor = await db.execute("SELECT COUNT(*) FROM referrals WHERE ref_user_id = ?", (user_id,))
         count = await cursor.fetchone()
         return count[0]
 
 async def get_referrals_earnings(user_id: int) -> float:
     """Заработок от рефералов"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         cursor = await db.execute("SELECT SUM(earnings) FROM referrals WHERE ref_user_id = ?", (user_id,))
         earnings = await cursor.fetchone()
         return earnings[0] or 0.0
 
 async def remove_from_cart(user_id: int, product_id: int):
     """Удалить товар из корзины"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         await db.execute("DELETE FROM cart WHERE user_id = ? AND product_id = ?", (user_id, product_id))
-        await db.commit()
 
 async def get_categories(parent_id: int = None) -> list:
     """Получить список категорий или подкатегорий"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.reader() as db:
         cursor = await db.execute(
             "SELECT id, name FROM categories WHERE parent_id IS ? ORDER BY name",
             (parent_id,)
@@ -186,23 +647,396 @@ async def get_categories(parent_id: int = None) -> list:
 
 async def add_category(name: str, parent_id: int = None) -> bool:
     """Добавить категорию или подкатегорию"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         try:
             await db.execute(
                 "INSERT INTO categories (name, parent_id) VALUES (?, ?)",
                 (name, parent_id)
             )
-            await db.commit()
             return True
         except aiosqlite.IntegrityError:
             return False
 
 async def delete_category(category_id: int) -> bool:
     """Удалить категорию или подкатегорию"""
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         cursor = await db.execute("SELECT COUNT(*) FROM products WHERE category_id = ? OR subcategory_id = ?", (category_id, category_id))
         if (await cursor.fetchone())[0] > 0:
             return False  # Нельзя удалить, если есть товары
         await db.execute("DELETE FROM categories WHERE id = ?", (category_id,))
-        await db.commit()
-        return True
\ No newline at end of file
+        return True
+
+async def get_memberships() -> list:
+    """Все известные статусы участников канала и чата"""
+    async with pool.reader() as db:
+        cursor = await db.execute("SELECT chat_id, user_id, status FROM memberships")
+        return await cursor.fetchall()
+
+async def set_membership(chat_id: int, user_id: int, status: str):
+    """Сохранить статус участника канала или чата"""
+    async with pool.writer() as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO memberships (chat_id, user_id, status, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)",
+            (chat_id, user_id, status)
+        )
+
+async def clear_memberships(chat_id: int):
+    """Забыть статусы участников чата (бот больше не получает его обновления)"""
+    async with pool.writer() as db:
+        await db.execute("DELETE FROM memberships WHERE chat_id = ?", (chat_id,))
+
+async def add_invoice(invoice_id, user_id: int, product_id: int, amount: float, payload: str, group_id: int = None):
+    """Запомнить открытый инвойс"""
+    async with pool.writer() as db:
+        await db.execute(
+            "INSERT OR REPLACE INTO invoices (invoice_id, user_id, product_id, amount, payload, group_id) VALUES (?, ?, ?, ?, ?, ?)",
+            (str(invoice_id), user_id, product_id, amount, payload, group_id)
+        )
+
+async def get_open_invoice_ids() -> list:
+    """ID всех ещё не закрытых инвойсов"""
+    async with pool.reader() as db:
+        cursor = await db.execute("SELECT invoice_id FROM invoices")
+        return [row[0] for row in await cursor.fetchall()]
+
+async def delete_invoice(invoice_id):
+    """Удалить инвойс (истёк или отменён)"""
+    async with pool.writer() as db:
+        await db.execute("""
+            UPDATE order_groups SET status = 'expired'
+            WHERE id = (SELECT group_id FROM invoices WHERE invoice_id = ?) AND status = 'pending'
+        """, (str(invoice_id),))
+        await db.execute("DELETE FROM invoices WHERE invoice_id = ?", (str(invoice_id),))
+
+async def complete_invoice(invoice_id) -> dict:
+    """Закрыть оплаченный инвойс: создать заказ или пополнить баланс.
+
+    Инвойс удаляется в той же транзакции, поэтому повторный вызов (поллинг и
+    вебхук одновременно) вернёт None и ничего не выдаст второй раз.
+    """
+    async with pool.writer() as db:
+        cursor = await db.execute(
+            "SELECT user_id, product_id, amount, group_id FROM invoices WHERE invoice_id = ?",
+            (str(invoice_id),)
+        )
+        invoice = await cursor.fetchone()
+        if not invoice:
+            return None
+        user_id, product_id, amount, group_id = invoice
+        await db.execute("DELETE FROM invoices WHERE invoice_id = ?", (str(invoice_id),))
+        if group_id is not None:
+            items = await _complete_order_group(db, group_id, user_id)
+            return {"user_id": user_id, "group_id": group_id, "amount": amount, "items": items}
+        if product_id == 0:
+            # Пополнение баланса
+            await db.execute("UPDATE users SET balance = balance + ? WHERE id = ?", (amount, user_id))
+            return {"user_id": user_id, "product_id": 0, "amount": amount}
+        cursor = await db.execute(
+            "INSERT INTO orders (user_id, product_id, amount, currency, status) VALUES (?, ?, ?, ?, ?)",
+            (user_id, product_id, amount, "USDT", "completed")
+        )
+        await _enqueue_deliveries(db, cursor.lastrowid - 1)
+    return {"user_id": user_id, "product_id": product_id, "amount": amount}
+
+async def create_free_order(user_id: int, product_id: int):
+    """Бесплатный заказ товара; выдача - через очередь"""
+    async with pool.writer() as db:
+        cursor = await db.execute(
+            "INSERT INTO orders (user_id, product_id, amount, status) VALUES (?, ?, ?, ?)",
+            (user_id, product_id, 0, "completed")
+        )
+        await _enqueue_deliveries(db, cursor.lastrowid - 1)
+
+async def create_order_group(user_id: int) -> dict:
+    """Оформить всю корзину как один заказ: цены со скидкой юзера фиксируются в order_group_items"""
+    async with pool.writer() as db:
+        cursor = await db.execute("""
+            SELECT c.product_id, p.price * (1 - COALESCE(u.discount, 0) / 100.0)
+            FROM cart c
+            JOIN products p ON p.id = c.product_id
+            LEFT JOIN users u ON u.id = c.user_id
+            WHERE c.user_id = ?
+        """, (user_id,))
+        items = await cursor.fetchall()
+        if not items:
+            return None
+        amount = round(sum(price for _, price in items), 2)
+        cursor = await db.execute(
+            "INSERT INTO order_groups (user_id, amount) VALUES (?, ?)",
+            (user_id, amount)
+        )
+        group_id = cursor.lastrowid
+        await db.executemany(
+            "INSERT INTO order_group_items (group_id, product_id, price) VALUES (?, ?, ?)",
+            [(group_id, product_id, price) for product_id, price in items]
+        )
+    return {"id": group_id, "user_id": user_id, "amount": amount, "count": len(items)}
+
+async def _complete_order_group(db, group_id: int, user_id: int) -> list:
+    """Провести оплаченный заказ в открытой транзакции: заказы по всем товарам, их выдача в очередь, очистка корзины"""
+    cursor = await db.execute(
+        "UPDATE order_groups SET status = 'paid', paid_at = CURRENT_TIMESTAMP WHERE id = ? AND status != 'paid'",
+        (group_id,)
+    )
+    if cursor.rowcount == 0:
+        return []  # Уже проведён
+    cursor = await db.execute("SELECT COALESCE(MAX(id), 0) FROM orders")
+    last_order_id = (await cursor.fetchone())[0]
+    await db.execute("""
+        INSERT INTO orders (user_id, product_id, amount, currency, status)
+        SELECT ?, product_id, price, 'USDT', 'completed' FROM order_group_items WHERE group_id = ?
+    """, (user_id, group_id))
+    await _enqueue_deliveries(db, last_order_id)
+    await db.execute("""
+        DELETE FROM cart
+        WHERE user_id = ? AND product_id IN (SELECT product_id FROM order_group_items WHERE group_id = ?)
+    """, (user_id, group_id))
+    cursor = await db.execute("""
+        SELECT i.product_id, COALESCE(p.name, '#' || i.product_id), p.delivery_file
+        FROM order_group_items i
+        LEFT JOIN products p ON p.id = i.product_id
+        WHERE i.group_id = ?
+    """, (group_id,))
+    return [
+        {"product_id": product_id, "name": name, "delivery_file": delivery_file}
+        for product_id, name, delivery_file in await cursor.fetchall()
+    ]
+
+async def complete_order_group(group_id: int, user_id: int) -> list:
+    """Провести заказ без инвойса (вся корзина бесплатна); товары к выдаче"""
+    async with pool.writer() as db:
+        return await _complete_order_group(db, group_id, user_id)
+
+async def _enqueue_deliveries(db, after_order_id: int):
+    """Поставить в очередь выдачу заказов, созданных в открытой транзакции (id больше after_order_id)"""
+    await db.execute("""
+        INSERT OR IGNORE INTO deliveries (order_id, user_id, name, delivery_file)
+        SELECT o.id, o.user_id, COALESCE(p.name, '#' || o.product_id), p.delivery_file
+        FROM orders o
+        LEFT JOIN products p ON p.id = o.product_id
+        WHERE o.id > ?
+    """, (after_order_id,))
+
+async def get_due_deliveries(now: float, limit: int) -> list:
+    """Выдачи, которые пора отправить (по времени следующей попытки)"""
+    async with pool.reader() as db:
+        cursor = await db.execute("""
+            SELECT order_id, user_id, name, delivery_file, attempts FROM deliveries
+            WHERE status = 'pending' AND next_attempt_at <= ?
+            ORDER BY next_attempt_at LIMIT ?
+        """, (now, limit))
+        rows = await cursor.fetchall()
+    keys = ("order_id", "user_id", "name", "delivery_file", "attempts")
+    return [dict(zip(keys, row)) for row in rows]
+
+async def get_next_delivery_time() -> float:
+    """Время ближайшей запланированной попытки выдачи или None"""
+    async with pool.reader() as db:
+        cursor = await db.execute("SELECT MIN(next_attempt_at) FROM deliveries WHERE status = 'pending'")
+        return (await cursor.fetchone())[0]
+
+async def mark_deliveries_sent(order_ids: list):
+    """Отметить выдачи отправленными"""
+    async with pool.writer() as db:
+        await db.executemany(
+            "UPDATE deliveries SET status = 'sent', sent_at = CURRENT_TIMESTAMP WHERE order_id = ?",
+            [(order_id,) for order_id in order_ids]
+        )
+
+async def retry_deliveries(order_ids: list, next_attempt_at: float, error: str, count_attempt: bool = True):
+    """Отложить выдачи до следующей попытки; count_attempt=False - попытка не засчитывается (флуд-контроль)"""
+    async with pool.writer() as db:
+        await db.executemany(
+            "UPDATE deliveries SET attempts = attempts + ?, next_attempt_at = ?, last_error = ? WHERE order_id = ?",
+            [(int(count_attempt), next_attempt_at, error, order_id) for order_id in order_ids]
+        )
+
+async def fail_deliveries(order_ids: list, error: str):
+    """Перенести выдачи в dead letter: повторять бесполезно или попытки исчерпаны"""
+    async with pool.writer() as db:
+        await db.executemany(
+            "UPDATE deliveries SET status = 'dead', attempts = attempts + 1, last_error = ? WHERE order_id = ?",
+            [(error, order_id) for order_id in order_ids]
+        )
+
+async def get_unreported_deliveries(limit: int) -> list:
+    """Невыданные товары, о которых админ ещё не знает"""
+    async with pool.reader() as db:
+        cursor = await db.execute("""
+            SELECT order_id, user_id, name, attempts, last_error FROM deliveries
+            WHERE status = 'dead' AND reported = 0
+            ORDER BY order_id LIMIT ?
+        """, (limit,))
+        rows = await cursor.fetchall()
+    keys = ("order_id", "user_id", "name", "attempts", "last_error")
+    return [dict(zip(keys, row)) for row in rows]
+
+async def mark_deliveries_reported(order_ids: list):
+    async with pool.writer() as db:
+        await db.executemany(
+            "UPDATE deliveries SET reported = 1 WHERE order_id = ?",
+            [(order_id,) for order_id in order_ids]
+        )
+
+async def create_broadcast(from_chat_id: int, message_id: int, progress_chat_id: int, progress_message_id: int) -> dict:
+    """Создать рассылку по всем пользователям"""
+    async with pool.writer() as db:
+        cursor = await db.execute("SELECT COUNT(*) FROM users")
+        total = (await cursor.fetchone())[0]
+        cursor = await db.execute("""
+            INSERT INTO broadcasts (from_chat_id, message_id, progress_chat_id, progress_message_id, total)
+            VALUES (?, ?, ?, ?, ?)
+        """, (from_chat_id, message_id, progress_chat_id, progress_message_id, total))
+        broadcast_id = cursor.lastrowid
+    return await get_broadcast(broadcast_id)
+
+async def get_broadcast(broadcast_id: int) -> dict:
+    """Получить рассылку"""
+    async with pool.reader() as db:
+        cursor = await db.execute("""
+            SELECT id, from_chat_id, message_id, progress_chat_id, progress_message_id,
+                status, total, sent, blocked, failed
+            FROM broadcasts WHERE id = ?
+        """, (broadcast_id,))
+        row = await cursor.fetchone()
+    if row:
+        keys = ("id", "from_chat_id", "message_id", "progress_chat_id", "progress_message_id",
+                "status", "total", "sent", "blocked", "failed")
+        return dict(zip(keys, row))
+    return None
+
+async def get_running_broadcast_ids() -> list:
+    """Незавершённые рассылки (для продолжения после перезапуска)"""
+    async with pool.reader() as db:
+        cursor = await db.execute("SELECT id FROM broadcasts WHERE status = 'running' ORDER BY id")
+        return [row[0] for row in await cursor.fetchall()]
+
+async def get_broadcast_recipients(broadcast_id: int, after_user_id: int, limit: int) -> list:
+    """Следующая пачка получателей по id, без уже обработанных"""
+    async with pool.reader() as db:
+        cursor = await db.execute("""
+            SELECT u.id FROM users u
+            WHERE u.id > ? AND NOT EXISTS (
+                SELECT 1 FROM broadcast_deliveries d WHERE d.broadcast_id = ? AND d.user_id = u.id
+            )
+            ORDER BY u.id LIMIT ?
+        """, (after_user_id, broadcast_id, limit))
+        return [row[0] for row in await cursor.fetchall()]
+
+async def save_broadcast_results(broadcast_id: int, results: list):
+    """Записать результаты отправки [(user_id, status)] и обновить счётчики"""
+    async with pool.writer() as db:
+        await db.executemany(
+            "INSERT OR IGNORE INTO broadcast_deliveries (broadcast_id, user_id, status) VALUES (?, ?, ?)",
+            [(broadcast_id, user_id, status) for user_id, status in results]
+        )
+        counts = {"sent": 0, "blocked": 0, "failed": 0}
+        for _, status in results:
+            counts[status] += 1
+        await db.execute("""
+            UPDATE broadcasts SET sent = sent + ?, blocked = blocked + ?, failed = failed + ? WHERE id = ?
+        """, (counts["sent"], counts["blocked"], counts["failed"], broadcast_id))
+
+async def finish_broadcast(broadcast_id: int, status: str):
+    """Завершить рассылку (done/cancelled)"""
+    async with pool.writer() as db:
+        await db.execute(
+            "UPDATE broadcasts SET status = ?, finished_at = CURRENT_TIMESTAMP WHERE id = ?",
+            (status, broadcast_id)
+        )
+
+async def search_product_ids(match: str, limit: int) -> list:
+    """id товаров по запросу FTS5: сначала совпадения в названии, затем в описании.
+
+    Внутри каждой ступени порядок по bm25(), но ранжируются только первые
+    SEARCH_RANK_DEPTH совпадений: полная сортировка по частому слову читает
+    весь его список вхождений. Описание ищется, только если названий мало.
+    """
+    async with pool.reader() as db:
+        cursor = await db.execute("""
+            SELECT rowid FROM (
+                SELECT rowid, rank FROM products_fts WHERE products_fts MATCH ? LIMIT ?
+            ) ORDER BY rank LIMIT ?
+        """, (f"{{name}} : ({match})", SEARCH_RANK_DEPTH, limit))
+        product_ids = [row[0] for row in await cursor.fetchall()]
+        if len(product_ids) < limit:
+            # Совпадение в названии весит больше, чем в описании
+            cursor = await db.execute("""
+                SELECT rowid FROM (
+                    SELECT rowid, bm25(products_fts, 10.0, 1.0) AS score FROM products_fts
+                    WHERE products_fts MATCH ? LIMIT ?
+                ) ORDER BY score LIMIT ?
+            """, (match, SEARCH_RANK_DEPTH + len(product_ids), limit + len(product_ids)))
+            found = set(product_ids)
+            product_ids += [row[0] for row in await cursor.fetchall() if row[0] not in found]
+    return product_ids[:limit]
+
+async def get_fsm_record(key: tuple) -> tuple:
+    """Состояние FSM и его данные (JSON) по ключу (bot_id, chat_id, user_id, thread_id, destiny)"""
+    async with pool.reader() as db:
+        cursor = await db.execute("""
+            SELECT state, data FROM fsm
+            WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?
+        """, key)
+        return await cursor.fetchone()
+
+async def save_fsm_records(records: list):
+    """Записать состояния FSM [(bot_id, chat_id, user_id, thread_id, destiny, state, data)]"""
+    # Пустые записи удаляем, чтобы таблица не росла за счёт давно ушедших юзеров
+    empty = [record[:5] for record in records if record[5] is None and record[6] == "{}"]
+    filled = [record for record in records if not (record[5] is None and record[6] == "{}")]
+    async with pool.writer() as db:
+        if empty:
+            await db.executemany("""
+                DELETE FROM fsm
+                WHERE bot_id = ? AND chat_id = ? AND user_id = ? AND thread_id = ? AND destiny = ?
+            """, empty)
+        if filled:
+            await db.executemany("""
+                INSERT INTO fsm (bot_id, chat_id, user_id, thread_id, destiny, state, data)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (bot_id, chat_id, user_id, thread_id, destiny)
+                DO UPDATE SET state = excluded.state, data = excluded.data
+            """, filled)
+
+_WINDOW_STATS_SQL = """
+    SELECT
+        (SELECT COUNT(*) FROM users WHERE created_at >= :start AND created_at < :hour)
+        + (SELECT COALESCE(SUM(users), 0) FROM stats_hourly WHERE hour >= :hour AND hour < :day)
+        + (SELECT COALESCE(SUM(users), 0) FROM stats_daily WHERE day >= date(:day)),
+        (SELECT COUNT(*) FROM orders WHERE status = 'completed' AND timestamp >= :start AND timestamp < :hour)
+        + (SELECT COALESCE(SUM(orders), 0) FROM stats_hourly WHERE hour >= :hour AND hour < :day)
+        + (SELECT COALESCE(SUM(orders), 0) FROM stats_daily WHERE day >= date(:day))
+"""
+
+def _window_bounds(start: datetime) -> dict:
+    """Разбить окно [start, ...) на хвост из сырых строк, полные часы и полные дни"""
+    hour = start.replace(minute=0, second=0, microsecond=0)
+    if hour < start:
+        hour += timedelta(hours=1)
+    day = hour.replace(hour=0)
+    if day < hour:
+        day += timedelta(days=1)
+    fmt = "%Y-%m-%d %H:%M:%S"
+    return {"start": start.strftime(fmt), "hour": hour.strftime(fmt), "day": day.strftime(fmt)}
+
+async def get_stats() -> dict:
+    """Статистика пользователей и заказов из сводок (окна считаются точно)"""
+    # Метки в БД пишет CURRENT_TIMESTAMP, то есть в UTC
+    now = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+    windows = {
+        "month": now - timedelta(days=30),
+        "week": now - timedelta(days=7),
+        "yesterday": now - timedelta(days=1),
+        "today": now.replace(hour=0, minute=0, second=0),
+        "hour": now - timedelta(hours=1),
+    }
+    stats = {"users": {}, "orders": {}}
+    async with pool.reader() as db:
+        cursor = await db.execute("SELECT users, orders, revenue FROM stats_totals WHERE id = 1")
+        stats["users"]["total"], stats["orders"]["total"], revenue = await cursor.fetchone()
+        stats["revenue"] = round(revenue, 2)  # Сумма копится инкрементально, убираем хвосты float
+        for name, start in windows.items():
+            cursor = await db.execute(_WINDOW_STATS_SQL, _window_bounds(start))
+            stats["users"][name], stats["orders"][name] = await cursor.fetchone()
+    return stats
@@ -0,0 +1,194 @@
+# delivery.py
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest, TelegramNotFound
+from aiogram.types import InputMediaDocument
+from config import (
+    ADMIN_ID, DELIVERY_WORKERS, DELIVERY_BATCH, DELIVERY_MAX_ATTEMPTS,
+    DELIVERY_RETRY_DELAY, DELIVERY_RETRY_MAX_DELAY, DELIVERY_POLL_INTERVAL
+)
+from db import (
+    get_due_deliveries, get_next_delivery_time, mark_deliveries_sent, retry_deliveries,
+    fail_deliveries, get_unreported_deliveries, mark_deliveries_reported
+)
+from metrics import registry
+from ratelimit import outbound_priority, BACKGROUND
+import asyncio
+import logging
+import time
+
+MEDIA_GROUP_SIZE = 10  # Лимит файлов в одном альбоме Telegram
+
+def split_items(items: list) -> list:
+    """Разбить товары на сообщения: альбомы до 10 файлов, товары без файла - одним списком"""
+    files = [item for item in items if item["delivery_file"]]
+    chunks = [files[i:i + MEDIA_GROUP_SIZE] for i in range(0, len(files), MEDIA_GROUP_SIZE)]
+    without_file = [item for item in items if not item["delivery_file"]]
+    if without_file:
+        chunks.append(without_file)
+    return chunks
+
+async def send_items(bot: Bot, user_id: int, items: list):
+    """Отправить одно сообщение с товарами (часть из split_items)"""
+    if not items[0]["delivery_file"]:
+        if len(items) == 1:
+            await bot.send_message(user_id, f"Ваш товар: {items[0]['name']}. Файл отсутствует.")
+        else:
+            names = "\n".join(item["name"] for item in items)
+            await bot.send_message(user_id, "Ваши товары (файл отсутствует):\n" + names, parse_mode=None)
+    elif len(items) == 1:
+        await bot.send_document(user_id, items[0]["delivery_file"], caption=f"Ваш товар: {items[0]['name']}")
+    else:
+        await bot.send_media_group(user_id, [
+            InputMediaDocument(media=item["delivery_file"], caption=f"Ваш товар: {item['name']}") for item in items
+        ])
+
+class DeliveryQueue:
+    """Выдача купленных товаров из таблицы deliveries с повторами.
+
+    Заказ и его выдача пишутся в одной транзакции, поэтому товар не теряется,
+    если Telegram недоступен или бот перезапустился. Отправленное помечается
+    sent и второй раз не уходит; выдачи, для которых повтор бесполезен или
+    попытки исчерпаны, переходят в dead и сообщаются админу.
+    """
+
+    PERMANENT_ERRORS = (TelegramForbiddenError, TelegramBadRequest, TelegramNotFound)
+    REPORT_LIMIT = 20  # Невыданных заказов в одном сообщении админу
+
+    def __init__(self, workers: int, batch_size: int, max_attempts: int,
+                 retry_delay: float, retry_max_delay: float, poll_interval: float):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self.poll_interval = poll_interval
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self, bot: Bot):
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """Заказ оплачен - выдать сразу, не дожидаясь опроса"""
+        self._wakeup.set()
+
+    def backoff(self, attempts: int) -> float:
+        """Пауза перед повтором после attempts неудачных попыток"""
+        return min(self.retry_delay * 2 ** (attempts - 1), self.retry_max_delay)
+
+    async def _deliver(self, bot: Bot, user_id: int, items: list):
+        chunks = split_items(items)
+        while chunks:
+            chunk = chunks.pop(0)
+            try:
+                await send_items(bot, user_id, chunk)
+            except TelegramBadRequest as e:
+                if len(chunk) > 1:
+                    # Альбом отклоняется целиком из-за одного файла - выдаём по одному, в dead уйдёт только он
+                    logging.warning(f"Delivery to {user_id}: {e}, sending {len(chunk)} items one by one")
+                    chunks[:0] = [[item] for item in chunk]
+                else:
+                    await asyncio.shield(self._failed(user_id, chunk, e))
+                continue
+            except Exception as e:
+                rest = chunk + [item for later in chunks for item in later]
+                await asyncio.shield(self._failed(user_id, rest, e))
+                return
+            await asyncio.shield(mark_deliveries_sent([item["order_id"] for item in chunk]))
+            registry.inc("bot_deliveries_total", len(chunk), "Purchased goods deliveries", result="sent")
+
+    async def _failed(self, user_id: int, items: list, error: Exception):
+        reason = f"{type(error).__name__}: {error}"[:200]
+        if isinstance(error, TelegramRetryAfter):
+            # Фон уже приостановлен в outbound_limiter; попытка не считается неудачной
+            dead = []
+        elif isinstance(error, self.PERMANENT_ERRORS):
+            dead = items  # Бот заблокирован, неверный file_id и т.п. (BadRequest приходит по одному товару)
+        else:
+            dead = [item for item in items if item["attempts"] + 1 >= self.max_attempts]
+        retry = [item for item in items if item not in dead]
+        if dead:
+            logging.error(f"Delivery to {user_id} failed, orders {[item['order_id'] for item in dead]}: {reason}")
+            await fail_deliveries([item["order_id"] for item in dead], reason)
+            registry.inc("bot_deliveries_total", len(dead), "Purchased goods deliveries", result="dead")
+            self.wake()  # Сообщить админу
+        if retry:
+            logging.warning(f"Delivery to {user_id} postponed, orders {[item['order_id'] for item in retry]}: {reason}")
+            schedule = {}
+            for item in retry:
+                if isinstance(error, TelegramRetryAfter):
+                    delay = error.retry_after
+                else:
+                    delay = self.backoff(item["attempts"] + 1)
+                schedule.setdefault(time.time() + delay, []).append(item["order_id"])
+            for next_attempt_at, order_ids in schedule.items():
+                await retry_deliveries(order_ids, next_attempt_at, reason,
+                                       count_attempt=not isinstance(error, TelegramRetryAfter))
+            registry.inc("bot_deliveries_total", len(retry), "Purchased goods deliveries", result="retry")
+
+    async def process(self, bot: Bot) -> int:
+        """Один круг: отправить выдачи, которым пора; возвращает их число"""
+        items = await get_due_deliveries(time.time(), self.batch_size)
+        by_user = {}
+        for item in items:
+            by_user.setdefault(item["user_id"], []).append(item)
+        queue = asyncio.Queue()
+        for job in by_user.items():
+            queue.put_nowait(job)
+
+        async def work():
+            while not queue.empty():
+                user_id, user_items = queue.get_nowait()
+                await self._deliver(bot, user_id, user_items)
+
+        results = await asyncio.gather(*(work() for _ in range(min(self.workers, len(by_user)))), return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result  # Не повторять круг сразу: неотмеченные выдачи ушли бы ещё раз
+        return len(items)
+
+    async def report(self, bot: Bot):
+        """Сообщить админу о товарах, которые не удалось выдать"""
+        items = await get_unreported_deliveries(self.REPORT_LIMIT)
+        if not items:
+            return
+        lines = [
+            f"#{item['order_id']} юзер {item['user_id']}: {item['name']} ({item['attempts']} попыток) - {item['last_error']}"
+            for item in items
+        ]
+        await bot.send_message(ADMIN_ID, "Не удалось выдать товары:\n" + "\n".join(lines), parse_mode=None)
+        await mark_deliveries_reported([item["order_id"] for item in items])
+
+    async def _run(self, bot: Bot):
+        outbound_priority.set(BACKGROUND)
+        while True:
+            self._wakeup.clear()
+            try:
+                if await self.process(bot):
+                    continue  # Возможно, в очереди есть ещё
+                await self.report(bot)
+                next_attempt_at = await get_next_delivery_time()
+            except Exception as e:
+                logging.error(f"Delivery queue error: {e}")
+                next_attempt_at = None
+            timeout = self.poll_interval
+            if next_attempt_at is not None:
+                timeout = min(timeout, max(0.0, next_attempt_at - time.time()))
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+delivery_queue = DeliveryQueue(
+    DELIVERY_WORKERS, DELIVERY_BATCH, DELIVERY_MAX_ATTEMPTS,
+    DELIVERY_RETRY_DELAY, DELIVERY_RETRY_MAX_DELAY, DELIVERY_POLL_INTERVAL
+)
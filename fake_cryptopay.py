@@ -0,0 +1,82 @@
+# fake_cryptopay.py
+"""Локальная замена Crypto Pay: шлёт подписанные invoice_paid на вебхук бота.
+
+Пример:
+    python fake_cryptopay.py --url http://127.0.0.1:8080/cryptopay --count 5000 --concurrency 50
+"""
+import argparse
+import asyncio
+import json
+import time
+import aiohttp
+from config import CRYPTOBOT_TOKEN
+from payments import CryptoPayWebhook, sign_webhook_body
+
+def make_update(update_id: int, invoice_id: int) -> bytes:
+    """Тело обновления invoice_paid в формате Crypto Pay"""
+    return json.dumps({
+        "update_id": update_id,
+        "update_type": "invoice_paid",
+        "request_date": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+        "payload": {
+            "invoice_id": invoice_id,
+            "status": "paid",
+            "asset": "USDT",
+            "amount": "1",
+            "paid_at": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+        }
+    }).encode()
+
+async def run(url: str, count: int, concurrency: int, first_invoice: int, duplicates: float, token: str):
+    latencies = []
+    statuses = {}
+    queue = asyncio.Queue()
+    for i in range(count):
+        queue.put_nowait(i)
+    dup_every = int(1 / duplicates) if duplicates > 0 else 0
+
+    async def worker(session: aiohttp.ClientSession):
+        while not queue.empty():
+            i = queue.get_nowait()
+            # Каждое dup_every-е обновление повторяет предыдущее (проверка дедупликации)
+            update_id = i - 1 if dup_every and i and i % dup_every == 0 else i
+            body = make_update(update_id, first_invoice + update_id)
+            headers = {
+                CryptoPayWebhook.SIGNATURE_HEADER: sign_webhook_body(body, token),
+                "Content-Type": "application/json"
+            }
+            started = time.perf_counter()
+            try:
+                async with session.post(url, data=body, headers=headers) as response:
+                    await response.read()
+                    status = response.status
+            except aiohttp.ClientError as e:
+                status = type(e).__name__
+            latencies.append(time.perf_counter() - started)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    async with aiohttp.ClientSession() as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def pct(p):
+        return latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000
+    print(f"Sent {count} updates in {elapsed:.2f}s: {count / elapsed:.0f} req/s")
+    print(f"Latency ms: p50={pct(0.5):.1f} p90={pct(0.9):.1f} p99={pct(0.99):.1f} max={latencies[-1] * 1000:.1f}")
+    print(f"Statuses: {statuses}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://127.0.0.1:8080/cryptopay")
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--first-invoice", type=int, default=1, help="invoice_id первого обновления")
+    parser.add_argument("--duplicates", type=float, default=0.0, help="доля повторных доставок (0..1)")
+    parser.add_argument("--token", default=CRYPTOBOT_TOKEN, help="токен, которым подписываются обновления")
+    args = parser.parse_args()
+    asyncio.run(run(args.url, args.count, args.concurrency, args.first_invoice, args.duplicates, args.token))
+
+if __name__ == "__main__":
+    main()
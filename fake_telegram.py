@@ -0,0 +1,316 @@
+# fake_telegram.py
+"""Локальная замена api.telegram.org для нагрузочных тестов main.py.
+
+Сервер сам генерирует апдейты по профилю нагрузки и отдаёт их через getUpdates
+или, если бот вызвал setWebhook, доставляет POST-запросами на его вебхук.
+Ответы на sendMessage/editMessageText/getChatMember и прочие методы можно
+задерживать и портить (429, 5xx, обрыв соединения). Раз в --report-interval
+печатается пропускная способность и задержка от создания апдейта до первого
+ответа бота в тот же чат. Бот не отправляет больше TELEGRAM_RATE сообщений
+в секунду; чтобы мерить пропускную способность самого бота, задайте TELEGRAM_RATE=0.
+
+Пример:
+    python fake_telegram.py --port 8081 --profile 20:30,100:60,300:60 --error-429 0.01
+    TELEGRAM_API_URL=http://127.0.0.1:8081 python main.py
+"""
+import argparse
+import asyncio
+import random
+import time
+from collections import deque
+import aiohttp
+from aiohttp import web
+
+FIRST_USER_ID = 20000000
+DEFAULT_MIX = "Товары:3,Профиль:2,Корзина:2,/start:1,cb:back_to_categories:2"
+
+def parse_profile(value: str) -> list:
+    """'50:30,200:60' -> [(50 апдейтов/с, 30 с), (200 апдейтов/с, 60 с)]"""
+    stages = []
+    for stage in value.split(","):
+        rate, _, seconds = stage.partition(":")
+        stages.append((float(rate), float(seconds)))
+    return stages
+
+def parse_mix(value: str) -> list:
+    """'Товары:3,cb:back_to_categories:2' -> [(тип, текст, вес)]"""
+    mix = []
+    for item in value.split(","):
+        body, _, weight = item.rpartition(":")
+        kind = "callback" if body.startswith("cb:") else "message"
+        mix.append((kind, body[3:] if kind == "callback" else body, float(weight)))
+    return mix
+
+def pct(values: list, p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))] * 1000 if values else 0.0
+
+class Stats:
+    def __init__(self):
+        self.created = 0
+        self.delivered = 0
+        self.replies = []  # задержки до ответа, сек
+        self.calls = {}  # метод -> количество
+        self.faults = {"429": 0, "5xx": 0, "network": 0}
+        self.webhook_statuses = {}
+
+class FakeTelegram:
+    def __init__(self, args):
+        self.args = args
+        self.mix = parse_mix(args.mix)
+        self.queue = deque()  # Неподтверждённые апдейты (getUpdates) или ждущие доставки (вебхук)
+        self.new_updates = asyncio.Event()
+        self.next_update_id = 1
+        self.served = 0  # Первый update_id, ещё не отданный через getUpdates
+        self.message_id = 0
+        self.pending = {}  # chat_id -> очередь времён создания апдейтов без ответа
+        self.callbacks = {}  # id callback-запроса -> chat_id
+        self.webhook = None  # (url, secret)
+        self.total = Stats()
+        self.interval = Stats()
+        self.done = False
+
+    # --- Генерация апдейтов ---
+
+    def make_update(self) -> dict:
+        update_id = self.next_update_id
+        self.next_update_id += 1
+        user_id = FIRST_USER_ID + random.randrange(self.args.users)
+        kind, text, _ = random.choices(self.mix, weights=[weight for *_, weight in self.mix])[0]
+        user = {"id": user_id, "is_bot": False, "first_name": "load", "username": f"load{user_id}"}
+        chat = {"id": user_id, "type": "private"}
+        self.message_id += 1
+        message = {"message_id": self.message_id, "date": int(time.time()), "chat": chat, "from": user, "text": text}
+        if kind == "message":
+            if text.startswith("/"):
+                message["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text.split()[0])}]
+            update = {"update_id": update_id, "message": message}
+        else:
+            callback_id = str(update_id)
+            self.callbacks[callback_id] = user_id
+            message.update(text="menu", **{"from": {"id": 1, "is_bot": True, "first_name": "bot"}})
+            update = {"update_id": update_id, "callback_query": {
+                "id": callback_id, "from": user, "chat_instance": str(user_id), "message": message, "data": text
+            }}
+        self.pending.setdefault(user_id, deque()).append(time.perf_counter())
+        return update
+
+    async def produce(self):
+        """Создавать апдейты с частотой по профилю нагрузки"""
+        for rate, seconds in parse_profile(self.args.profile):
+            print(f"Stage: {rate:g} updates/s for {seconds:g}s")
+            started = time.perf_counter()
+            made = 0
+            while (elapsed := time.perf_counter() - started) < seconds:
+                due = int(elapsed * rate) - made
+                for _ in range(due):
+                    self.queue.append(self.make_update())
+                    self.total.created += 1
+                    self.interval.created += 1
+                made += due
+                if due:
+                    self.new_updates.set()
+                await asyncio.sleep(0.01)
+
+    # --- Учёт ответов бота ---
+
+    def record_reply(self, chat_id):
+        try:
+            created = self.pending[int(chat_id)].popleft()
+        except (KeyError, IndexError, ValueError, TypeError):
+            return  # Сообщение не в ответ на апдейт (рассылка, уведомление админу)
+        latency = time.perf_counter() - created
+        self.total.replies.append(latency)
+        self.interval.replies.append(latency)
+
+    def mark_delivered(self, count: int):
+        self.total.delivered += count
+        self.interval.delivered += count
+
+    # --- Bot API ---
+
+    def fault(self):
+        """Случайная ошибка по настройкам или None"""
+        roll = random.random()
+        if roll < self.args.error_429:
+            return "429"
+        roll -= self.args.error_429
+        if roll < self.args.error_5xx:
+            return "5xx"
+        roll -= self.args.error_5xx
+        if roll < self.args.network_errors:
+            return "network"
+        return None
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        for stats in (self.total, self.interval):
+            stats.calls[method] = stats.calls.get(method, 0) + 1
+        if method.lower() != "getupdates" and self.args.latency:
+            await asyncio.sleep(random.uniform(0.5, 1.5) * self.args.latency / 1000)
+        fault = self.fault() if method.lower() not in ("getupdates", "getme", "setwebhook", "deletewebhook") else None
+        if fault:
+            self.total.faults[fault] += 1
+            self.interval.faults[fault] += 1
+            if fault == "429":
+                return web.json_response({
+                    "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 1",
+                    "parameters": {"retry_after": self.args.retry_after}
+                }, status=429)
+            if fault == "5xx":
+                return web.json_response({"ok": False, "error_code": 502, "description": "Bad Gateway"}, status=502)
+            request.transport.close()  # Обрыв соединения без ответа
+            return web.Response()
+        handler = getattr(self, f"api_{method.lower()}", self.api_default)
+        return web.json_response({"ok": True, "result": await handler(request, params)})
+
+    async def api_getme(self, request, params):
+        bot_id = int(request.match_info["token"].split(":")[0] or 1)
+        return {"id": bot_id, "is_bot": True, "first_name": "Fake", "username": "fake_shop_bot"}
+
+    async def api_getupdates(self, request, params):
+        offset = int(params.get("offset") or 0)
+        limit = int(params.get("limit") or 100)
+        timeout = float(params.get("timeout") or 0)
+        # Всё до offset бот подтвердил
+        while self.queue and self.queue[0]["update_id"] < offset:
+            self.queue.popleft()
+        if not self.queue and timeout and not self.done:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        batch = [update for _, update in zip(range(limit), self.queue)]
+        new = sum(1 for update in batch if update["update_id"] >= self.served)
+        if batch:
+            self.served = max(self.served, batch[-1]["update_id"] + 1)
+        self.mark_delivered(new)
+        return batch
+
+    async def api_setwebhook(self, request, params):
+        self.webhook = (params["url"], params.get("secret_token", ""))
+        print(f"Webhook set to {params['url']}")
+        return True
+
+    async def api_deletewebhook(self, request, params):
+        self.webhook = None
+        return True
+
+    async def api_getchatmember(self, request, params):
+        user_id = int(params["user_id"])
+        return {"status": "member", "user": {"id": user_id, "is_bot": False, "first_name": "load"}}
+
+    async def api_answercallbackquery(self, request, params):
+        self.record_reply(self.callbacks.pop(params.get("callback_query_id"), None))
+        return True
+
+    async def api_default(self, request, params):
+        """sendMessage, editMessageText, sendPhoto, copyMessage и т.п."""
+        chat_id = params.get("chat_id")
+        self.record_reply(chat_id)
+        if chat_id is None:
+            return True  # Inline-сообщение или метод без сообщения в ответе
+        self.message_id += 1
+        chat = {"id": int(chat_id) if chat_id.lstrip("-").isdigit() else 0, "type": "private"}
+        return {"message_id": params.get("message_id") and int(params["message_id"]) or self.message_id,
+                "date": int(time.time()), "chat": chat, "text": params.get("text") or params.get("caption")}
+
+    # --- Доставка на вебхук ---
+
+    async def push(self, session: aiohttp.ClientSession):
+        """Доставлять апдейты на вебхук бота, как Telegram: с повтором при ошибке"""
+        while not self.done or self.queue:
+            if self.webhook is None or not self.queue:
+                self.new_updates.clear()
+                try:
+                    await asyncio.wait_for(self.new_updates.wait(), 0.5)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            update = self.queue.popleft()
+            url, secret = self.webhook
+            try:
+                async with session.post(url, json=update, headers={"X-Telegram-Bot-Api-Secret-Token": secret}) as response:
+                    status = response.status
+            except aiohttp.ClientError as e:
+                status = type(e).__name__
+            for stats in (self.total, self.interval):
+                stats.webhook_statuses[status] = stats.webhook_statuses.get(status, 0) + 1
+            if status == 200:
+                self.mark_delivered(1)
+            else:
+                self.queue.appendleft(update)
+                await asyncio.sleep(1)
+
+    # --- Отчёт ---
+
+    def report(self, stats: Stats, elapsed: float, title: str):
+        replies = sorted(stats.replies)
+        pending = sum(len(times) for times in self.pending.values())
+        print(f"{title} created={stats.created} delivered={stats.delivered} ({stats.delivered / elapsed:.1f}/s) "
+              f"replies={len(replies)} ({len(replies) / elapsed:.1f}/s) pending={pending}")
+        print(f"{' ' * len(title)} reply ms: p50={pct(replies, 0.5):.0f} p95={pct(replies, 0.95):.0f} "
+              f"p99={pct(replies, 0.99):.0f} max={pct(replies, 1):.0f} faults={stats.faults}"
+              + (f" webhook={stats.webhook_statuses}" if stats.webhook_statuses else ""))
+
+    async def reporter(self):
+        started = last = time.perf_counter()
+        while not self.done:
+            await asyncio.sleep(self.args.report_interval)
+            now = time.perf_counter()
+            self.report(self.interval, now - last, f"[{now - started:6.0f}s]")
+            self.interval = Stats()
+            last = now
+
+async def run(args):
+    fake = FakeTelegram(args)
+    app = web.Application(client_max_size=50 * 1024 * 1024)
+    app.router.add_route("*", "/bot{token}/{method}", fake.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f"Fake Bot API on http://{args.host}:{args.port}, waiting {args.warmup:g}s for the bot to start")
+
+    async with aiohttp.ClientSession() as session:
+        pushers = [asyncio.create_task(fake.push(session)) for _ in range(args.webhook_connections)]
+        await asyncio.sleep(args.warmup)
+        reporter = asyncio.create_task(fake.reporter())
+        started = time.perf_counter()
+        await fake.produce()
+        # Даём боту дообработать хвост
+        deadline = time.perf_counter() + args.drain
+        while time.perf_counter() < deadline and any(fake.pending.values()):
+            await asyncio.sleep(0.1)
+        fake.done = True
+        fake.new_updates.set()
+        reporter.cancel()
+        print("\nTotal")
+        fake.report(fake.total, time.perf_counter() - started, "[ total]")
+        print(f"API calls: {dict(sorted(fake.total.calls.items(), key=lambda item: -item[1]))}")
+        for task in pushers:
+            task.cancel()
+        await asyncio.gather(*pushers, reporter, return_exceptions=True)
+    await runner.cleanup()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--profile", default="50:60", help="этапы нагрузки 'апдейтов/с:секунд,...'")
+    parser.add_argument("--users", type=int, default=1000, help="сколько разных юзеров шлют апдейты")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="тексты сообщений и cb:данные кнопок с весами")
+    parser.add_argument("--latency", type=float, default=0, help="средняя задержка ответа на методы, мс")
+    parser.add_argument("--error-429", type=float, default=0.0, help="доля ответов 429 Too Many Requests")
+    parser.add_argument("--retry-after", type=int, default=1, help="retry_after в ответах 429, сек")
+    parser.add_argument("--error-5xx", type=float, default=0.0, help="доля ответов 502")
+    parser.add_argument("--network-errors", type=float, default=0.0, help="доля обрывов соединения")
+    parser.add_argument("--webhook-connections", type=int, default=40, help="параллельных доставок на вебхук")
+    parser.add_argument("--warmup", type=float, default=5, help="пауза до начала нагрузки, сек")
+    parser.add_argument("--drain", type=float, default=10, help="сколько ждать ответов после нагрузки, сек")
+    parser.add_argument("--report-interval", type=float, default=10, help="как часто печатать статистику, сек")
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,216 @@
+# log_report.py
+"""Отчёт по задержкам и ошибкам из логов бота (bot.log, logs/bot.log, в т.ч. .gz).
+
+Файлы читаются построчно, в памяти держатся только гистограммы по периодам.
+
+Примеры:
+    python log_report.py bot.log logs/bot.log
+    python log_report.py logs/*.gz --hourly --since 2025-08-27
+    python log_report.py bot.log --baseline 2025-08-25..2025-08-31 --compare 2025-09-01..2025-09-02
+"""
+import argparse
+import gzip
+import math
+import re
+import sys
+from collections import Counter
+from datetime import datetime
+
+UPDATE_RE = re.compile(r"Update id=(\d+) is (handled|not handled)\. Duration (\d+) ms")
+ERROR_CLASS_RE = re.compile(r"^(?:[a-z_][\w.]*\.)?([A-Z]\w+)(?=: )|\b([A-Z]\w*(?:Error|Exception))\b")
+LOG_STEP = math.log(1.02)  # Точность гистограммы для длинных задержек: 2%
+
+class LatencyHistogram:
+    """Гистограмма задержек в мс: точная до 100 мс, логарифмическая выше"""
+
+    def __init__(self):
+        self.bins = Counter()
+        self.count = 0
+        self.handled = 0
+        self.max = 0
+        self.errors = 0
+
+    def add(self, ms: int, handled: bool):
+        key = ms if ms < 100 else 100 + int(math.log(ms / 100) / LOG_STEP)
+        self.bins[key] += 1
+        self.count += 1
+        self.handled += handled
+        self.max = max(self.max, ms)
+
+    def merge(self, other: "LatencyHistogram"):
+        self.bins.update(other.bins)
+        self.count += other.count
+        self.handled += other.handled
+        self.max = max(self.max, other.max)
+        self.errors += other.errors
+
+    def percentile(self, p: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = p * self.count
+        seen = 0
+        for key in sorted(self.bins):
+            seen += self.bins[key]
+            if seen >= rank:
+                return key if key < 100 else 100 * math.exp((key - 100 + 0.5) * LOG_STEP)
+        return float(self.max)
+
+def open_log(path: str):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, encoding="utf-8", errors="replace")
+
+def parse_time(value: str) -> datetime:
+    for fmt in ("%Y-%m-%d %H:%M:%S", "%Y-%m-%d %H:%M", "%Y-%m-%d %H", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(value, fmt)
+        except ValueError:
+            pass
+    raise argparse.ArgumentTypeError(f"bad time: {value}")
+
+def parse_range(value: str) -> tuple:
+    start, sep, end = value.partition("..")
+    if not sep:
+        raise argparse.ArgumentTypeError(f"expected FROM..TO, got {value}")
+    return parse_time(start), parse_time(end)
+
+def error_key(message: str) -> tuple:
+    """(класс ошибки, сигнатура сообщения без чисел)"""
+    match = ERROR_CLASS_RE.search(message)
+    error_class = match.group(match.lastindex) if match else message.split(":")[0][:40]
+    signature = message[match.end():] if match else message
+    signature = re.sub(r"\d+", "N", signature.lstrip(": ")).strip()[:80]
+    return error_class, signature
+
+class Report:
+    def __init__(self, since: datetime = None, until: datetime = None):
+        self.since = since
+        self.until = until
+        self.hours = {}  # "YYYY-MM-DD HH" -> LatencyHistogram
+        self.errors = Counter()  # (класс, сигнатура) -> количество
+        self.lines = 0
+        self.updates = 0
+
+    def _hour(self, key: str) -> LatencyHistogram:
+        histogram = self.hours.get(key)
+        if histogram is None:
+            histogram = self.hours[key] = LatencyHistogram()
+        return histogram
+
+    def feed(self, lines):
+        pending_cause = None  # Час ошибки, класс которой на следующей строке
+        for line in lines:
+            self.lines += 1
+            if len(line) < 24 or line[4] != "-" or line[19] != ",":
+                # Продолжение записи (traceback); после "Cause exception" первой идёт "Класс: сообщение"
+                if pending_cause and line.strip():
+                    self.errors[error_key(line.strip())] += 1
+                    pending_cause = None
+                continue
+            pending_cause = None
+            if self.since or self.until:
+                stamp = datetime.strptime(line[:19], "%Y-%m-%d %H:%M:%S")
+                if (self.since and stamp < self.since) or (self.until and stamp >= self.until):
+                    continue
+            hour = line[:13]
+            if " - INFO - " in line:
+                match = UPDATE_RE.search(line)
+                if match:
+                    self._hour(hour).add(int(match.group(3)), match.group(2) == "handled")
+                    self.updates += 1
+                continue
+            if " - ERROR - " not in line and " - CRITICAL - " not in line:
+                continue
+            self._hour(hour).errors += 1
+            message = line.split(" - ", 3)[-1].strip()
+            if message.startswith("Cause exception while process update"):
+                pending_cause = hour
+            else:
+                self.errors[error_key(message)] += 1
+
+    def grouped(self, by: str) -> dict:
+        if by == "hour":
+            return self.hours
+        days = {}
+        for hour, histogram in self.hours.items():
+            days.setdefault(hour[:10], LatencyHistogram()).merge(histogram)
+        return days
+
+    def window(self, start: datetime, end: datetime) -> LatencyHistogram:
+        total = LatencyHistogram()
+        for hour, histogram in self.hours.items():
+            if start <= datetime.strptime(hour, "%Y-%m-%d %H") < end:
+                total.merge(histogram)
+        return total
+
+def print_table(title: str, rows: dict):
+    print(f"\n{title}")
+    print(f"{'period':<14} {'updates':>8} {'handled':>8} {'errors':>7} {'p50':>8} {'p90':>8} {'p99':>8} {'max':>8}")
+    for period in sorted(rows):
+        h = rows[period]
+        if not h.count and not h.errors:
+            continue
+        print(f"{period:<14} {h.count:>8} {h.handled:>8} {h.errors:>7} "
+              f"{h.percentile(0.5):>8.0f} {h.percentile(0.9):>8.0f} {h.percentile(0.99):>8.0f} {h.max:>8}")
+
+def print_errors(errors: Counter, top: int):
+    print("\nErrors by class")
+    by_class = Counter()
+    for (error_class, _), count in errors.items():
+        by_class[error_class] += count
+    for error_class, count in by_class.most_common():
+        print(f"{count:>7}  {error_class}")
+        signatures = [(sig, n) for (cls, sig), n in errors.items() if cls == error_class]
+        for signature, n in sorted(signatures, key=lambda item: -item[1])[:top]:
+            print(f"{n:>15}  {signature}")
+
+def print_regression(baseline: LatencyHistogram, compare: LatencyHistogram, threshold: float):
+    print("\nRegression check (ms)")
+    print(f"{'metric':<8} {'baseline':>10} {'compare':>10} {'change':>9}")
+    regressions = []
+    metrics = [("p50", 0.5), ("p90", 0.9), ("p99", 0.99)]
+    for name, p in metrics:
+        before, after = baseline.percentile(p), compare.percentile(p)
+        change = (after - before) / before * 100 if before else 0.0
+        flag = " <-" if change > threshold else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<8} {before:>10.0f} {after:>10.0f} {change:>8.1f}%{flag}")
+    rate_before = baseline.errors / baseline.count * 100 if baseline.count else 0.0
+    rate_after = compare.errors / compare.count * 100 if compare.count else 0.0
+    print(f"{'errors':<8} {rate_before:>9.2f}% {rate_after:>9.2f}%")
+    print(f"{'updates':<8} {baseline.count:>10} {compare.count:>10}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("files", nargs="+", help="лог-файлы (.log или .gz)")
+    parser.add_argument("--since", type=parse_time, help="начало периода, YYYY-MM-DD[ HH[:MM[:SS]]]")
+    parser.add_argument("--until", type=parse_time, help="конец периода (не включительно)")
+    parser.add_argument("--hourly", action="store_true", help="таблица по часам в дополнение к дневной")
+    parser.add_argument("--top", type=int, default=3, help="сколько разных сообщений показывать на класс ошибки")
+    parser.add_argument("--baseline", type=parse_range, help="эталонный период FROM..TO")
+    parser.add_argument("--compare", type=parse_range, help="сравниваемый период FROM..TO")
+    parser.add_argument("--threshold", type=float, default=20.0, help="рост перцентиля в %%, считающийся регрессией")
+    args = parser.parse_args()
+    if bool(args.baseline) != bool(args.compare):
+        parser.error("--baseline and --compare go together")
+
+    report = Report(args.since, args.until)
+    for path in args.files:
+        with open_log(path) as lines:
+            report.feed(lines)
+    print(f"Read {report.lines} lines, {report.updates} updates from {len(args.files)} file(s)")
+
+    print_table("Per day (ms)", report.grouped("day"))
+    if args.hourly:
+        print_table("Per hour (ms)", report.grouped("hour"))
+    print_errors(report.errors, args.top)
+    if args.baseline:
+        regressions = print_regression(report.window(*args.baseline), report.window(*args.compare), args.threshold)
+        if regressions:
+            print(f"\nRegression: {', '.join(regressions)} grew more than {args.threshold:.0f}%")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -1,13 +1,31 @@
 import asyncio
 import logging
+import signal
+from aiohttp import web
 from aiogram import Bot, Dispatcher
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.types import BotCommand
 from bot import router as bot_router
 from admin import router as admin_router
-from config import BOT_TOKEN, ADMIN_ID
-from db import init_db, DB_PATH
-import aiosqlite
+from subscription import router as subscription_router, membership_index, subscription_cache
+from payments import crypto_pay, invoice_watcher, CryptoPayWebhook
+from config import (
+    BOT_TOKEN, ADMIN_ID, TELEGRAM_API_URL, CRYPTOPAY_WEBHOOK_PATH, INVOICE_RECONCILE_INTERVAL, WEB_HOST, WEB_PORT,
+    TELEGRAM_WEBHOOK_URL, TELEGRAM_WEBHOOK_PATH, TELEGRAM_WEBHOOK_SECRET, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS,
+    RUN_BACKGROUND_JOBS, FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL, METRICS_PATH,
+    TRACE_FILE, TRACE_SLOW_MS, TRACE_SAMPLE_RATE, TRACE_MAX_BYTES, TRACE_BACKUPS,
+    TELEGRAM_RATE, TELEGRAM_MAX_RETRY_AFTER
+)
+from db import init_db, pool
+from catalog import reload_catalog, screen_stats, search_stats
+from broadcast import broadcaster
+from delivery import delivery_queue
+from webhook import TelegramWebhook, default_secret
+from storage import SQLiteStorage
+from metrics import registry, MetricsMiddleware, TelegramMetricsMiddleware, instrument_router, handle_metrics
+from tracing import TraceExporter, TracingMiddleware, TracingRequestMiddleware
+from ratelimit import RateLimitMiddleware, outbound_limiter
 
 # Настройка логирования
 logging.basicConfig(
@@ -21,12 +39,11 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 async def clear_training_product():
-    async with aiosqlite.connect(DB_PATH) as db:
+    async with pool.writer() as db:
         cursor = await db.execute("SELECT id, name FROM products WHERE name = 'Граббер телеграм'")
         product = await cursor.fetchone()
         if product:
             await db.execute("DELETE FROM products WHERE name = 'Граббер телеграм'")
-            await db.commit()
             logger.info(f"Тренировочный товар '{product[1]}' (ID: {product[0]}) удалён")
         else:
             logger.info("Тренировочный товар не найден")
@@ -38,27 +55,114 @@ async def set_commands(bot: Bot):
         BotCommand(command="/catalog", description="Каталог"),
         BotCommand(command="/profile", description="Профиль"),
         BotCommand(command="/cart", description="Корзина"),
+        BotCommand(command="/search", description="Поиск товаров"),
         BotCommand(command="/help", description="Помощь"),
     ]
     await bot.set_my_commands(commands)
 
+def setup_metrics(bot: Bot, dp: Dispatcher, storage: SQLiteStorage):
+    """Подключить сбор метрик к диспетчеру, роутерам и сессии бота"""
+    dp.update.outer_middleware(MetricsMiddleware())
+    for router in (bot_router, admin_router, subscription_router):
+        instrument_router(router)
+    bot.session.middleware(TelegramMetricsMiddleware())
+    registry.collect("bot_cache_hits_total", "counter", "Cache hits", "cache", lambda: {
+        "subscription": subscription_cache.hits,
+        "catalog_screens": screen_stats["hits"],
+        "catalog_search": search_stats["hits"],
+        "fsm": storage.hits
+    })
+    registry.collect("bot_cache_misses_total", "counter", "Cache misses", "cache", lambda: {
+        "subscription": subscription_cache.misses,
+        "catalog_screens": screen_stats["misses"],
+        "catalog_search": search_stats["misses"],
+        "fsm": storage.misses
+    })
+
 async def main():
     logger.info("Starting bot...")
     
+    await pool.open()
     await clear_training_product()  # Удаляем тренировочный товар
     
-    bot = Bot(token=BOT_TOKEN, parse_mode="Markdown")
-    dp = Dispatcher(storage=MemoryStorage())
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL)) if TELEGRAM_API_URL else None
+    bot = Bot(token=BOT_TOKEN, parse_mode="Markdown", session=session)
+    storage = SQLiteStorage(FSM_CACHE_SIZE, FSM_FLUSH_INTERVAL)  # Состояния переживают перезапуск
+    dp = Dispatcher(storage=storage)
     dp.include_router(bot_router)
     dp.include_router(admin_router)
+    dp.include_router(subscription_router)
+    trace_exporter = None
+    if TRACE_FILE:
+        # Подключаем до метрик: корневой спан охватывает весь апдейт
+        trace_exporter = TraceExporter(TRACE_FILE, TRACE_SLOW_MS, TRACE_SAMPLE_RATE, TRACE_MAX_BYTES, TRACE_BACKUPS)
+        dp.update.outer_middleware(TracingMiddleware(trace_exporter))
+        bot.session.middleware(TracingRequestMiddleware())
+        trace_exporter.start()
+    if TELEGRAM_RATE:
+        # До метрик: ожидание лимита видно в спане вызова, но не портит задержки Bot API
+        bot.session.middleware(RateLimitMiddleware(outbound_limiter, TELEGRAM_MAX_RETRY_AFTER))
+    setup_metrics(bot, dp, storage)
     
     await init_db()
+    await reload_catalog()
+    await membership_index.load(bot)
     await set_commands(bot)
+    dp["bot_username"] = (await bot.get_me()).username  # Для реферальных ссылок, без get_me на каждый профиль
+    
+    app = web.Application()
+    if CRYPTOPAY_WEBHOOK_PATH:
+        # Оплаты приходят вебхуком, опрос инвойсов остаётся редкой страховкой
+        app.router.add_post(CRYPTOPAY_WEBHOOK_PATH, CryptoPayWebhook(bot).handle)
+        invoice_watcher.min_interval = invoice_watcher.max_interval = INVOICE_RECONCILE_INTERVAL
+        logger.info(f"CryptoPay webhook at {CRYPTOPAY_WEBHOOK_PATH}")
+    telegram_webhook = None
+    if TELEGRAM_WEBHOOK_URL:
+        secret = TELEGRAM_WEBHOOK_SECRET or default_secret(BOT_TOKEN)
+        telegram_webhook = TelegramWebhook(dp, bot, secret, WEBHOOK_QUEUE_SIZE, WEBHOOK_WORKERS)
+        app.router.add_post(TELEGRAM_WEBHOOK_PATH, telegram_webhook.handle)
+        telegram_webhook.start()
+    if METRICS_PATH:
+        app.router.add_get(METRICS_PATH, handle_metrics)
+    runner = None
+    if app.router.routes():
+        runner = web.AppRunner(app)
+        await runner.setup()
+        await web.TCPSite(runner, WEB_HOST, WEB_PORT).start()
+        logger.info(f"HTTP server listening on {WEB_HOST}:{WEB_PORT}")
+    if RUN_BACKGROUND_JOBS:
+        invoice_watcher.start(bot)
+        delivery_queue.start(bot)  # В т.ч. выдачи, не отправленные до прошлой остановки
+        await broadcaster.resume(bot)  # Рассылки, прерванные прошлой остановкой
     
     try:
-        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
+        # resolve_used_update_types() включает chat_member/my_chat_member из subscription_router
+        allowed_updates = dp.resolve_used_update_types()
+        if telegram_webhook is not None:
+            await bot.set_webhook(TELEGRAM_WEBHOOK_URL, secret_token=secret, allowed_updates=allowed_updates)
+            logger.info(f"Telegram webhook set to {TELEGRAM_WEBHOOK_URL}")
+            stop = asyncio.Event()
+            loop = asyncio.get_running_loop()
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.add_signal_handler(sig, stop.set)
+            await stop.wait()
+        else:
+            await bot.delete_webhook()  # getUpdates не работает при установленном вебхуке
+            await dp.start_polling(bot, allowed_updates=allowed_updates)
     finally:
+        if runner is not None:
+            await runner.cleanup()
+        if telegram_webhook is not None:
+            await telegram_webhook.stop()
+        await invoice_watcher.stop()
+        await delivery_queue.stop()
+        await broadcaster.stop()
         await bot.session.close()
+        await crypto_pay.close()
+        await storage.close()  # Сбросить несохранённые состояния до закрытия пула
+        await pool.close()
+        if trace_exporter is not None:
+            trace_exporter.stop()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,163 @@
+# metrics.py
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+import contextvars
+import time
+
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+class Histogram:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(BUCKETS):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+def _labels(labels: dict, extra: str = None) -> str:
+    parts = []
+    for name, value in labels.items():
+        value = str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+        parts.append(f'{name}="{value}"')
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+class Registry:
+    """Набор метрик процесса"""
+
+    def __init__(self):
+        self._meta = {}  # имя -> (тип, описание)
+        self._histograms = {}  # имя -> {метки: Histogram}
+        self._counters = {}  # имя -> {метки: значение}
+        self._collectors = []  # (имя, функция -> {значение метки: число}, имя метки)
+
+    def _declare(self, name: str, kind: str, help_text: str):
+        self._meta.setdefault(name, (kind, help_text))
+
+    def observe(self, name: str, value: float, help_text: str = "", **labels):
+        self._declare(name, "histogram", help_text)
+        key = tuple(labels.items())
+        series = self._histograms.setdefault(name, {})
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = Histogram()
+        histogram.observe(value)
+
+    def inc(self, name: str, value: float = 1, help_text: str = "", **labels):
+        self._declare(name, "counter", help_text)
+        series = self._counters.setdefault(name, {})
+        key = tuple(labels.items())
+        series[key] = series.get(key, 0) + value
+
+    def collect(self, name: str, kind: str, help_text: str, label: str, fn):
+        """Значения, которые считает другой модуль (например, попадания в кэш): читаются при выгрузке"""
+        self._declare(name, kind, help_text)
+        self._collectors.append((name, fn, label))
+
+    def render(self) -> str:
+        lines = []
+        for name, (kind, help_text) in self._meta.items():
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for key, histogram in self._histograms.get(name, {}).items():
+                labels = dict(key)
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    le = f'le="{bound}"'
+                    lines.append(f"{name}_bucket{_labels(labels, le)} {cumulative}")
+                le = 'le="+Inf"'
+                lines.append(f"{name}_bucket{_labels(labels, le)} {histogram.count}")
+                lines.append(f"{name}_sum{_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+            for key, value in self._counters.get(name, {}).items():
+                lines.append(f"{name}{_labels(dict(key))} {value}")
+            for collector_name, fn, label in self._collectors:
+                if collector_name == name:
+                    for label_value, value in fn().items():
+                        lines.append(f"{name}{_labels({label: label_value})} {value}")
+        return "\n".join(lines) + "\n"
+
+registry = Registry()
+
+class UpdateTiming:
+    """Разбивка времени одного апдейта по видам ввода-вывода"""
+    __slots__ = ("handler", "io")
+
+    def __init__(self):
+        self.handler = None
+        self.io = {"sqlite": 0.0, "telegram": 0.0, "cryptopay": 0.0}
+
+_current = contextvars.ContextVar("update_timing", default=None)
+
+def observe_io(io: str, operation: str, seconds: float):
+    """Учесть внешний вызов: в общей гистограмме и во времени текущего апдейта"""
+    registry.observe("bot_io_call_seconds", seconds, "Duration of a single SQLite block / API call",
+                     io=io, operation=operation)
+    timing = _current.get()
+    if timing is not None:
+        timing.io[io] += seconds
+
+class MetricsMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: время апдейта целиком и по видам ввода-вывода"""
+
+    async def __call__(self, handler, event, data):
+        timing = UpdateTiming()
+        token = _current.set(timing)
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception as e:
+            registry.inc("bot_update_errors_total", 1, "Updates that raised an exception",
+                         handler=timing.handler or "unhandled", error=type(e).__name__)
+            raise
+        finally:
+            _current.reset(token)
+            name = timing.handler or "unhandled"
+            registry.observe("bot_update_duration_seconds", time.perf_counter() - started,
+                             "Update processing time by handler", handler=name)
+            for io, seconds in timing.io.items():
+                registry.observe("bot_update_io_seconds", seconds,
+                                 "Time an update spent waiting on SQLite / Telegram / CryptoBot", handler=name, io=io)
+
+class HandlerNameMiddleware(BaseMiddleware):
+    """Внутренний middleware: запоминает, какой хендлер обработал апдейт"""
+
+    async def __call__(self, handler, event, data):
+        timing = _current.get()
+        if timing is not None:
+            timing.handler = data["handler"].callback.__name__
+        return await handler(event, data)
+
+def instrument_router(router):
+    """Подписать хендлеры роутера именами в метриках"""
+    for name, observer in router.observers.items():
+        if name != "error":
+            observer.middleware(HandlerNameMiddleware())
+
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: время и ошибки каждого вызова Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        except Exception as e:
+            registry.inc("bot_io_errors_total", 1, "Failed external calls", io="telegram", error=type(e).__name__)
+            raise
+        finally:
+            observe_io("telegram", type(method).__name__, time.perf_counter() - started)
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    """Выгрузка метрик для Prometheus"""
+    return web.Response(text=registry.render(), content_type="text/plain", charset="utf-8")
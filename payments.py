@@ -1,54 +1,333 @@
 # payments.py
-import requests
-from config import CRYPTOBOT_TOKEN
+import aiohttp
+import asyncio
+import hashlib
+import hmac
+import json
+import time
+from aiohttp import web
+from collections import deque
+from config import (
+    CRYPTOBOT_TOKEN, CRYPTOPAY_API_URL, CRYPTOPAY_TIMEOUT, CRYPTOPAY_MAX_RETRIES, CRYPTOPAY_MAX_RETRY_AFTER,
+    INVOICE_EXPIRES_IN, INVOICE_POLL_MIN_INTERVAL, INVOICE_POLL_MAX_INTERVAL
+)
+from db import add_invoice, get_open_invoice_ids, delete_invoice, complete_invoice
+from delivery import delivery_queue
+from metrics import observe_io, registry
+from tracing import span
 import logging
 from aiogram import Bot
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+class CryptoPayError(Exception):
+    """Ошибка Crypto Pay API (ok=false или исчерпаны повторы)"""
+
+class CryptoPayClient:
+    """Асинхронный клиент Crypto Pay API с одной keep-alive сессией"""
+
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+    MAX_INVOICES_PER_REQUEST = 1000  # Лимит count в getInvoices
+
+    def __init__(self, token: str, base_url: str, timeout: float = 10, max_retries: int = 3,
+                 max_retry_after: float = 30):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                headers={"Crypto-Pay-API-Token": self.token},
+                timeout=self.timeout,
+                connector=aiohttp.TCPConnector(limit=20, keepalive_timeout=60)
+            )
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+
+    async def request(self, method: str, payload: dict = None, params: dict = None, idempotent: bool = False):
+        """Вызвать метод API и вернуть поле result.
+
+        Повторяет запрос с экспоненциальной задержкой (или по Retry-After, но
+        не дольше max_retry_after) на 429 и несостоявшееся соединение. 5xx и
+        сетевые таймауты повторяются только для идемпотентных запросов: после
+        них инвойс мог уже создаться, и повтор создал бы второй.
+        """
+        started = time.perf_counter()
+        try:
+            with span(f"cryptopay.{method}"):
+                return await self._request(method, payload, params, idempotent)
+        except CryptoPayError as e:
+            registry.inc("bot_io_errors_total", 1, "Failed external calls", io="cryptopay",
+                         error=type(e.__cause__ or e).__name__)
+            raise
+        finally:
+            observe_io("cryptopay", method, time.perf_counter() - started)
+
+    async def _request(self, method: str, payload: dict, params: dict, idempotent: bool):
+        url = f"{self.base_url}/{method}"
+        session = self._get_session()
+        for attempt in range(self.max_retries + 1):
+            delay = min(0.5 * 2 ** attempt, 8)
+            try:
+                if payload is None:
+                    response = await session.get(url, params=params)
+                else:
+                    response = await session.post(url, json=payload)
+                async with response:
+                    # 429 - запрос отклонён до выполнения, его можно повторить и для createInvoice
+                    retryable = response.status == 429 or (idempotent and response.status in self.RETRY_STATUSES)
+                    if retryable and attempt < self.max_retries:
+                        retry_after = response.headers.get("Retry-After")
+                        if retry_after and retry_after.isdigit():
+                            delay = int(retry_after)
+                        if delay > self.max_retry_after:
+                            raise CryptoPayError(f"{method}: HTTP {response.status}, Retry-After {delay}s is too long")
+                        logging.warning(f"CryptoPay {method}: HTTP {response.status}, retry in {delay}s")
+                        await asyncio.sleep(delay)
+                        continue
+                    try:
+                        data = await response.json(content_type=None)
+                    except ValueError as e:
+                        # HTML-страница 5xx на последней попытке, ответ прокси и т.п.
+                        raise CryptoPayError(f"{method}: HTTP {response.status}, body is not JSON") from e
+            except aiohttp.ClientConnectorError as e:
+                # Соединение не установлено - запрос точно не дошёл
+                if attempt == self.max_retries:
+                    raise CryptoPayError(f"{method}: {e}") from e
+                logging.warning(f"CryptoPay {method}: {e}, retry in {delay}s")
+                await asyncio.sleep(delay)
+                continue
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if not idempotent or attempt == self.max_retries:
+                    raise CryptoPayError(f"{method}: {e!r}") from e
+                logging.warning(f"CryptoPay {method}: {e!r}, retry in {delay}s")
+                await asyncio.sleep(delay)
+                continue
+            if not isinstance(data, dict) or not data.get("ok"):
+                raise CryptoPayError(f"{method}: {data}")
+            return data["result"]
+        raise CryptoPayError(f"{method}: retries exhausted")
+
+    async def create_invoice(self, **params) -> dict:
+        return await self.request("createInvoice", params)
+
+    async def get_invoices(self, invoice_ids: list) -> list:
+        ids = ",".join(str(invoice_id) for invoice_id in invoice_ids)
+        params = {"invoice_ids": ids, "count": len(invoice_ids)}
+        result = await self.request("getInvoices", params=params, idempotent=True)
+        return result["items"]
+
+crypto_pay = CryptoPayClient(
+    CRYPTOBOT_TOKEN, CRYPTOPAY_API_URL, CRYPTOPAY_TIMEOUT, CRYPTOPAY_MAX_RETRIES, CRYPTOPAY_MAX_RETRY_AFTER
+)
+
 async def send_payment_request(bot: Bot, user_id: int, product_id: int, amount_usd: float):
     """Отправить запрос на оплату"""
-    url = "https://pay.crypt.bot/api/createInvoice"
-    headers = {"Crypto-Pay-API-Token": CRYPTOBOT_TOKEN}
-    payload = {
-        "amount": str(amount_usd),
-        "currency": "USD",
-        "asset": "USDT",  # Фиксируем USDT как единственный актив
-        "description": f"Покупка товара #{product_id}",
-        "payload": f"{user_id}_{product_id}",
-        "allowed_assets": ["USDT"]  # Ограничиваем только USDT
-    }
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        invoice = response.json()
-        if invoice.get("ok"):
-            invoice_id = invoice["result"]["invoice_id"]
-            payment_url = invoice["result"]["pay_url"]
-            kb = InlineKeyboardMarkup(inline_keyboard=[
-                [InlineKeyboardButton(text="Оплатить", url=payment_url)]
-            ])
-            await bot.send_message(
-                user_id,
-                f"Оплати {amount_usd}$ за товар #{product_id} в USDT:",
-                reply_markup=kb
-            )
-            return invoice_id
-        else:
-            logging.error(f"Failed to create invoice: {invoice}")
-            return None
-    except Exception as e:
-        logging.error(f"Error creating invoice: {e}, Response: {response.text if 'response' in locals() else 'No response'}")
+        invoice = await crypto_pay.create_invoice(
+            amount=str(amount_usd),
+            currency="USD",
+            asset="USDT",  # Фиксируем USDT как единственный актив
+            description=f"Покупка товара #{product_id}",
+            payload=f"{user_id}_{product_id}",
+            allowed_assets=["USDT"],  # Ограничиваем только USDT
+            expires_in=INVOICE_EXPIRES_IN
+        )
+    except CryptoPayError as e:
+        logging.error(f"Error creating invoice: {e}")
         return None
+    invoice_id = invoice["invoice_id"]
+    await add_invoice(invoice_id, user_id, product_id, amount_usd, f"{user_id}_{product_id}")
+    invoice_watcher.wake()
+    payment_url = invoice["pay_url"]
+    kb = InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Оплатить", url=payment_url)]
+    ])
+    await bot.send_message(
+        user_id,
+        f"Оплати {amount_usd}$ за товар #{product_id} в USDT:",
+        reply_markup=kb
+    )
+    return invoice_id
+
+async def create_cart_invoice(user_id: int, group: dict):
+    """Один инвойс на весь заказ из корзины; payload ссылается на заказ"""
+    payload = f"group_{group['id']}"
+    try:
+        invoice = await crypto_pay.create_invoice(
+            amount=str(group["amount"]),
+            currency="USD",
+            asset="USDT",
+            description=f"Заказ #{group['id']}: товаров {group['count']}",
+            payload=payload,
+            allowed_assets=["USDT"],
+            expires_in=INVOICE_EXPIRES_IN
+        )
+    except CryptoPayError as e:
+        logging.error(f"Error creating invoice: {e}")
+        return None
+    await add_invoice(invoice["invoice_id"], user_id, None, group["amount"], payload, group["id"])
+    invoice_watcher.wake()
+    return invoice
 
 async def check_invoice(invoice_id: str) -> bool:
     """Проверить статус инвойса"""
-    url = f"https://pay.crypt.bot/api/getInvoices?invoice_ids={invoice_id}"
-    headers = {"Crypto-Pay-API-Token": CRYPTOBOT_TOKEN}
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        invoice = response.json()["result"][0]
-        return invoice["status"] == "paid"
-    except Exception as e:
+        invoices = await crypto_pay.get_invoices([invoice_id])
+        return bool(invoices) and invoices[0]["status"] == "paid"
+    except CryptoPayError as e:
         logging.error(f"Error checking invoice: {e}")
-        return False
\ No newline at end of file
+        return False
+
+async def fulfill_invoice(bot: Bot, invoice_id) -> bool:
+    """Провести оплаченный инвойс (ровно один раз); товары выдаёт delivery_queue"""
+    result = await complete_invoice(invoice_id)
+    if result is None:
+        return False  # Уже проведён или неизвестен
+    user_id = result["user_id"]
+    if "group_id" in result:
+        logging.info(f"Invoice {invoice_id} paid: user {user_id}, order group {result['group_id']} "
+                     f"({len(result['items'])} items), {result['amount']}$")
+        delivery_queue.wake()
+        return True
+    logging.info(f"Invoice {invoice_id} paid: user {user_id}, product {result['product_id']}, {result['amount']}$")
+    if result["product_id"] != 0:
+        delivery_queue.wake()
+        return True
+    try:
+        await bot.send_message(user_id, f"Баланс пополнен на {result['amount']}$")
+    except Exception as e:
+        logging.error(f"Error notifying {user_id} about invoice {invoice_id}: {e}")
+    return True
+
+class InvoiceWatcher:
+    """Фоновый опрос открытых инвойсов пачками через getInvoices"""
+
+    def __init__(self, client: CryptoPayClient, min_interval: float, max_interval: float):
+        self.client = client
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def start(self, bot: Bot):
+        self._task = asyncio.create_task(self._run(bot))
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self):
+        """Новый инвойс создан - начать опрос, не дожидаясь паузы"""
+        self._wakeup.set()
+
+    def interval(self, pending: int) -> float:
+        """Пауза между опросами: чем больше запросов на круг, тем реже круги"""
+        if pending == 0:
+            return self.max_interval
+        requests = -(-pending // self.client.MAX_INVOICES_PER_REQUEST)
+        return min(max(self.min_interval, float(requests)), self.max_interval)
+
+    async def poll(self, bot: Bot) -> int:
+        """Один круг опроса; возвращает число открытых инвойсов"""
+        invoice_ids = await get_open_invoice_ids()
+        step = self.client.MAX_INVOICES_PER_REQUEST
+        for i in range(0, len(invoice_ids), step):
+            try:
+                invoices = await self.client.get_invoices(invoice_ids[i:i + step])
+            except CryptoPayError as e:
+                logging.error(f"Error polling invoices: {e}")
+                continue
+            for invoice in invoices:
+                if invoice["status"] == "paid":
+                    await fulfill_invoice(bot, invoice["invoice_id"])
+                elif invoice["status"] == "expired":
+                    await delete_invoice(invoice["invoice_id"])
+        return len(invoice_ids)
+
+    async def _run(self, bot: Bot):
+        while True:
+            self._wakeup.clear()
+            try:
+                pending = await self.poll(bot)
+            except Exception as e:
+                logging.error(f"Invoice watcher error: {e}")
+                pending = 0
+            if pending:
+                await asyncio.sleep(self.interval(pending))
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.max_interval)
+            except asyncio.TimeoutError:
+                continue
+            # Только что созданный инвойс оплатят не раньше, чем через несколько секунд
+            await asyncio.sleep(self.min_interval)
+
+invoice_watcher = InvoiceWatcher(crypto_pay, INVOICE_POLL_MIN_INTERVAL, INVOICE_POLL_MAX_INTERVAL)
+
+def sign_webhook_body(body: bytes, token: str = CRYPTOBOT_TOKEN) -> str:
+    """Подпись тела вебхука так, как её считает Crypto Pay"""
+    secret = hashlib.sha256(token.encode()).digest()
+    return hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+class CryptoPayWebhook:
+    """Приём обновлений invoice_paid от Crypto Pay по HTTP"""
+
+    SIGNATURE_HEADER = "crypto-pay-api-signature"
+
+    def __init__(self, bot: Bot, token: str = CRYPTOBOT_TOKEN, dedup_size: int = 10000):
+        self.bot = bot
+        self.token = token
+        self._seen = set()
+        self._seen_order = deque()
+        self.dedup_size = dedup_size
+
+    def _is_duplicate(self, update_id) -> bool:
+        if update_id in self._seen:
+            return True
+        self._seen.add(update_id)
+        self._seen_order.append(update_id)
+        if len(self._seen_order) > self.dedup_size:
+            self._seen.discard(self._seen_order.popleft())
+        return False
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        signature = request.headers.get(self.SIGNATURE_HEADER, "")
+        if not hmac.compare_digest(sign_webhook_body(body, self.token), signature):
+            logging.warning("CryptoPay webhook: bad signature")
+            return web.Response(status=401)
+        try:
+            update = json.loads(body)
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+        if update.get("update_type") != "invoice_paid":
+            return web.Response(text="ok")
+        payload = update.get("payload")
+        invoice_id = payload.get("invoice_id") if isinstance(payload, dict) else None
+        if invoice_id is None:
+            logging.warning(f"CryptoPay webhook: invoice_paid without invoice_id, update {update.get('update_id')}")
+            return web.Response(status=400)
+        if self._is_duplicate(update.get("update_id")):
+            return web.Response(text="ok")
+        try:
+            await fulfill_invoice(self.bot, invoice_id)
+        except Exception as e:
+            # Разрешаем Crypto Pay повторить доставку
+            self._seen.discard(update.get("update_id"))
+            logging.error(f"CryptoPay webhook: error fulfilling invoice {invoice_id}: {e}")
+            return web.Response(status=500)
+        return web.Response(text="ok")
\ No newline at end of file
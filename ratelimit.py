@@ -0,0 +1,190 @@
+# ratelimit.py
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from config import (
+    TELEGRAM_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_GROUP_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_BACKGROUND_RATE,
+    TELEGRAM_MAX_RETRY_AFTER
+)
+from contextvars import ContextVar
+from metrics import registry
+import asyncio
+import itertools
+import logging
+import time
+
+INTERACTIVE = 0  # Ответы на апдейты
+BACKGROUND = 1  # Рассылки, выдача товаров и прочие фоновые задачи
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+# Приоритет исходящих запросов текущей задачи; фоновые задачи ставят BACKGROUND в начале работы
+outbound_priority = ContextVar("outbound_priority", default=INTERACTIVE)
+
+LIMITED_METHODS = ("Send", "Copy", "Forward", "Edit")  # Методы, на которые действуют лимиты сообщений
+
+class RateBucket:
+    """Токены без ожидания внутри: когда и кого пропустить, решает планировщик"""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Сколько ждать до следующего токена (0 - можно отправлять)"""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_idle(self, now: float) -> bool:
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+class OutboundLimiter:
+    """Планировщик исходящих сообщений в рамках лимитов Telegram.
+
+    Запрос ждёт токен общего лимита бота и лимита своего чата (группы и каналы
+    медленнее личных чатов). Из ожидающих первым проходит интерактивный
+    запрос; фоновый - только если ни один интерактивный не может уйти сейчас
+    и не исчерпана доля фона (background_rate).
+    """
+
+    MAX_CHATS = 10000  # Корзин чатов в памяти; простаивающие удаляются
+
+    def __init__(self, rate: float, chat_rate: float, group_rate: float, chat_burst: float, background_rate: float = 0):
+        self.bucket = RateBucket(rate, max(1.0, rate / 10))  # Всплеск не больше 0.1 с трафика
+        self.background = RateBucket(background_rate, max(1.0, background_rate / 10)) if background_rate else None
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.chat_burst = chat_burst
+        self.chats = {}  # chat_id -> RateBucket
+        self.chat_paused = {}  # chat_id -> monotonic-время конца флуд-контроля
+        self.paused_until = {INTERACTIVE: 0.0, BACKGROUND: 0.0}
+        self._waiters = []  # (priority, seq, chat_id, future)
+        self._seq = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._task = None
+
+    def _chat_wait(self, chat_id, now: float) -> float:
+        if chat_id is None:
+            return 0.0
+        wait = 0.0
+        paused = self.chat_paused.get(chat_id)
+        if paused is not None:
+            if paused <= now:
+                del self.chat_paused[chat_id]
+            else:
+                wait = paused - now
+        bucket = self.chats.get(chat_id)
+        return max(wait, bucket.wait_time(now)) if bucket else wait
+
+    def _background_wait(self, priority: int, now: float) -> float:
+        if priority != BACKGROUND or self.background is None:
+            return 0.0
+        return self.background.wait_time(now)
+
+    def _take(self, chat_id, now: float, priority: int):
+        self.bucket.take()
+        if priority == BACKGROUND and self.background is not None:
+            self.background.take()
+        if chat_id is None:
+            return
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= self.MAX_CHATS:
+                self.chats = {key: value for key, value in self.chats.items() if not value.is_idle(now)}
+            # Отрицательный id или @username - группа или канал
+            is_private = isinstance(chat_id, int) and chat_id > 0
+            rate = self.chat_rate if is_private else self.group_rate / 60
+            bucket = self.chats[chat_id] = RateBucket(rate, self.chat_burst)
+        bucket.wait_time(now)
+        bucket.take()
+
+    async def acquire(self, chat_id, priority: int = INTERACTIVE):
+        """Дождаться разрешения на отправку сообщения в чат"""
+        now = time.monotonic()
+        if (not self._waiters and self.paused_until[priority] <= now and self.bucket.wait_time(now) <= 0
+                and self._background_wait(priority, now) <= 0 and self._chat_wait(chat_id, now) <= 0):
+            self._take(chat_id, now, priority)
+            return
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((priority, next(self._seq), chat_id, future))
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._dispatch())
+        self._wakeup.set()
+        await future
+        waited = time.monotonic() - now
+        registry.inc("bot_telegram_throttled_seconds_total", waited, "Time outbound calls waited for rate limits",
+                     priority=PRIORITY_NAMES[priority])
+
+    def retry_after(self, chat_id, seconds: float):
+        """Telegram ответил 429: приостановить чат, а фон - целиком, чтобы не мешал интерактиву"""
+        until = time.monotonic() + seconds
+        if chat_id is None:
+            self.paused_until[INTERACTIVE] = max(self.paused_until[INTERACTIVE], until)
+        else:
+            self.chat_paused[chat_id] = max(self.chat_paused.get(chat_id, 0.0), until)
+        self.paused_until[BACKGROUND] = max(self.paused_until[BACKGROUND], until)
+        self._wakeup.set()
+
+    async def _dispatch(self):
+        while True:
+            self._waiters = sorted(waiter for waiter in self._waiters if not waiter[3].done())
+            if not self._waiters:
+                return
+            now = time.monotonic()
+            chosen, delay = None, None
+            for waiter in self._waiters:
+                priority, _, chat_id, _ = waiter
+                wait = max(self.paused_until[priority] - now, self._chat_wait(chat_id, now),
+                           self._background_wait(priority, now))
+                if wait <= 0:
+                    chosen = waiter
+                    break
+                delay = wait if delay is None else min(delay, wait)
+            if chosen is not None:
+                delay = self.bucket.wait_time(now)
+                if delay <= 0:
+                    self._waiters.remove(chosen)
+                    self._take(chosen[2], now, chosen[0])
+                    chosen[3].set_result(None)
+                    continue
+            # Ждём токен или появления нового запроса, который может уйти раньше
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), delay)
+            except asyncio.TimeoutError:
+                pass
+
+class RateLimitMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: сообщения уходят по расписанию OutboundLimiter, после 429 - повтор в свою очередь"""
+
+    MAX_RETRIES = 3
+
+    def __init__(self, limiter: OutboundLimiter, max_retry_after: float):
+        self.limiter = limiter
+        self.max_retry_after = max_retry_after
+
+    async def __call__(self, make_request, bot, method):
+        name = type(method).__name__
+        if not name.startswith(LIMITED_METHODS):
+            return await make_request(bot, method)
+        chat_id = getattr(method, "chat_id", None)
+        priority = outbound_priority.get()
+        for attempt in range(self.MAX_RETRIES + 1):
+            await self.limiter.acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                self.limiter.retry_after(chat_id, e.retry_after)
+                registry.inc("bot_telegram_flood_waits_total", 1, "429 responses from Bot API",
+                             priority=PRIORITY_NAMES[priority])
+                if e.retry_after > self.max_retry_after or attempt == self.MAX_RETRIES:
+                    raise
+                logging.warning(f"Flood control on {name} to {chat_id}: retry in {e.retry_after}s")
+
+outbound_limiter = OutboundLimiter(
+    TELEGRAM_RATE, TELEGRAM_CHAT_RATE, TELEGRAM_GROUP_RATE, TELEGRAM_CHAT_BURST, TELEGRAM_BACKGROUND_RATE
+)
@@ -0,0 +1,111 @@
+# storage.py
+from collections import OrderedDict
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey, StateType
+from db import get_fsm_record, save_fsm_records
+import asyncio
+import json
+import logging
+
+class FSMRecord:
+    __slots__ = ("state", "data")
+
+    def __init__(self, state=None, data: dict = None):
+        self.state = state
+        self.data = data if data is not None else {}
+
+def _db_key(key: StorageKey) -> tuple:
+    return (key.bot_id, key.chat_id, key.user_id, key.thread_id or 0, key.destiny)
+
+class SQLiteStorage(BaseStorage):
+    """FSM-хранилище в traffic_shop.db с LRU-кэшем в памяти.
+
+    Чтения активных юзеров обслуживаются из кэша, изменения копятся и раз в
+    flush_interval пишутся в БД одной транзакцией. Давно не активные юзеры
+    вытесняются из кэша и при следующем апдейте читаются из БД.
+    """
+
+    def __init__(self, cache_size: int, flush_interval: float):
+        self.cache_size = cache_size
+        self.flush_interval = flush_interval
+        self._cache = OrderedDict()  # StorageKey -> FSMRecord
+        self._dirty = {}  # Изменённые, ещё не записанные
+        self._flushing = {}  # Записываемые прямо сейчас
+        self._task = None
+        self.hits = 0
+        self.misses = 0
+
+    async def _get_record(self, key: StorageKey) -> FSMRecord:
+        record = self._cache.get(key)
+        if record is not None:
+            self._cache.move_to_end(key)
+            self.hits += 1
+            return record
+        self.misses += 1
+        record = self._dirty.get(key) or self._flushing.get(key)
+        if record is None:
+            row = await get_fsm_record(_db_key(key))
+            # Пока ждали БД, запись могли загрузить параллельно
+            record = self._cache.get(key)
+            if record is not None:
+                return record
+            record = FSMRecord(row[0], json.loads(row[1])) if row else FSMRecord()
+        self._cache[key] = record
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+        return record
+
+    def _mark_dirty(self, key: StorageKey, record: FSMRecord):
+        self._dirty[key] = record
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._get_record(key)
+        record.state = state.state if isinstance(state, State) else state
+        self._mark_dirty(key, record)
+
+    async def get_state(self, key: StorageKey):
+        return (await self._get_record(key)).state
+
+    async def set_data(self, key: StorageKey, data: dict) -> None:
+        record = await self._get_record(key)
+        record.data = data.copy()
+        self._mark_dirty(key, record)
+
+    async def get_data(self, key: StorageKey) -> dict:
+        return (await self._get_record(key)).data.copy()
+
+    async def flush(self):
+        """Записать накопленные изменения в БД"""
+        if not self._dirty:
+            return
+        self._flushing, self._dirty = self._dirty, {}
+        records = [
+            _db_key(key) + (record.state, json.dumps(record.data, ensure_ascii=False, default=str))
+            for key, record in self._flushing.items()
+        ]
+        try:
+            await save_fsm_records(records)
+        except BaseException:
+            # Вернём в очередь и при отмене (остановка бота), более свежие изменения не затираем
+            for key, record in self._flushing.items():
+                self._dirty.setdefault(key, record)
+            raise
+        finally:
+            self._flushing = {}
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logging.error(f"Error flushing FSM storage: {e}")
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
@@ -0,0 +1,192 @@
+# subscription.py
+from aiogram import Bot, BaseMiddleware, F, Router
+from aiogram.types import Message, CallbackQuery, ChatMemberUpdated, InlineKeyboardMarkup, InlineKeyboardButton
+from config import (
+    ADMIN_ID, CHANNEL_ID, CHAT_ID, CHANNEL_INVITE, CHAT_INVITE,
+    SUBSCRIPTION_TTL, SUBSCRIPTION_NEGATIVE_TTL, SUBSCRIPTION_CACHE_SIZE
+)
+from db import get_memberships, set_membership, clear_memberships
+import asyncio
+import logging
+import time
+
+router = Router()
+
+def get_subscription_keyboard() -> InlineKeyboardMarkup:
+    """Клавиатура для проверки подписки"""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text="Подписаться на канал", url=CHANNEL_INVITE)],
+        [InlineKeyboardButton(text="Подписаться на чат", url=CHAT_INVITE)],
+        [InlineKeyboardButton(text="Проверить подписку", callback_data="check_subscription")]
+    ])
+
+def is_member_status(status: str) -> bool:
+    """Статус участника означает подписку"""
+    return status not in ("left", "kicked")
+
+class SubscriptionCache:
+    """Кэш результатов проверки подписки с разным TTL для "да" и "нет" """
+
+    def __init__(self, ttl: float, negative_ttl: float, max_size: int):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_size = max_size
+        self._items = {}  # user_id -> (подписан, истекает в)
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, user_id: int):
+        item = self._items.get(user_id)
+        if item is None or item[1] < time.monotonic():
+            self.misses += 1
+            return None
+        self.hits += 1
+        return item[0]
+
+    def set(self, user_id: int, subscribed: bool):
+        if len(self._items) >= self.max_size:
+            self._prune()
+        ttl = self.ttl if subscribed else self.negative_ttl
+        self._items[user_id] = (subscribed, time.monotonic() + ttl)
+
+    def invalidate(self, user_id: int):
+        self._items.pop(user_id, None)
+
+    def _prune(self):
+        now = time.monotonic()
+        self._items = {k: v for k, v in self._items.items() if v[1] >= now}
+        # Если живых записей всё ещё слишком много, выбрасываем самые старые
+        while len(self._items) >= self.max_size:
+            self._items.pop(next(iter(self._items)))
+
+class MembershipIndex:
+    """Локальный индекс участников канала и чата, обновляемый апдейтами chat_member.
+
+    Индексу доверяем только для чатов, где бот администратор: только тогда
+    Telegram присылает ему изменения состава участников.
+    """
+
+    def __init__(self, chat_ids: tuple):
+        self.chat_ids = chat_ids
+        self.tracked = set()
+        self._members = {chat_id: {} for chat_id in chat_ids}  # chat_id -> {user_id: подписан}
+
+    async def load(self, bot: Bot):
+        """Загрузить индекс из БД и выяснить, в каких чатах бот получает обновления"""
+        for chat_id in self.chat_ids:
+            try:
+                me = await bot.get_chat_member(chat_id, bot.id)
+            except Exception as e:
+                logging.error(f"Error checking bot rights in {chat_id}: {e}")
+                continue
+            if me.status in ("administrator", "creator"):
+                self.tracked.add(chat_id)
+        for chat_id, user_id, status in await get_memberships():
+            if chat_id in self.tracked:
+                self._members[chat_id][user_id] = is_member_status(status)
+        logging.info(f"Membership index loaded: tracked chats {sorted(self.tracked)}, "
+                     f"{sum(len(m) for m in self._members.values())} entries")
+
+    def get(self, user_id: int):
+        """True/False, если статус известен во всех чатах, иначе None"""
+        for chat_id in self.chat_ids:
+            if chat_id not in self.tracked:
+                return None
+            subscribed = self._members[chat_id].get(user_id)
+            if not subscribed:
+                return subscribed
+        return True
+
+    async def update(self, chat_id: int, user_id: int, status: str):
+        if chat_id not in self.tracked:
+            return
+        self._members[chat_id][user_id] = is_member_status(status)
+        await set_membership(chat_id, user_id, status)
+
+    async def set_tracked(self, chat_id: int, tracked: bool):
+        if tracked:
+            self.tracked.add(chat_id)
+        elif chat_id in self.tracked:
+            self.tracked.discard(chat_id)
+            self._members[chat_id] = {}
+            await clear_memberships(chat_id)
+
+membership_index = MembershipIndex((CHANNEL_ID, CHAT_ID))
+subscription_cache = SubscriptionCache(SUBSCRIPTION_TTL, SUBSCRIPTION_NEGATIVE_TTL, SUBSCRIPTION_CACHE_SIZE)
+_inflight = {}  # user_id -> задача проверки, чтобы одновременные апдейты не дублировали запросы
+
+async def _fetch_subscription(bot: Bot, user_id: int) -> bool:
+    """Запросить статус в канале и чате параллельно"""
+    try:
+        channel_member, chat_member = await asyncio.gather(
+            bot.get_chat_member(CHANNEL_ID, user_id),
+            bot.get_chat_member(CHAT_ID, user_id)
+        )
+    except Exception as e:
+        logging.error(f"Error checking subscription: {e}")
+        return False  # Ошибки не кэшируем
+    subscribed = is_member_status(channel_member.status) and is_member_status(chat_member.status)
+    subscription_cache.set(user_id, subscribed)
+    await membership_index.update(CHANNEL_ID, user_id, channel_member.status)
+    await membership_index.update(CHAT_ID, user_id, chat_member.status)
+    return subscribed
+
+async def check_subscription(bot: Bot, user_id: int, use_cache: bool = True) -> bool:
+    """Проверка подписки на канал и чат"""
+    known = membership_index.get(user_id)
+    # Отрицательный ответ индекса перепроверяем, если просят свежую проверку
+    if known or (known is False and use_cache):
+        return known
+    if use_cache:
+        cached = subscription_cache.get(user_id)
+        if cached is not None:
+            return cached
+    else:
+        subscription_cache.invalidate(user_id)
+    task = _inflight.get(user_id)
+    if task is None:
+        task = asyncio.ensure_future(_fetch_subscription(bot, user_id))
+        _inflight[user_id] = task
+        task.add_done_callback(lambda _: _inflight.pop(user_id, None))
+    return await asyncio.shield(task)
+
+class SubscriptionMiddleware(BaseMiddleware):
+    """Пропускает к хендлерам только подписчиков канала и чата"""
+
+    async def __call__(self, handler, event, data):
+        user = data.get("event_from_user")
+        if user is None or user.id == ADMIN_ID:
+            return await handler(event, data)
+        # Кнопка "Проверить подписку" сама делает свежую проверку
+        if isinstance(event, CallbackQuery) and event.data == "check_subscription":
+            return await handler(event, data)
+        if await check_subscription(data["bot"], user.id):
+            return await handler(event, data)
+
+        if isinstance(event, Message):
+            if event.text and event.text.startswith("/start"):
+                text = "Для использования бота подпишись на наш канал и чат!"
+            else:
+                text = "Подпишись на канал и чат!"
+            await event.answer(text, reply_markup=get_subscription_keyboard())
+        elif isinstance(event, CallbackQuery):
+            if event.message:
+                await event.message.edit_text(
+                    "Подпишись на канал и чат!",
+                    reply_markup=get_subscription_keyboard()
+                )
+            await event.answer()
+
+@router.chat_member(F.chat.id.in_({CHANNEL_ID, CHAT_ID}))
+async def on_chat_member(event: ChatMemberUpdated):
+    """Пользователь вступил или вышел из канала/чата"""
+    user_id = event.new_chat_member.user.id
+    await membership_index.update(event.chat.id, user_id, event.new_chat_member.status)
+    subscription_cache.invalidate(user_id)
+
+@router.my_chat_member(F.chat.id.in_({CHANNEL_ID, CHAT_ID}))
+async def on_my_chat_member(event: ChatMemberUpdated):
+    """Права бота в канале/чате изменились"""
+    tracked = event.new_chat_member.status in ("administrator", "creator")
+    await membership_index.set_tracked(event.chat.id, tracked)
+    logging.info(f"Membership tracking for {event.chat.id}: {tracked}")
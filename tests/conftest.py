@@ -0,0 +1,29 @@
+# tests/conftest.py
+import asyncio
+import os
+import sys
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# До импорта config: load_dotenv не перезаписывает уже заданные переменные
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.setdefault("CRYPTOBOT_TOKEN", "test")
+os.environ.setdefault("ADMIN_ID", "1")
+os.environ.setdefault("TRACE_FILE", "")
+
+import db
+
+@pytest.fixture
+def run_db(tmp_path):
+    """Выполнить корутину с открытым пулом на новой БД со всеми миграциями"""
+    def run(coro_fn, *args):
+        async def main():
+            db.pool.path = str(tmp_path / "test.db")
+            await db.pool.open()
+            try:
+                await db.init_db()
+                return await coro_fn(*args)
+            finally:
+                await db.pool.close()
+        return asyncio.run(main())
+    return run
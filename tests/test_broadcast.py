@@ -0,0 +1,48 @@
+# tests/test_broadcast.py
+import asyncio
+from types import SimpleNamespace
+import pytest
+from broadcast import Broadcaster
+import db
+
+class FakeBot:
+    """Бот, у которого copy_message падает на crash_at-м вызове (как при аварийной остановке)"""
+
+    def __init__(self, crash_at: int = None):
+        self.crash_at = crash_at
+        self.calls = 0
+        self.delivered = []
+
+    async def copy_message(self, chat_id, from_chat_id, message_id):
+        self.calls += 1
+        call = self.calls
+        await asyncio.sleep(0)
+        if call == self.crash_at:
+            raise RuntimeError("crash")
+        self.delivered.append(chat_id)
+
+    async def send_message(self, chat_id, text, **kwargs):
+        return SimpleNamespace(message_id=1)
+
+    async def edit_message_text(self, text, **kwargs):
+        pass
+
+def test_resumed_broadcast_does_not_resend(run_db):
+    async def scenario():
+        async with db.pool.writer() as conn:
+            await conn.executemany("INSERT INTO users (id) VALUES (?)", [(user_id,) for user_id in range(1, 31)])
+        broadcaster = Broadcaster(concurrency=3, batch_size=5, progress_interval=60)
+        crashed = FakeBot(crash_at=12)
+        broadcast_id = await broadcaster.start(crashed, 1, 1, 1)
+        with pytest.raises(ExceptionGroup):
+            await broadcaster._runs[broadcast_id].task
+        resumed = FakeBot()
+        await broadcaster.resume(resumed)
+        await asyncio.gather(*(run.task for run in broadcaster._runs.values()))
+        return crashed.delivered, resumed.delivered, await db.get_broadcast(broadcast_id)
+
+    before, after, info = run_db(scenario)
+    assert len(before) >= 11
+    assert not set(before) & set(after)
+    assert sorted(before + after) == list(range(1, 31))
+    assert info["status"] == "done" and info["sent"] == 30
@@ -0,0 +1,39 @@
+# tests/test_catalog.py
+import pytest
+import catalog
+from catalog import CatalogSnapshot, Category, Product
+from config import CATALOG_PAGE_SIZE
+
+@pytest.fixture
+def snapshot(monkeypatch):
+    products = [Product(i, f"Товар {i}", None, 1.0, 1, 2, None, None) for i in range(1, 26)]
+    snap = CatalogSnapshot(1, [Category(1, "Категория", None), Category(2, "Подкатегория", 1)], products)
+    monkeypatch.setattr(catalog, "_snapshot", snap)
+    monkeypatch.setattr(catalog, "_screens", catalog.OrderedDict())
+    return snap
+
+def page_ids(screen) -> list:
+    return [int(row[0].callback_data.split("_")[1]) for row in screen.reply_markup.inline_keyboard
+            if row[0].callback_data.startswith("product_")]
+
+def test_pages_follow_cursor(snapshot):
+    first = catalog.render_subcategory(2)
+    assert page_ids(first) == list(range(1, CATALOG_PAGE_SIZE + 1))
+    second = catalog.render_subcategory(2, f"a{CATALOG_PAGE_SIZE}")
+    assert page_ids(second) == list(range(CATALOG_PAGE_SIZE + 1, 2 * CATALOG_PAGE_SIZE + 1))
+    back = catalog.render_subcategory(2, f"b{CATALOG_PAGE_SIZE + 1}")
+    assert page_ids(back) == page_ids(first)
+
+def test_forged_cursors_share_cache_entries(snapshot):
+    # Любой id за последним товаром - это последняя страница, а не новая запись в кэше
+    for forged in ("a100", "a999999", "a123456789012"):
+        assert page_ids(catalog.render_subcategory(2, forged)) == list(range(26 - CATALOG_PAGE_SIZE, 26))
+    for forged in ("b0", "b1", "b2"):
+        assert page_ids(catalog.render_subcategory(2, forged)) == page_ids(catalog.render_subcategory(2))
+    assert len(catalog._screens) == 2
+
+def test_screen_cache_is_bounded(snapshot, monkeypatch):
+    monkeypatch.setattr(catalog, "CATALOG_SCREEN_CACHE_SIZE", 3)
+    for product_id in range(1, 20):
+        catalog.render_subcategory(2, f"a{product_id}")
+    assert len(catalog._screens) == 3
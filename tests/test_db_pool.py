@@ -0,0 +1,54 @@
+# tests/test_db_pool.py
+import asyncio
+import sqlite3
+import pytest
+import db
+
+def test_failed_block_rolls_back_only_itself(run_db):
+    async def scenario():
+        async def write(value, fail):
+            async with db.pool.writer() as conn:
+                await conn.execute("INSERT INTO promocodes (code, discount_percent) VALUES (?, 1)", (value,))
+                if fail:
+                    raise RuntimeError("boom")
+
+        results = await asyncio.gather(write("a", False), write("b", True), write("c", False), return_exceptions=True)
+        async with db.pool.reader() as conn:
+            cursor = await conn.execute("SELECT code FROM promocodes ORDER BY code")
+            codes = [row[0] for row in await cursor.fetchall()]
+        return results, codes
+
+    results, codes = run_db(scenario)
+    assert results[0] is None and results[2] is None
+    assert isinstance(results[1], RuntimeError)
+    assert codes == ["a", "c"]
+
+def test_locked_database_fails_writer_instead_of_hanging(tmp_path, monkeypatch):
+    monkeypatch.setitem(db.PRAGMAS, "busy_timeout", 100)
+    path = str(tmp_path / "locked.db")
+
+    async def scenario():
+        pool = db.ConnectionPool(path, readers=1)
+        await pool.open()
+        async with pool.writer() as conn:
+            await conn.execute("CREATE TABLE t (x INTEGER)")
+        other = sqlite3.connect(path, isolation_level=None)
+        other.execute("BEGIN IMMEDIATE")  # Запись из другого процесса
+        try:
+            with pytest.raises(sqlite3.OperationalError, match="locked"):
+                async with asyncio.timeout(5):
+                    async with pool.writer() as conn:
+                        await conn.execute("INSERT INTO t VALUES (1)")
+        finally:
+            other.execute("ROLLBACK")
+            other.close()
+        # Писатель жив и дальше
+        async with pool.writer() as conn:
+            await conn.execute("INSERT INTO t VALUES (2)")
+        async with pool.reader() as conn:
+            cursor = await conn.execute("SELECT x FROM t")
+            rows = await cursor.fetchall()
+        await pool.close()
+        return rows
+
+    assert asyncio.run(scenario()) == [(2,)]
@@ -0,0 +1,148 @@
+# tests/test_delivery.py
+from datetime import datetime
+from aiogram import Bot
+from aiogram.client.session.base import BaseSession
+from aiogram.exceptions import TelegramNetworkError, TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest
+from aiogram.types import Message, Chat
+from config import ADMIN_ID
+from delivery import DeliveryQueue
+import db
+import time
+
+USER_ID = 100
+
+class FakeSession(BaseSession):
+    """Bot API, который отвечает ошибкой error (пока она задана) или принимает сообщение"""
+
+    def __init__(self):
+        super().__init__()
+        self.error = None
+        self.bad_files = set()  # file_id, на которые Telegram отвечает 400
+        self.sent = []  # (chat_id, текст или file_id)
+
+    async def make_request(self, bot, method, timeout=None):
+        if self.error is not None:
+            raise self.error(method)
+        files = [media.media for media in getattr(method, "media", [])] or [getattr(method, "document", None)]
+        if self.bad_files.intersection(files):
+            raise TelegramBadRequest(method, "wrong file identifier/HTTP URL specified")
+        message = Message(message_id=1, date=datetime.now(), chat=Chat(id=method.chat_id, type="private"))
+        if type(method).__name__ == "SendMediaGroup":
+            self.sent += [(method.chat_id, file_id) for file_id in files]
+            return [message] * len(files)
+        self.sent.append((method.chat_id, getattr(method, "text", None) or files[0]))
+        return message
+
+    async def close(self):
+        pass
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b""
+
+async def order_delivery() -> int:
+    async with db.pool.writer() as conn:
+        cursor = await conn.execute("INSERT INTO products (name, price) VALUES ('Мануал', 0)")
+        product_id = cursor.lastrowid
+    await db.create_free_order(USER_ID, product_id)
+    async with db.pool.reader() as conn:
+        cursor = await conn.execute("SELECT MAX(order_id) FROM deliveries")
+        return (await cursor.fetchone())[0]
+
+async def delivery_state(order_id: int) -> tuple:
+    async with db.pool.reader() as conn:
+        cursor = await conn.execute(
+            "SELECT status, attempts, next_attempt_at, reported FROM deliveries WHERE order_id = ?", (order_id,)
+        )
+        return await cursor.fetchone()
+
+def new_queue() -> DeliveryQueue:
+    return DeliveryQueue(workers=2, batch_size=10, max_attempts=3, retry_delay=0, retry_max_delay=0, poll_interval=1)
+
+def test_transient_errors_retry_then_go_dead_and_reported(run_db):
+    async def scenario():
+        session = FakeSession()
+        bot = Bot("1:test", session=session)
+        queue = new_queue()
+        order_id = await order_delivery()
+        session.error = lambda method: TelegramNetworkError(method, "Cannot connect")
+        states = []
+        for _ in range(3):
+            await queue.process(bot)
+            states.append((await delivery_state(order_id))[:2])
+        session.error = None
+        processed = await queue.process(bot)  # В dead больше не выбирается
+        await queue.report(bot)
+        await queue.report(bot)  # Админ узнаёт один раз
+        return states, processed, await delivery_state(order_id), session.sent
+
+    states, processed, state, sent = run_db(scenario)
+    assert states == [("pending", 1), ("pending", 2), ("dead", 3)]
+    assert processed == 0
+    assert state[3] == 1
+    assert len(sent) == 1 and sent[0][0] == ADMIN_ID and "Мануал" in sent[0][1]
+
+def test_flood_control_does_not_use_up_attempts(run_db):
+    async def scenario():
+        session = FakeSession()
+        bot = Bot("1:test", session=session)
+        queue = new_queue()
+        order_id = await order_delivery()
+        session.error = lambda method: TelegramRetryAfter(method, "Too Many Requests", 30)
+        states = []
+        for _ in range(5):  # Больше max_attempts
+            await queue.process(bot)
+            states.append(await delivery_state(order_id))
+            async with db.pool.writer() as conn:  # Не ждать 30 с флуд-контроля
+                await conn.execute("UPDATE deliveries SET next_attempt_at = 0")
+        return states, time.time()
+
+    states, now = run_db(scenario)
+    assert [state[:2] for state in states] == [("pending", 0)] * 5
+    assert all(now + 20 < state[2] <= now + 30 for state in states)
+
+def test_blocked_user_goes_dead_at_once(run_db):
+    async def scenario():
+        session = FakeSession()
+        bot = Bot("1:test", session=session)
+        order_id = await order_delivery()
+        session.error = lambda method: TelegramForbiddenError(method, "bot was blocked by the user")
+        await new_queue().process(bot)
+        return await delivery_state(order_id)
+
+    assert run_db(scenario)[:2] == ("dead", 1)
+
+def test_sent_delivery_is_not_repeated(run_db):
+    async def scenario():
+        session = FakeSession()
+        bot = Bot("1:test", session=session)
+        queue = new_queue()
+        order_id = await order_delivery()
+        await queue.process(bot)
+        await queue.process(bot)
+        return await delivery_state(order_id), session.sent
+
+    state, sent = run_db(scenario)
+    assert state[0] == "sent"
+    assert [chat_id for chat_id, _ in sent] == [USER_ID]
+
+def test_bad_file_in_album_fails_only_that_item(run_db):
+    async def scenario():
+        session = FakeSession()
+        session.bad_files.add("file_2")
+        bot = Bot("1:test", session=session)
+        async with db.pool.writer() as conn:
+            for i in range(4):
+                cursor = await conn.execute(
+                    "INSERT INTO products (name, price, delivery_file) VALUES (?, 1, ?)", (f"Товар {i}", f"file_{i}")
+                )
+                await conn.execute("INSERT INTO cart (user_id, product_id) VALUES (?, ?)", (USER_ID, cursor.lastrowid))
+        group = await db.create_order_group(USER_ID)
+        await db.complete_order_group(group["id"], USER_ID)
+        await new_queue().process(bot)
+        async with db.pool.reader() as conn:
+            cursor = await conn.execute("SELECT delivery_file, status FROM deliveries ORDER BY order_id")
+            return dict(await cursor.fetchall()), session.sent
+
+    statuses, sent = run_db(scenario)
+    assert statuses == {"file_0": "sent", "file_1": "sent", "file_2": "dead", "file_3": "sent"}
+    assert sorted(file_id for _, file_id in sent) == ["file_0", "file_1", "file_3"]
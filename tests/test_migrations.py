@@ -0,0 +1,47 @@
+# tests/test_migrations.py
+import sqlite3
+import pytest
+import db
+
+async def schema_versions() -> list:
+    async with db.pool.reader() as conn:
+        cursor = await conn.execute("SELECT version FROM schema_version ORDER BY version")
+        return [row[0] for row in await cursor.fetchall()]
+
+async def promocodes() -> list:
+    async with db.pool.reader() as conn:
+        cursor = await conn.execute("SELECT code FROM promocodes")
+        return [row[0] for row in await cursor.fetchall()]
+
+def test_init_db_is_idempotent(run_db):
+    async def scenario():
+        async with db.pool.writer() as conn:
+            await conn.execute("INSERT INTO promocodes (code, discount_percent) VALUES ('SALE', 10)")
+        await db.init_db()
+        await db.pool.close()  # Перезапуск бота
+        await db.pool.open()
+        await db.init_db()
+        return await schema_versions(), await promocodes()
+
+    versions, codes = run_db(scenario)
+    assert versions == [version for version, _, _ in db.MIGRATIONS]
+    assert codes == ["SALE"]
+
+def test_failed_migration_is_not_applied(run_db, monkeypatch):
+    broken = (db.MIGRATIONS[-1][0] + 1, "Сломанная миграция", [
+        "CREATE TABLE extra (x INTEGER)",
+        "INSERT INTO missing VALUES (1)",
+    ])
+
+    async def scenario():
+        monkeypatch.setattr(db, "MIGRATIONS", db.MIGRATIONS + [broken])
+        with pytest.raises(sqlite3.OperationalError, match="missing"):
+            await db.init_db()
+        async with db.pool.reader() as conn:
+            cursor = await conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE name = 'extra'")
+            extra = (await cursor.fetchone())[0]
+        return extra, await schema_versions()
+
+    extra, versions = run_db(scenario)
+    assert extra == 0
+    assert versions[-1] == broken[0] - 1
@@ -0,0 +1,59 @@
+# tests/test_orders.py
+import asyncio
+import db
+
+USER_ID = 100
+
+async def add_product(price: float) -> int:
+    async with db.pool.writer() as conn:
+        cursor = await conn.execute("INSERT INTO products (name, price) VALUES ('Мануал', ?)", (price,))
+        return cursor.lastrowid
+
+async def count(sql: str, *args) -> int:
+    async with db.pool.reader() as conn:
+        cursor = await conn.execute(sql, args)
+        return (await cursor.fetchone())[0]
+
+def test_paid_invoice_is_completed_once(run_db):
+    async def scenario():
+        product_id = await add_product(5)
+        await db.add_invoice(1, USER_ID, product_id, 5, "payload")
+        # Поллинг и вебхук видят оплату одновременно, потом приходит повтор вебхука
+        results = list(await asyncio.gather(db.complete_invoice(1), db.complete_invoice(1)))
+        results.append(await db.complete_invoice(1))
+        return product_id, results, await count("SELECT COUNT(*) FROM orders"), await count("SELECT COUNT(*) FROM deliveries")
+
+    product_id, results, orders, deliveries = run_db(scenario)
+    assert results[0] == {"user_id": USER_ID, "product_id": product_id, "amount": 5}
+    assert results[1:] == [None, None]
+    assert (orders, deliveries) == (1, 1)
+
+def test_top_up_is_credited_once(run_db):
+    async def scenario():
+        async with db.pool.writer() as conn:
+            await conn.execute("INSERT INTO users (id, balance) VALUES (?, 10)", (USER_ID,))
+        await db.add_invoice(1, USER_ID, 0, 5, "payload")
+        await asyncio.gather(db.complete_invoice(1), db.complete_invoice(1))
+        return await count("SELECT balance FROM users WHERE id = ?", USER_ID)
+
+    assert run_db(scenario) == 15
+
+def test_cart_invoice_is_completed_once(run_db):
+    async def scenario():
+        product_ids = [await add_product(price) for price in (2, 3)]
+        async with db.pool.writer() as conn:
+            await conn.executemany("INSERT INTO cart (user_id, product_id) VALUES (?, ?)",
+                                   [(USER_ID, product_id) for product_id in product_ids])
+        group = await db.create_order_group(USER_ID)
+        await db.add_invoice(1, USER_ID, 0, group["amount"], "payload", group["id"])
+        results = await asyncio.gather(db.complete_invoice(1), db.complete_invoice(1))
+        repeated = await db.complete_order_group(group["id"], USER_ID)
+        return (product_ids, group, results, repeated, await count("SELECT COUNT(*) FROM orders"),
+                await count("SELECT COUNT(*) FROM deliveries"), await count("SELECT COUNT(*) FROM cart"))
+
+    product_ids, group, results, repeated, orders, deliveries, cart = run_db(scenario)
+    assert group["amount"] == 5 and group["count"] == 2
+    assert sorted(item["product_id"] for item in results[0]["items"]) == product_ids
+    assert results[1] is None
+    assert repeated == []
+    assert (orders, deliveries, cart) == (2, 2, 0)
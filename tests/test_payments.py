@@ -0,0 +1,96 @@
+# tests/test_payments.py
+import asyncio
+import json
+import aiohttp
+import pytest
+from aiohttp import web
+from payments import CryptoPayClient, CryptoPayError, CryptoPayWebhook, sign_webhook_body
+
+async def serve(handler):
+    app = web.Application()
+    app.router.add_route("*", "/{method}", handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    return runner, f"http://{host}:{port}"
+
+@pytest.mark.parametrize("status", [502, 403])
+def test_non_json_response_raises_cryptopay_error(status):
+    async def handler(request):
+        return web.Response(status=status, text="<html>Bad Gateway</html>", content_type="text/html")
+
+    async def scenario():
+        runner, url = await serve(handler)
+        client = CryptoPayClient("token", url, timeout=5, max_retries=1)
+        try:
+            with pytest.raises(CryptoPayError, match="not JSON"):
+                await client.request("getInvoices", params={"invoice_ids": "1"}, idempotent=True)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+def call_create_invoice(responses: list, max_retry_after: float = 30):
+    """createInvoice к серверу, отвечающему responses по очереди; результат или ошибка и число запросов"""
+    calls = []
+
+    async def handler(request):
+        calls.append(request.method)
+        status, headers = responses[min(len(calls), len(responses)) - 1]
+        if status != 200:
+            return web.json_response({"ok": False, "error": {"code": status}}, status=status, headers=headers)
+        return web.json_response({"ok": True, "result": {"invoice_id": 1}})
+
+    async def scenario():
+        runner, url = await serve(handler)
+        client = CryptoPayClient("token", url, timeout=5, max_retries=2, max_retry_after=max_retry_after)
+        try:
+            return await client.create_invoice(amount="1")
+        except CryptoPayError as e:
+            return e
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    return asyncio.run(scenario()), calls
+
+@pytest.mark.parametrize("status", [500, 502, 504])
+def test_create_invoice_is_not_retried_after_server_error(status):
+    result, calls = call_create_invoice([(status, {})])
+    assert isinstance(result, CryptoPayError)
+    assert calls == ["POST"]  # Инвойс мог создаться - второй запрос создал бы дубль
+
+def test_create_invoice_is_retried_after_429():
+    result, calls = call_create_invoice([(429, {"Retry-After": "0"}), (200, {})])
+    assert result == {"invoice_id": 1}
+    assert len(calls) == 2
+
+def test_long_retry_after_fails_instead_of_waiting():
+    result, calls = call_create_invoice([(429, {"Retry-After": "3600"})], max_retry_after=1)
+    assert isinstance(result, CryptoPayError) and "Retry-After" in str(result)
+    assert len(calls) == 1
+
+@pytest.mark.parametrize("update", [
+    {"update_id": 1, "update_type": "invoice_paid"},
+    {"update_id": 2, "update_type": "invoice_paid", "payload": {"status": "paid"}},
+    {"update_id": 3, "update_type": "invoice_paid", "payload": "broken"},
+    ["not", "an", "object"],
+])
+def test_webhook_rejects_invoice_paid_without_invoice_id(update):
+    webhook = CryptoPayWebhook(bot=None, token="token")
+    body = json.dumps(update).encode()
+
+    async def scenario():
+        runner, url = await serve(webhook.handle)
+        try:
+            async with aiohttp.ClientSession() as session:
+                headers = {CryptoPayWebhook.SIGNATURE_HEADER: sign_webhook_body(body, "token")}
+                async with session.post(f"{url}/cryptopay", data=body, headers=headers) as response:
+                    return response.status
+        finally:
+            await runner.cleanup()
+
+    assert asyncio.run(scenario()) == 400
@@ -0,0 +1,35 @@
+# tests/test_ratelimit.py
+import asyncio
+import time
+from ratelimit import OutboundLimiter, INTERACTIVE, BACKGROUND
+
+def test_background_is_held_to_its_share_of_the_rate():
+    async def scenario():
+        limiter = OutboundLimiter(rate=100, chat_rate=100, group_rate=100, chat_burst=100, background_rate=10)
+
+        async def send(priority: int, count: int) -> float:
+            started = time.monotonic()
+            for _ in range(count):
+                await limiter.acquire(None, priority)
+            return time.monotonic() - started
+
+        return await asyncio.gather(send(BACKGROUND, 4), send(INTERACTIVE, 4))
+
+    background, interactive = asyncio.run(scenario())
+    assert background >= 0.25  # Всплеск фона - 1 сообщение, дальше 10 в секунду
+    assert interactive < 0.1
+
+def test_retry_after_pauses_background_for_all_chats():
+    async def scenario():
+        limiter = OutboundLimiter(rate=100, chat_rate=100, group_rate=100, chat_burst=100, background_rate=50)
+        limiter.retry_after(1, 0.2)
+        started = time.monotonic()
+        await limiter.acquire(2, BACKGROUND)
+        background = time.monotonic() - started
+        started = time.monotonic()
+        await limiter.acquire(3, INTERACTIVE)
+        return background, time.monotonic() - started
+
+    background, interactive = asyncio.run(scenario())
+    assert background >= 0.15
+    assert interactive < 0.05
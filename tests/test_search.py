@@ -0,0 +1,87 @@
+# tests/test_search.py
+import asyncio
+import pytest
+import db
+
+async def add_product(name: str, desc: str) -> int:
+    async with db.pool.writer() as conn:
+        cursor = await conn.execute(
+            "INSERT INTO products (name, desc, price, category_id, subcategory_id) VALUES (?, ?, 1, 2, 3)",
+            (name, desc)
+        )
+        return cursor.lastrowid
+
+def test_triggers_keep_index_in_sync(run_db):
+    async def scenario():
+        bot_id = await add_product("Телеграм бот", "Готовый скрипт")
+        proxy_id = await add_product("Прокси", "Для телеграм аккаунтов")
+        found = [await db.search_product_ids('"телеграм"', 10)]
+        async with db.pool.writer() as conn:
+            await conn.execute("UPDATE products SET name = 'Парсер чатов' WHERE id = ?", (bot_id,))
+        found.append(await db.search_product_ids('"телеграм"', 10))
+        found.append(await db.search_product_ids('"парсер"', 10))
+        async with db.pool.writer() as conn:
+            await conn.execute("DELETE FROM products WHERE id = ?", (proxy_id,))
+        found.append(await db.search_product_ids('"телеграм"', 10))
+        return bot_id, proxy_id, found
+
+    bot_id, proxy_id, found = run_db(scenario)
+    assert found == [[bot_id, proxy_id], [proxy_id], [bot_id], []]
+
+def test_name_matches_rank_before_description(run_db):
+    async def scenario():
+        in_desc = await add_product("Курс", "Схема арбитраж трафика")
+        in_name = await add_product("Арбитраж трафика", "Пошаговый мануал")
+        return [in_name, in_desc], await db.search_product_ids('"арбитраж"', 10)
+
+    expected, found = run_db(scenario)
+    assert found == expected
+
+@pytest.mark.parametrize("query", ['"теле"*', '"те"*', '"телег"*'])
+def test_prefix_queries(run_db, query):
+    async def scenario():
+        product_id = await add_product("Телеграм бот", "")
+        return product_id, await db.search_product_ids(query, 10)
+
+    product_id, found = run_db(scenario)
+    assert found == [product_id]
+
+async def schema_versions() -> list:
+    async with db.pool.reader() as conn:
+        cursor = await conn.execute("SELECT version FROM schema_version ORDER BY version")
+        return [row[0] for row in await cursor.fetchall()]
+
+def test_index_survives_repeated_init_db(run_db):
+    async def scenario():
+        product_id = await add_product("Телеграм бот", "")
+        await db.init_db()
+        await db.pool.close()  # Перезапуск бота
+        await db.pool.open()
+        await db.init_db()
+        return product_id, await schema_versions(), await db.search_product_ids('"бот"', 10)
+
+    product_id, versions, found = run_db(scenario)
+    assert versions == [version for version, _, _ in db.MIGRATIONS]
+    assert found == [product_id]
+
+def test_fts_migration_reindexes_existing_products(tmp_path, monkeypatch):
+    async def scenario():
+        db.pool.path = str(tmp_path / "old.db")
+        await db.pool.open()
+        try:
+            with monkeypatch.context() as patch:
+                patch.setattr(db, "MIGRATIONS", [migration for migration in db.MIGRATIONS if migration[0] < 9])
+                await db.init_db()
+            product_id = await add_product("Телеграм бот", "Старый товар")
+            await db.init_db()
+            async with db.pool.reader() as conn:
+                cursor = await conn.execute("SELECT sql FROM sqlite_master WHERE name = 'products_fts'")
+                schema = (await cursor.fetchone())[0]
+            return product_id, schema, await schema_versions(), await db.search_product_ids('"теле"*', 10)
+        finally:
+            await db.pool.close()
+
+    product_id, schema, versions, found = asyncio.run(scenario())
+    assert "prefix = '2 3 4'" in schema
+    assert versions[-1] == db.MIGRATIONS[-1][0]
+    assert found == [product_id]
@@ -0,0 +1,21 @@
+# tests/test_storage.py
+import asyncio
+from aiogram.fsm.storage.base import StorageKey
+from storage import SQLiteStorage
+import db
+
+KEY = StorageKey(bot_id=1, chat_id=100, user_id=100)
+
+def test_cancelled_flush_keeps_records_for_close(run_db):
+    async def scenario():
+        storage = SQLiteStorage(cache_size=10, flush_interval=3600)
+        await storage.set_state(KEY, "Search:query")
+        await storage.set_data(KEY, {"page": 2})
+        flush = asyncio.create_task(storage.flush())
+        await asyncio.sleep(0)  # flush ждёт писателя БД
+        flush.cancel()
+        await asyncio.gather(flush, return_exceptions=True)
+        await storage.close()
+        return await db.get_fsm_record((1, 100, 100, 0, "default"))
+
+    assert run_db(scenario) == ("Search:query", '{"page": 2}')
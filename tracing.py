@@ -0,0 +1,161 @@
+# tracing.py
+from logging.handlers import RotatingFileHandler, QueueListener
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from contextlib import contextmanager
+import contextvars
+import json
+import logging
+import os
+import queue
+import random
+import time
+
+class Trace:
+    """Все спаны одного апдейта"""
+    __slots__ = ("trace_id", "update_id", "spans")
+
+    def __init__(self, update_id: int):
+        self.trace_id = os.urandom(8).hex()
+        self.update_id = update_id
+        self.spans = []
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "start", "duration", "attrs", "error")
+
+    def __init__(self, trace: Trace, name: str, parent_id, attrs: dict):
+        self.trace = trace
+        self.span_id = os.urandom(4).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start = time.time()
+        self.duration = None
+        self.attrs = attrs
+        self.error = None
+        trace.spans.append(self)
+
+    def finish(self):
+        self.duration = time.time() - self.start
+
+    def to_json(self) -> str:
+        return json.dumps({
+            "trace_id": self.trace.trace_id,
+            "update_id": self.trace.update_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": round(self.start, 6),
+            "duration_ms": round(self.duration * 1000, 3),
+            "error": self.error,
+            **self.attrs
+        }, ensure_ascii=False, default=str)
+
+_current = contextvars.ContextVar("trace_span", default=None)
+
+def active() -> bool:
+    return _current.get() is not None
+
+@contextmanager
+def span(name: str, **attrs):
+    """Дочерний спан текущего апдейта; вне апдейта ничего не делает"""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = Span(parent.trace, name, parent.span_id, attrs)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        child.error = type(e).__name__
+        raise
+    finally:
+        child.finish()
+        _current.reset(token)
+
+class TracedConnection:
+    """Обёртка соединения aiosqlite: каждый запрос - отдельный спан"""
+    __slots__ = ("_conn",)
+
+    def __init__(self, conn):
+        self._conn = conn
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+    async def execute(self, sql: str, parameters=None):
+        with span("sqlite.execute", sql=" ".join(sql.split())[:200]):
+            return await self._conn.execute(sql, parameters)
+
+    async def executemany(self, sql: str, parameters):
+        with span("sqlite.executemany", sql=" ".join(sql.split())[:200]):
+            return await self._conn.executemany(sql, parameters)
+
+def traced_connection(conn):
+    """Соединение с трассировкой запросов, если идёт трассируемый апдейт"""
+    return TracedConnection(conn) if active() else conn
+
+class TraceExporter:
+    """Запись отобранных трасс в ротируемый JSONL в отдельном потоке.
+
+    Сохраняются все апдейты медленнее slow_ms или с ошибкой и доля sample_rate
+    остальных (решение принимается после завершения апдейта).
+    """
+
+    def __init__(self, path: str, slow_ms: float, sample_rate: float, max_bytes: int, backups: int,
+                 queue_size: int = 10000):
+        self.slow_ms = slow_ms
+        self.sample_rate = sample_rate
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding="utf-8")
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._queue = queue.Queue(queue_size)
+        self._listener = QueueListener(self._queue, handler)
+        self.dropped = 0
+
+    def start(self):
+        self._listener.start()
+
+    def stop(self):
+        self._listener.stop()
+
+    def should_keep(self, root: Span) -> bool:
+        if root.error or root.duration * 1000 >= self.slow_ms:
+            return True
+        return random.random() < self.sample_rate
+
+    def export(self, trace: Trace):
+        for item in trace.spans:
+            if item.duration is None:
+                item.finish()  # Спан фоновой задачи, которая пережила апдейт
+            try:
+                self._queue.put_nowait(logging.makeLogRecord({"msg": item.to_json()}))
+            except queue.Full:
+                self.dropped += 1
+
+class TracingMiddleware(BaseMiddleware):
+    """Внешний middleware на dp.update: корневой спан апдейта"""
+
+    def __init__(self, exporter: TraceExporter):
+        self.exporter = exporter
+
+    async def __call__(self, handler, event, data):
+        trace = Trace(event.update_id)
+        root = Span(trace, "update", None, {"type": event.event_type})
+        token = _current.set(root)
+        try:
+            return await handler(event, data)
+        except BaseException as e:
+            root.error = type(e).__name__
+            raise
+        finally:
+            root.finish()
+            _current.reset(token)
+            if self.exporter.should_keep(root):
+                self.exporter.export(trace)
+
+class TracingRequestMiddleware(BaseRequestMiddleware):
+    """Middleware сессии бота: спан на каждый вызов Bot API"""
+
+    async def __call__(self, make_request, bot, method):
+        with span(f"telegram.{type(method).__name__}", chat_id=getattr(method, "chat_id", None)):
+            return await make_request(bot, method)
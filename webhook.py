@@ -0,0 +1,73 @@
+# webhook.py
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+import asyncio
+import hashlib
+import hmac
+import logging
+
+def default_secret(token: str) -> str:
+    """Секрет вебхука, выводимый из токена: не меняется между перезапусками"""
+    return hashlib.sha256(f"webhook:{token}".encode()).hexdigest()
+
+class TelegramWebhook:
+    """Приём апдейтов Telegram по HTTP с ограниченной очередью обработки.
+
+    Ответ Telegram отдаётся сразу после постановки апдейта в очередь, обработку
+    ведут workers задач. Если очередь заполнена, отвечаем 503 и Telegram
+    повторит доставку позже.
+
+    Бот рассчитан на один процесс: снимок каталога, состояния FSM и подписки
+    кэшируются в памяти без межпроцессной инвалидации, поэтому несколько
+    экземпляров за одним вебхуком разойдутся в данных.
+    """
+
+    SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+    def __init__(self, dp: Dispatcher, bot: Bot, secret: str, queue_size: int, workers: int):
+        self.dp = dp
+        self.bot = bot
+        self.secret = secret
+        self.workers = workers
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self._tasks = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self, timeout: float = 10):
+        """Дообработать принятые апдейты и остановить workers"""
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Telegram webhook: {self.queue.qsize()} updates dropped on shutdown")
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(request.headers.get(self.SECRET_HEADER, ""), self.secret):
+            logging.warning("Telegram webhook: bad secret token")
+            return web.Response(status=401)
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except ValueError:
+            return web.Response(status=400)
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            logging.warning(f"Telegram webhook: queue full, update {update.update_id} deferred")
+            return web.Response(status=503)
+        return web.Response()
+
+    async def _work(self):
+        while True:
+            update = await self.queue.get()
+            try:
+                await self.dp.feed_update(self.bot, update)
+            except Exception as e:
+                logging.error(f"Error handling update {update.update_id}: {e}")
+            finally:
+                self.queue.task_done()